@@ -0,0 +1,85 @@
+# Benchmark: thông lượng /users/login và độ trễ p99 của endpoint khác khi có nhiều login đồng thời
+#
+# Chạy server trước (uvicorn main:app), tạo sẵn 1 tài khoản rồi:
+#   DIAG_TOKEN=... python benchmarks/bench_login.py --email a@b.com --password 123456 --logins 32 --duration 20
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from common import HttpClient, summarize
+
+
+def login_worker(args, stop, latencies, errors):
+    client = HttpClient(args.url)
+    while not stop.is_set():
+        status, _, elapsed = client.request(
+            "POST", "/users/login",
+            form={"username": args.email, "password": args.password}
+        )
+        if status == 200:
+            latencies.append(elapsed)
+        else:
+            errors.append(status)
+    client.close()
+
+
+def probe_worker(args, stop, latencies):
+    # Endpoint nhẹ, không liên quan đến băm mật khẩu
+    client = HttpClient(args.url)
+    while not stop.is_set():
+        _, _, elapsed = client.request("GET", args.probe_path)
+        latencies.append(elapsed)
+        time.sleep(args.probe_interval)
+    client.close()
+
+
+def run_phase(args, logins):
+    stop = threading.Event()
+    login_latencies, probe_latencies, errors = [], [], []
+
+    threads = [threading.Thread(target=login_worker, args=(args, stop, login_latencies, errors)) for _ in range(logins)]
+    threads.append(threading.Thread(target=probe_worker, args=(args, stop, probe_latencies)))
+    for t in threads:
+        t.start()
+    time.sleep(args.duration)
+    stop.set()
+    for t in threads:
+        t.join()
+
+    return {
+        "concurrentLogins": logins,
+        "login": summarize(login_latencies, args.duration),
+        "loginErrors": len(errors),
+        "probe": summarize(probe_latencies)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--email", required=True)
+    parser.add_argument("--password", required=True)
+    parser.add_argument("--logins", type=int, default=16, help="Số luồng login đồng thời")
+    parser.add_argument("--duration", type=float, default=15)
+    parser.add_argument("--probe-path", default="/system/health/live")
+    parser.add_argument("--probe-interval", type=float, default=0.01)
+    args = parser.parse_args()
+
+    # Pha 0: chỉ đo endpoint probe (baseline), pha 1: có login đồng thời
+    results = [run_phase(args, 0), run_phase(args, args.logins)]
+
+    client = HttpClient(args.url)
+    # Trạng thái pool cần token chẩn đoán (DIAG_TOKEN của server)
+    _, pool_stats, _ = client.request("GET", "/system/hash-pool", headers={"X-Diagnostics-Token": os.getenv("DIAG_TOKEN", "")})
+    client.close()
+
+    print(json.dumps({"phases": results, "hashPool": pool_stats}, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
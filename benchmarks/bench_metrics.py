@@ -0,0 +1,148 @@
+# Benchmark: chi phí đo đạc (metrics) trên đường ingest MQTT thật (main.message -> ingest_message -> MongoDB).
+# Chạy cùng 1 lượng message qua handler trong 2 process riêng, METRICS_ENABLED=0 và =1 (xen kẽ nhiều vòng
+# để giảm nhiễu), so sánh thời gian xử lý trung bình mỗi message. Yêu cầu: chênh lệch < --budget % (mặc định 1%).
+# Không cần broker: handler được gọi trực tiếp như fastapi-mqtt gọi khi có message.
+#
+# Dùng DB benchmark đã seed (benchmarks/seed.py), handler ghi thật vào DB này:
+#   python benchmarks/bench_metrics.py --mongo mongodb://127.0.0.1:27017 --db smart_home_bench --messages 20000
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from common import summarize
+
+
+# Chạy trong process con: METRICS_ENABLED đã được đặt qua biến môi trường trước khi import app
+async def run_child(args):
+    import main
+    from database import connect_db, close_db
+    from ingest import start_ingest, stop_ingest
+    from routing import routing
+    from metrics import registry, METRICS_ENABLED
+
+    await connect_db()
+    await start_ingest()
+    rooms = sorted(routing.rooms)[:args.rooms]
+    if not rooms:
+        raise SystemExit("DB chưa có thiết bị, chạy benchmarks/seed.py trước")
+
+    # Xen kẽ message công tắc và cảm biến, mỗi message đổi giá trị để luôn có lần ghi thật
+    messages = []
+    for i in range(args.messages + args.warmup):
+        room = rooms[i % len(rooms)]
+        if i % 2:
+            messages.append((f"{room}/status", json.dumps({"temperature": 20 + i % 15, "humidity": 40 + i % 50}).encode()))
+        else:
+            messages.append((f"{room}/device", json.dumps({"device1": (i // len(rooms)) % 2}).encode()))
+
+    latencies = []
+
+    async def worker(items, record):
+        for topic, payload in items:
+            t = time.perf_counter()
+            await main.message(None, topic, payload, 0, None)
+            if record:
+                latencies.append(time.perf_counter() - t)
+
+    warmup, timed = messages[:args.warmup], messages[args.warmup:]
+    await asyncio.gather(*(worker(warmup[i::args.concurrency], False) for i in range(args.concurrency)))
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(timed[i::args.concurrency], True) for i in range(args.concurrency)))
+    elapsed = time.perf_counter() - started
+
+    result = {
+        "metrics": METRICS_ENABLED,
+        "msgsPerSec": round(len(latencies) / elapsed, 1),
+        "meanUs": round(statistics.fmean(latencies) * 1e6, 1),
+        "latency": summarize(latencies)
+    }
+    if METRICS_ENABLED:
+        t = time.perf_counter()
+        body = registry.render()
+        result["scrapeMs"] = round((time.perf_counter() - t) * 1000, 2)
+        result["scrapeBytes"] = len(body)
+
+    await stop_ingest()
+    await close_db()
+    print(json.dumps(result))
+
+
+def spawn(args, enabled: bool, wal_dir: str):
+    env = {
+        **os.environ,
+        "METRICS_ENABLED": "1" if enabled else "0",
+        "MONGO_URL": args.mongo,
+        "DB_NAME": args.db,
+        "INGEST_WAL_DIR": wal_dir,
+        "LOG_LEVEL": "WARNING",
+        # Không kết nối broker, chỉ cần cấu hình hợp lệ để import app
+        "MQTT_HOST": os.getenv("MQTT_HOST", "127.0.0.1"),
+        "MQTT_PORT": os.getenv("MQTT_PORT", "1883"),
+        "MQTT_TLS": "0"
+    }
+    cmd = [
+        sys.executable, os.path.abspath(__file__), "--child",
+        "--messages", str(args.messages), "--warmup", str(args.warmup),
+        "--concurrency", str(args.concurrency), "--rooms", str(args.rooms)
+    ]
+    out = subprocess.run(cmd, env=env, cwd=ROOT, check=True, capture_output=True, text=True).stdout
+    # Dòng cuối là kết quả (log của app ghi ra stderr)
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mongo", default=os.getenv("MONGO_URL", "mongodb://127.0.0.1:27017"))
+    parser.add_argument("--db", default="smart_home_bench")
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--warmup", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=32, help="Số message xử lý đồng thời (như nhiều message MQTT cùng tới)")
+    parser.add_argument("--rooms", type=int, default=500)
+    parser.add_argument("--rounds", type=int, default=3, help="Số vòng tắt/bật xen kẽ")
+    parser.add_argument("--budget", type=float, default=1.0, help="Chi phí cho phép (%)")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        asyncio.run(run_child(args))
+        return
+
+    # Handler ghi thật vào DB -> chỉ chạy trên DB benchmark
+    if "bench" not in args.db:
+        parser.error("Chỉ chạy trên DB có chữ 'bench' trong tên (handler ghi dữ liệu thật)")
+
+    runs = {False: [], True: []}
+    with tempfile.TemporaryDirectory() as wal_dir:
+        for _ in range(args.rounds):
+            for enabled in (False, True):
+                runs[enabled].append(spawn(args, enabled, wal_dir))
+
+    off = statistics.median(r["meanUs"] for r in runs[False])
+    on = statistics.median(r["meanUs"] for r in runs[True])
+    overhead = (on - off) / off * 100
+    print(json.dumps({
+        "messages": args.messages,
+        "concurrency": args.concurrency,
+        "rounds": args.rounds,
+        "meanUsOff": off,
+        "meanUsOn": on,
+        "overheadPercent": round(overhead, 3),
+        "budgetPercent": args.budget,
+        "withinBudget": overhead < args.budget,
+        "runs": {"off": runs[False], "on": runs[True]}
+    }, indent=2))
+    sys.exit(0 if overhead < args.budget else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+# Benchmark: so khớp luật theo điều kiện cho mỗi message ingest
+#   - "indexed": ConditionEngine (chỉ mục theo phòng/endpoint/trường + ngưỡng đã sắp xếp)
+#   - "linear": duyệt toàn bộ luật, so sánh từng luật (cách làm đơn giản)
+#
+#   python benchmarks/bench_rules.py --rules 100000 --rooms 2000 --messages 20000
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bson import ObjectId
+from conditions import ConditionEngine, OPERATORS
+from common import summarize
+
+FIELDS = ("temperature", "humidity", "light")
+
+
+def make_rules(n, rooms):
+    room_ids = [str(ObjectId()) for _ in range(rooms)]
+    rules = []
+    for _ in range(n):
+        rules.append({
+            "_id": ObjectId(),
+            "houseId": "h",
+            "roomId": random.choice(room_ids),
+            "endpointId": 4,
+            "field": random.choice(FIELDS),
+            "operator": random.choice(list(OPERATORS)),
+            "threshold": float(random.randint(0, 100)),
+            "targetDeviceId": str(ObjectId()),
+            "targetEndpointId": 1,
+            "command": "TURN_ON"
+        })
+    return room_ids, rules
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rules", type=int, default=100000)
+    parser.add_argument("--rooms", type=int, default=2000)
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    room_ids, docs = make_rules(args.rules, args.rooms)
+    messages = [
+        (random.choice(room_ids), random.choice(FIELDS), float(random.randint(0, 100)))
+        for _ in range(args.messages)
+    ]
+
+    engine = ConditionEngine()
+    started = time.perf_counter()
+    engine.set_all(docs)
+    # Biên dịch bucket trước để không tính vào độ trễ message đầu tiên
+    for room_id in room_ids:
+        for field in FIELDS:
+            engine.match(room_id, 4, field, 0.0)
+    compile_seconds = time.perf_counter() - started
+
+    latencies, matched = [], 0
+    started = time.perf_counter()
+    for room_id, field, value in messages:
+        t = time.perf_counter()
+        matched += len(engine.match(room_id, 4, field, value))
+        latencies.append(time.perf_counter() - t)
+    indexed = summarize(latencies, time.perf_counter() - started)
+
+    compiled = list(engine.rules.values())
+
+    def linear_match(room_id, field, value):
+        return [
+            r for r in compiled
+            if r.room_id == room_id and r.endpoint_id == 4 and r.field == field and OPERATORS[r.operator](value, r.threshold)
+        ]
+
+    # Duyệt tuần tự rất chậm, chỉ chạy trên 1 phần message
+    sample = messages[:max(1, min(len(messages), 200))]
+    latencies, linear_matched = [], 0
+    started = time.perf_counter()
+    for room_id, field, value in sample:
+        t = time.perf_counter()
+        linear_matched += len(linear_match(room_id, field, value))
+        latencies.append(time.perf_counter() - t)
+    linear = summarize(latencies, time.perf_counter() - started)
+
+    # Kết quả hai cách phải giống nhau
+    mismatched = sum(
+        1 for room_id, field, value in sample
+        if {r.id for r in engine.match(room_id, 4, field, value)} != {r.id for r in linear_match(room_id, field, value)}
+    )
+
+    print(json.dumps({
+        "rules": len(engine.rules),
+        "keys": len(engine.index),
+        "compileMs": round(compile_seconds * 1000, 1),
+        "avgMatches": round(matched / len(messages), 2),
+        "indexed": indexed,
+        "linear": linear,
+        "speedupP50": round(linear["p50Ms"] / indexed["p50Ms"], 1) if indexed["p50Ms"] else None,
+        "mismatched": mismatched
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+# Benchmark: chi phí serialize danh sách thiết bị (ms / 1000 thiết bị)
+#   - "response_model": validate qua List[Device] rồi dump JSON như FastAPI làm
+#   - "lean": encoder biên dịch sẵn + FastJSONResponse
+#
+#   python benchmarks/bench_serialization.py --devices 1000 --rounds 50
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime
+from typing import List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bson import ObjectId
+from pydantic import TypeAdapter
+from models import Device
+from serializers import FastJSONResponse, encode_device, orjson
+
+
+def make_devices(n, endpoints):
+    now = datetime.now()
+    house_id, room_id = str(ObjectId()), str(ObjectId())
+    return [{
+        "_id": ObjectId(),
+        "houseId": house_id,
+        "roomId": room_id,
+        "name": f"Device {i}",
+        "isOnline": True,
+        "lastSeenAt": now,
+        "createdAt": now,
+        "endpoints": [
+            {"id": e, "name": f"Ep {e}", "type": "SWITCH", "value": i % 2, "lastUpdated": now}
+            for e in range(1, endpoints + 1)
+        ]
+    } for i in range(n)]
+
+
+def bench(fn, docs, rounds):
+    fn(docs)
+    started = time.perf_counter()
+    for _ in range(rounds):
+        fn(docs)
+    return (time.perf_counter() - started) / rounds
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--devices", type=int, default=1000)
+    parser.add_argument("--endpoints", type=int, default=4)
+    parser.add_argument("--rounds", type=int, default=50)
+    args = parser.parse_args()
+
+    docs = make_devices(args.devices, args.endpoints)
+    adapter = TypeAdapter(List[Device])
+
+    # Tương đương serialize_response của FastAPI với response_model
+    def response_model_path(items):
+        validated = adapter.validate_python(items)
+        content = adapter.dump_python(validated, mode="json", by_alias=True)
+        return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode()
+
+    def lean_path(items):
+        return FastJSONResponse([encode_device(d) for d in items]).body
+
+    scale = 1000 / args.devices
+    before = bench(response_model_path, docs, args.rounds) * scale
+    after = bench(lean_path, docs, args.rounds) * scale
+
+    print(json.dumps({
+        "devices": args.devices,
+        "endpointsPerDevice": args.endpoints,
+        "orjson": orjson is not None,
+        "responseModelMsPer1k": round(before * 1000, 3),
+        "leanMsPer1k": round(after * 1000, 3),
+        "speedup": round(before / after, 2)
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
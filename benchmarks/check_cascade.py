@@ -0,0 +1,107 @@
+# Kiểm tra xóa phòng (delete_room_data) trên MongoDB thật, cả 2 đường: xóa trong transaction (API)
+# và xóa nền theo lượt (job). Sau khi xóa: thiết bị, lịch hẹn, luật tự tắt, luật theo điều kiện của phòng
+# phải hết trong DB và change log của nhà phải có tombstone cho từng thứ đã xóa.
+#
+#   MONGO_URL=mongodb://127.0.0.1:27017 DB_NAME=smart_home_bench python benchmarks/check_cascade.py
+import asyncio
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from datetime import datetime, timedelta
+from bson import ObjectId
+from database import db, connect_db, close_db
+from routers.utils import delete_room_data
+
+
+async def seed_room(house_id: str, other_room_id: str):
+    room_id = str(ObjectId())
+    await db.rooms.insert_one({"_id": ObjectId(room_id), "houseId": house_id, "name": "Cascade check", "createdAt": datetime.now()})
+    expected = {"room": {room_id}, "device": set(), "schedule": set(), "auto_off_rule": set(), "condition_rule": set()}
+
+    for i in range(2):
+        device = await db.devices.insert_one({
+            "houseId": house_id,
+            "roomId": room_id,
+            "name": f"Board {i}",
+            "endpoints": [{"id": 1, "name": "Switch", "type": "SWITCH", "value": 0, "lastUpdated": datetime.now()}],
+            "createdAt": datetime.now()
+        })
+        device_id = str(device.inserted_id)
+        expected["device"].add(device_id)
+
+        schedule = await db.schedules.insert_one({
+            "deviceId": device_id, "endpointId": 1, "name": "Check", "enabled": True,
+            "action": json.dumps({"command": "TURN_ON"}), "scheduleType": "DAILY",
+            "nextRunAt": datetime.now() + timedelta(days=1), "timezone": "Asia/Ho_Chi_Minh"
+        })
+        expected["schedule"].add(str(schedule.inserted_id))
+
+        await db.auto_off_rules.insert_one({"deviceId": device_id, "endpointId": 1, "durationSec": 60, "enabled": True})
+        expected["auto_off_rule"].add(f"{device_id}:1")
+
+        # Luật trong phòng điều khiển thiết bị của phòng (khớp cả roomId lẫn targetDeviceId -> chỉ 1 tombstone)
+        # và luật ở phòng khác điều khiển thiết bị của phòng
+        for rule_room in (room_id, other_room_id):
+            rule = await db.condition_rules.insert_one({
+                "houseId": house_id, "roomId": rule_room, "endpointId": 4, "field": "temperature",
+                "operator": "GT", "threshold": 30, "targetDeviceId": device_id, "targetEndpointId": 1,
+                "command": "TURN_ON", "payload": None, "cooldownSec": 60, "enabled": True, "lastFiredAt": None
+            })
+            expected["condition_rule"].add(str(rule.inserted_id))
+
+    return room_id, expected
+
+
+async def check(house_id: str, room_id: str, expected: dict, job: dict = None):
+    since = (await db.houses.find_one({"_id": ObjectId(house_id)}, {"version": 1})).get("version", 0)
+    await delete_room_data(room_id, house_id, job)
+
+    device_ids = list(expected["device"])
+    left = {
+        "rooms": await db.rooms.count_documents({"_id": ObjectId(room_id)}),
+        "devices": await db.devices.count_documents({"roomId": room_id}),
+        "schedules": await db.schedules.count_documents({"deviceId": {"$in": device_ids}}),
+        "auto_off_rules": await db.auto_off_rules.count_documents({"deviceId": {"$in": device_ids}}),
+        "condition_rules": await db.condition_rules.count_documents({"_id": {"$in": [ObjectId(r) for r in expected["condition_rule"]]}})
+    }
+
+    entries = await db.house_changes.find({"houseId": house_id, "seq": {"$gt": since}, "op": "delete"}).to_list(length=None)
+    recorded = {}
+    for e in entries:
+        recorded.setdefault(e["entity"], []).append(e["entityId"])
+    tombstones = {
+        entity: sorted(recorded.get(entity, [])) == sorted(ids)
+        for entity, ids in expected.items()
+    }
+    return {"leftInDb": left, "tombstonesMatch": tombstones, "ok": not any(left.values()) and all(tombstones.values())}
+
+
+async def main():
+    await connect_db()
+    house_id = str(ObjectId())
+    other_room_id = str(ObjectId())
+    await db.houses.insert_one({"_id": ObjectId(house_id), "name": "Cascade check", "ownerId": str(ObjectId()), "version": 0, "createdAt": datetime.now()})
+
+    results = {}
+    try:
+        room_id, expected = await seed_room(house_id, other_room_id)
+        results["transaction"] = await check(house_id, room_id, expected)
+
+        room_id, expected = await seed_room(house_id, other_room_id)
+        job = {"totalDevices": 0, "deletedDevices": 0}
+        results["job"] = await check(house_id, room_id, expected, job)
+        results["job"]["deletedDevices"] = job["deletedDevices"]
+    finally:
+        await db.house_changes.delete_many({"houseId": house_id})
+        await db.houses.delete_one({"_id": ObjectId(house_id)})
+        await close_db()
+
+    print(json.dumps(results, indent=2))
+    sys.exit(0 if all(r["ok"] for r in results.values()) else 1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
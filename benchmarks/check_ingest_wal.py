@@ -0,0 +1,160 @@
+# Kiểm tra WAL của ingest bằng cách làm MongoDB ngừng hoạt động giữa chừng:
+# gửi liên tục message "{room}/device" + "{room}/status" vào ingest (không qua broker),
+# chạy --kill-cmd, gửi tiếp, chạy --start-cmd, chờ WAL replay xong rồi so giá trị cuối cùng trong DB
+# với giá trị cuối cùng đã gửi của từng endpoint.
+# Mặc định gửi nhanh hơn INGEST_WAL_REPLAY_RATE: WAL phải replay hết trong lúc vẫn đang gửi
+# (message mới ghi thẳng vào DB, không xếp hàng sau WAL)
+#
+#   python benchmarks/check_ingest_wal.py --kill-cmd "docker stop mongo" --start-cmd "docker start mongo"
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# WAL riêng cho lần kiểm tra này
+os.environ.setdefault("INGEST_WAL_DIR", tempfile.mkdtemp(prefix="ingest-wal-"))
+
+from datetime import datetime
+from bson import ObjectId
+from database import db, connect_db, close_db
+from ingest import ingest_message, start_ingest, stop_ingest, ingest_stats, SENSOR_ENDPOINT_ID
+from wal import wal, INGEST_WAL_REPLAY_RATE
+
+
+async def seed(rooms):
+    house_id = str(ObjectId())
+    await db.houses.insert_one({"_id": ObjectId(house_id), "name": "WAL check", "ownerId": str(ObjectId()), "createdAt": datetime.now()})
+    room_ids = []
+    for i in range(rooms):
+        room_id = str(ObjectId())
+        room_ids.append(room_id)
+        await db.devices.insert_one({
+            "houseId": house_id,
+            "roomId": room_id,
+            "name": f"Board {i}",
+            "isOnline": False,
+            "createdAt": datetime.now(),
+            "endpoints": [{"id": e, "name": f"Ep {e}", "type": "SWITCH", "value": 0} for e in range(1, SENSOR_ENDPOINT_ID + 1)]
+        })
+    return house_id, room_ids
+
+
+async def cleanup(house_id):
+    await db.devices.delete_many({"houseId": house_id})
+    await db.house_changes.delete_many({"houseId": house_id})
+    await db.houses.delete_one({"_id": ObjectId(house_id)})
+
+
+def run_cmd(cmd):
+    print(f"$ {cmd}", file=sys.stderr)
+    subprocess.run(cmd, shell=True, check=False)
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rooms", type=int, default=20)
+    parser.add_argument("--rate", type=float, default=1000, help="message/giây")
+    parser.add_argument("--duration", type=float, default=60, help="giây gửi message")
+    parser.add_argument("--kill-at", type=float, default=5)
+    parser.add_argument("--start-at", type=float, default=20)
+    parser.add_argument("--kill-cmd", required=True)
+    parser.add_argument("--start-cmd", required=True)
+    parser.add_argument("--drain-timeout", type=float, default=300)
+    args = parser.parse_args()
+
+    await connect_db()
+    house_id, room_ids = await seed(args.rooms)
+    await start_ingest()
+
+    # (roomId, endpointId) -> giá trị cuối cùng đã gửi
+    expected = {}
+    sent = 0
+    killed = started = False
+    # Thời điểm WAL replay hết khi vẫn đang gửi (tính từ lúc chạy --start-cmd)
+    started_at = drained_under_load = None
+    ok = False
+    begin = time.monotonic()
+    try:
+        while (elapsed := time.monotonic() - begin) < args.duration:
+            if not killed and elapsed >= args.kill_at:
+                await asyncio.to_thread(run_cmd, args.kill_cmd)
+                killed = True
+            if killed and not started and elapsed >= args.start_at:
+                await asyncio.to_thread(run_cmd, args.start_cmd)
+                started = True
+                started_at = time.monotonic()
+            if started and drained_under_load is None and wal.appended and not wal.active:
+                drained_under_load = round(time.monotonic() - started_at, 1)
+
+            room_id = room_ids[sent % len(room_ids)]
+            sent += 1
+            if sent % 4:
+                ep = sent % 3 + 1
+                asyncio.create_task(ingest_message(f"{room_id}/device", json.dumps({f"device{ep}": sent})))
+            else:
+                ep = SENSOR_ENDPOINT_ID
+                asyncio.create_task(ingest_message(f"{room_id}/status", json.dumps({"t": sent})))
+            expected[(room_id, ep)] = sent
+            # Gửi theo lịch (không cộng dồn thời gian xử lý) để giữ đúng tốc độ --rate
+            delay = begin + sent / args.rate - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            elif sent % 100 == 0:
+                await asyncio.sleep(0)
+
+        if not started:
+            await asyncio.to_thread(run_cmd, args.start_cmd)
+
+        # Chờ các lần ghi đang chạy kết thúc và WAL replay hết
+        deadline = time.monotonic() + args.drain_timeout
+        while time.monotonic() < deadline:
+            stats = ingest_stats()
+            if not stats["inflight"] and not wal.active:
+                break
+            await asyncio.sleep(0.5)
+
+        stats = ingest_stats()
+        mismatched = []
+        async for device in db.devices.find({"houseId": house_id}):
+            for ep in device["endpoints"]:
+                want = expected.get((device["roomId"], ep["id"]))
+                if want is None:
+                    continue
+                got = ep["value"]["t"] if isinstance(ep["value"], dict) else ep["value"]
+                if got != want:
+                    mismatched.append({"roomId": device["roomId"], "endpointId": ep["id"], "expected": want, "got": got})
+
+        # Gửi nhanh hơn tốc độ replay mà WAL vẫn phải hết trước khi ngừng gửi
+        above_replay_rate = bool(INGEST_WAL_REPLAY_RATE) and args.rate > INGEST_WAL_REPLAY_RATE
+        print(json.dumps({
+            "sent": sent,
+            "rate": args.rate,
+            "actualRate": round(sent / args.duration, 1),
+            "replayRate": INGEST_WAL_REPLAY_RATE,
+            "drainedUnderLoadSeconds": drained_under_load,
+            "walAppended": stats["wal"]["appended"],
+            "walReplayed": stats["wal"]["replayed"],
+            "walDropped": stats["wal"]["dropped"],
+            "drained": not wal.active,
+            "mismatched": len(mismatched),
+            "examples": mismatched[:10]
+        }, indent=2))
+        ok = not mismatched and not wal.active and stats["wal"]["dropped"] == 0
+        if above_replay_rate and started_at is not None:
+            ok = ok and drained_under_load is not None
+    finally:
+        await stop_ingest()
+        await cleanup(house_id)
+        await close_db()
+
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,72 @@
+# Kiểm tra bus hủy cache qua change stream trên MongoDB replica set 1 node:
+#   mongod --replSet rs0 --dbpath ./data   (lần đầu: mongosh --eval "rs.initiate()")
+#   MONGO_URL="mongodb://localhost:27017/?replicaSet=rs0" python benchmarks/check_invalidation.py
+#
+# Các bước: ghi vào home_members -> handler nhận insert/update/delete (delete có document cũ);
+# dừng bus, ghi tiếp khi đang dừng, chạy lại bus -> sự kiện bị lỡ phải được nhận nhờ resume token
+import asyncio
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bson import ObjectId
+from database import db, connect_db, close_db
+from invalidation import bus
+
+
+async def wait_for(received, predicate, timeout=10):
+    for _ in range(int(timeout * 10)):
+        if any(predicate(e) for e in received):
+            return True
+        await asyncio.sleep(0.1)
+    return False
+
+
+async def main():
+    await connect_db()
+    house_id = str(ObjectId())
+    received = []
+    bus.on("home_members")(received.append)
+
+    results = {}
+    try:
+        await bus.start()
+        # Chờ change stream mở xong
+        await asyncio.sleep(2)
+
+        member = {"houseId": house_id, "userId": str(ObjectId()), "role": "MEMBER", "status": "ACCEPTED"}
+        inserted = await db.home_members.insert_one(member)
+        member_id = str(inserted.inserted_id)
+        await db.home_members.update_one({"_id": inserted.inserted_id}, {"$set": {"role": "ADMIN"}})
+        await db.home_members.delete_one({"_id": inserted.inserted_id})
+
+        def is_event(op):
+            return lambda e: e.id == member_id and e.op == op
+
+        results["insert"] = await wait_for(received, is_event("insert"))
+        results["update"] = await wait_for(received, is_event("update"))
+        results["delete"] = await wait_for(received, is_event("delete"))
+        delete_event = next((e for e in received if is_event("delete")(e)), None)
+        results["deleteHasPreImage"] = bool(delete_event and delete_event.doc and delete_event.doc.get("houseId") == house_id)
+
+        # Resume sau khi khởi động lại
+        await bus.stop()
+        missed = await db.home_members.insert_one({**member, "userId": str(ObjectId())})
+        await db.home_members.delete_one({"_id": missed.inserted_id})
+        await bus.start()
+        results["resumed"] = await wait_for(received, lambda e: e.id == str(missed.inserted_id) and e.op == "insert")
+        results["stats"] = bus.stats()
+    finally:
+        await bus.stop()
+        await db.home_members.delete_many({"houseId": house_id})
+        await close_db()
+
+    print(json.dumps(results, indent=2))
+    ok = all(results[k] for k in ("insert", "update", "delete", "resumed"))
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,96 @@
+import http.client
+import json
+import time
+from urllib.parse import urlencode, urlsplit
+
+
+# Tính phân vị (p trong khoảng 0-100) của danh sách đã sắp xếp
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    k = (len(sorted_values) - 1) * p / 100
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+# Tổng hợp độ trễ (giây) thành các chỉ số hiển thị theo ms
+def summarize(latencies, duration=None):
+    values = sorted(latencies)
+    result = {
+        "count": len(values),
+        "p50Ms": round(percentile(values, 50) * 1000, 2),
+        "p90Ms": round(percentile(values, 90) * 1000, 2),
+        "p99Ms": round(percentile(values, 99) * 1000, 2),
+        "maxMs": round((values[-1] if values else 0) * 1000, 2)
+    }
+    if duration:
+        result["throughput"] = round(len(values) / duration, 2)
+    return result
+
+
+# HTTP client tối giản (giữ kết nối keep-alive), mỗi luồng dùng 1 instance
+class HttpClient:
+    def __init__(self, base_url, timeout=30):
+        parts = urlsplit(base_url)
+        self.host = parts.hostname
+        self.port = parts.port or (443 if parts.scheme == "https" else 80)
+        self.https = parts.scheme == "https"
+        self.timeout = timeout
+        self.token = None
+        self._conn = None
+
+    def _connect(self):
+        if self._conn is None:
+            cls = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+            self._conn = cls(self.host, self.port, timeout=self.timeout)
+        return self._conn
+
+    def request(self, method, path, body=None, form=None, params=None, headers=None):
+        headers = dict(headers or {})
+        if self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+        if params:
+            path = f"{path}?{urlencode(params)}"
+
+        data = None
+        if form is not None:
+            data = urlencode(form)
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+        elif body is not None:
+            data = json.dumps(body)
+            headers["Content-Type"] = "application/json"
+
+        started = time.perf_counter()
+        for attempt in range(2):
+            conn = self._connect()
+            try:
+                conn.request(method, path, body=data, headers=headers)
+                resp = conn.getresponse()
+                raw = resp.read()
+                break
+            except (http.client.HTTPException, ConnectionError):
+                # Server đóng kết nối keep-alive -> mở lại 1 lần
+                conn.close()
+                self._conn = None
+                if attempt:
+                    raise
+        elapsed = time.perf_counter() - started
+
+        try:
+            payload = json.loads(raw) if raw else None
+        except ValueError:
+            payload = raw
+        return resp.status, payload, elapsed
+
+    def login(self, email, password):
+        status, payload, _ = self.request("POST", "/users/login", form={"username": email, "password": password})
+        if status != 200:
+            raise RuntimeError(f"Đăng nhập thất bại ({status}): {payload}")
+        self.token = payload["access_token"]
+        return payload
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
@@ -0,0 +1,300 @@
+# Load test REST API trên dữ liệu tạo bởi seed.py: nhiều luồng, mỗi luồng là 1 chủ nhà gửi request theo tỉ lệ của mix
+# (xem danh sách, điều khiển thiết bị, lịch sử, quản lý thành viên). Báo cáo thông lượng + p50/p90/p99 theo từng endpoint,
+# lưu kết quả làm baseline và so sánh với baseline của commit trước.
+#
+#   python benchmarks/seed.py --drop
+#   DB_NAME=smart_home_bench uvicorn main:app --workers 1
+#   python benchmarks/loadtest.py --mix mixed --concurrency 32 --duration 60 --save benchmarks/baselines/main.json
+#   python benchmarks/loadtest.py --mix mixed --concurrency 32 --duration 60 --baseline benchmarks/baselines/main.json
+#   python benchmarks/loadtest.py --diff benchmarks/baselines/main.json benchmarks/results/latest.json
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from common import HttpClient, summarize
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Tỉ lệ các thao tác trong mỗi mix
+MIXES = {
+    # App mở lên, xem danh sách
+    "browse": {
+        "houses.list": 15, "houses.snapshot": 10, "rooms.list": 15, "devices.house": 20, "devices.room": 15,
+        "members.list": 10, "invitations.count": 5, "schedules.list": 5, "houses.changes": 5
+    },
+    # Bật / tắt thiết bị liên tục
+    "control": {
+        "devices.command": 50, "devices.history": 20, "devices.house": 10, "houses.changes": 15, "devices.usage": 5
+    },
+    "mixed": {
+        "houses.list": 8, "houses.snapshot": 6, "rooms.list": 8, "devices.house": 12, "devices.room": 8,
+        "members.list": 6, "invitations.count": 4, "schedules.list": 4, "houses.changes": 8,
+        "devices.command": 20, "devices.history": 10, "devices.usage": 4, "members.churn": 2
+    }
+}
+
+
+class Worker:
+    def __init__(self, url, house, token, spare_token, rng):
+        self.client = HttpClient(url)
+        self.client.token = token
+        self.spare = None
+        if spare_token:
+            self.spare = HttpClient(url)
+            self.spare.token = spare_token
+        self.house = house
+        self.rng = rng
+
+    def device(self):
+        return self.rng.choice(self.house["devices"])
+
+    def room(self):
+        return self.rng.choice(self.house["rooms"])
+
+    def close(self):
+        self.client.close()
+        if self.spare:
+            self.spare.close()
+
+
+# Mỗi thao tác trả về danh sách (nhãn, status, thời gian)
+def single(label, method, path, body=None, params=None):
+    def run(w):
+        status, _, elapsed = w.client.request(method, path(w), body=body(w) if body else None, params=params)
+        return [(label, status, elapsed)]
+    return run
+
+
+# Mời user dự bị -> user đó chấp nhận -> đổi role -> xóa khỏi nhà (nhà chỉ thuộc 1 luồng nên không tranh chấp)
+def membership_churn(w):
+    if w.spare is None:
+        return []
+    house_id = w.house["houseId"]
+    results = []
+
+    status, _, elapsed = w.client.request("POST", "/members/invite", body={"houseId": house_id, "email": w.house["spare"], "role": "MEMBER"})
+    results.append(("POST /members/invite", status, elapsed))
+    if status != 201:
+        return results
+
+    status, invites, elapsed = w.spare.request("GET", "/members/invitations")
+    results.append(("GET /members/invitations", status, elapsed))
+    member_id = next((i["_id"] for i in invites or [] if i.get("houseId") == house_id), None) if status == 200 else None
+    if member_id is None:
+        return results
+
+    for label, client, method, path, body in (
+        ("PUT /members/invitations/{member_id}/accept", w.spare, "PUT", f"/members/invitations/{member_id}/accept", None),
+        ("PUT /members/{member_id}/role", w.client, "PUT", f"/members/{member_id}/role", {"houseId": house_id, "role": "ADMIN"}),
+        ("DELETE /members/{member_id}", w.client, "DELETE", f"/members/{member_id}", None)
+    ):
+        status, _, elapsed = client.request(method, path, body=body)
+        results.append((label, status, elapsed))
+        if status >= 400:
+            break
+    return results
+
+
+def command_body(w):
+    return {"endpointId": w.rng.choice((1, 2, 3)), "command": w.rng.choice(("TURN_ON", "TURN_OFF"))}
+
+
+OPERATIONS = {
+    "houses.list": single("GET /houses/", "GET", lambda w: "/houses/"),
+    "houses.snapshot": single("GET /houses/{house_id}/snapshot", "GET", lambda w: f"/houses/{w.house['houseId']}/snapshot"),
+    "houses.changes": single("GET /houses/{house_id}/changes", "GET", lambda w: f"/houses/{w.house['houseId']}/changes"),
+    "rooms.list": single("GET /rooms/{house_id}", "GET", lambda w: f"/rooms/{w.house['houseId']}"),
+    "devices.house": single("GET /devices/house/{house_id}", "GET", lambda w: f"/devices/house/{w.house['houseId']}"),
+    "devices.room": single("GET /devices/room/{room_id}", "GET", lambda w: f"/devices/room/{w.room()}"),
+    "devices.command": single("POST /devices/{device_id}/command", "POST", lambda w: f"/devices/{w.device()}/command", body=command_body),
+    "devices.history": single("GET /devices/{device_id}/history", "GET", lambda w: f"/devices/{w.device()}/history", params={"limit": 20}),
+    "devices.usage": single("GET /devices/{device_id}/usage", "GET", lambda w: f"/devices/{w.device()}/usage"),
+    "members.list": single("GET /members/{house_id}", "GET", lambda w: f"/members/{w.house['houseId']}"),
+    "invitations.count": single("GET /members/invitations/count", "GET", lambda w: "/members/invitations/count"),
+    "schedules.list": single("GET /automations/schedules/{device_id}", "GET", lambda w: f"/automations/schedules/{w.device()}"),
+    "members.churn": membership_churn
+}
+
+
+def login_all(url, emails, password, parallel):
+    def login(email):
+        client = HttpClient(url)
+        try:
+            return email, client.login(email, password)["access_token"]
+        finally:
+            client.close()
+
+    with ThreadPoolExecutor(parallel) as pool:
+        return dict(pool.map(login, emails))
+
+
+def run(args, manifest):
+    mix = MIXES[args.mix]
+    names, weights = list(mix), list(mix.values())
+    houses = manifest["houses"][:args.concurrency]
+    if len(houses) < args.concurrency:
+        print(f"Chỉ có {len(houses)} nhà, giảm concurrency xuống {len(houses)}", file=sys.stderr)
+
+    emails = {h["owner"] for h in houses}
+    if "members.churn" in mix:
+        emails |= {h["spare"] for h in houses if h["spare"]}
+    tokens = login_all(args.url, sorted(emails), manifest["password"], args.login_parallel)
+
+    workers = [
+        Worker(args.url, h, tokens[h["owner"]], tokens.get(h["spare"]) if "members.churn" in mix else None, random.Random(args.seed + i))
+        for i, h in enumerate(houses)
+    ]
+
+    lock = threading.Lock()
+    latencies, statuses = {}, {}
+    measuring = threading.Event()
+    stop = threading.Event()
+
+    def loop(w):
+        while not stop.is_set():
+            op = w.rng.choices(names, weights)[0]
+            try:
+                results = OPERATIONS[op](w)
+            except Exception as e:
+                results = [(op, type(e).__name__, 0.0)]
+            if measuring.is_set():
+                with lock:
+                    for label, status, elapsed in results:
+                        latencies.setdefault(label, []).append(elapsed)
+                        counts = statuses.setdefault(label, {})
+                        counts[str(status)] = counts.get(str(status), 0) + 1
+            if args.think_ms:
+                time.sleep(args.think_ms / 1000)
+
+    threads = [threading.Thread(target=loop, args=(w,)) for w in workers]
+    for t in threads:
+        t.start()
+    time.sleep(args.warmup)
+    measuring.set()
+    started = time.perf_counter()
+    time.sleep(args.duration)
+    measuring.clear()
+    elapsed = time.perf_counter() - started
+    stop.set()
+    for t in threads:
+        t.join()
+    for w in workers:
+        w.close()
+
+    endpoints = {}
+    for label in sorted(latencies):
+        ok = sum(n for s, n in statuses[label].items() if s.isdigit() and int(s) < 400)
+        endpoints[label] = {**summarize(latencies[label], elapsed), "statuses": statuses[label], "errorRate": round(1 - ok / len(latencies[label]), 4)}
+
+    total = sum(len(v) for v in latencies.values())
+    return {
+        "commit": git_commit(),
+        "at": datetime.now().isoformat(timespec="seconds"),
+        "config": {
+            "mix": args.mix, "concurrency": len(workers), "duration": args.duration,
+            "warmup": args.warmup, "thinkMs": args.think_ms, "seed": args.seed, "data": manifest.get("config")
+        },
+        "total": {"requests": total, "throughput": round(total / elapsed, 2)},
+        "endpoints": endpoints
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=HERE, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def pct_change(before, after):
+    return round((after - before) / before * 100, 1) if before else None
+
+
+# So sánh 2 kết quả: độ trễ tăng / thông lượng giảm quá threshold% được đánh dấu là chậm đi
+def diff(before, after, threshold):
+    rows, regressions = [], []
+    for label in sorted(set(before["endpoints"]) | set(after["endpoints"])):
+        a, b = before["endpoints"].get(label), after["endpoints"].get(label)
+        if not a or not b:
+            rows.append({"endpoint": label, "note": "chỉ có ở 1 bên"})
+            continue
+        row = {
+            "endpoint": label,
+            "p50Ms": [a["p50Ms"], b["p50Ms"], pct_change(a["p50Ms"], b["p50Ms"])],
+            "p99Ms": [a["p99Ms"], b["p99Ms"], pct_change(a["p99Ms"], b["p99Ms"])],
+            "throughput": [a.get("throughput"), b.get("throughput"), pct_change(a.get("throughput"), b.get("throughput"))],
+            "errorRate": [a["errorRate"], b["errorRate"]]
+        }
+        worse = (
+            (row["p50Ms"][2] or 0) > threshold
+            or (row["p99Ms"][2] or 0) > threshold
+            or -(row["throughput"][2] or 0) > threshold
+            or b["errorRate"] > a["errorRate"] + 0.01
+        )
+        if worse:
+            regressions.append(label)
+        rows.append(row)
+
+    return {
+        "before": {"commit": before.get("commit"), "at": before.get("at"), "throughput": before["total"]["throughput"]},
+        "after": {"commit": after.get("commit"), "at": after.get("at"), "throughput": after["total"]["throughput"]},
+        "thresholdPercent": threshold,
+        "endpoints": rows,
+        "regressions": regressions
+    }
+
+
+def load(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save(path, data):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--manifest", default=os.path.join(HERE, "results", "seed-manifest.json"))
+    parser.add_argument("--mix", choices=sorted(MIXES), default="mixed")
+    parser.add_argument("--concurrency", type=int, default=16, help="Số luồng, mỗi luồng dùng 1 nhà khác nhau")
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--warmup", type=float, default=5, help="Bỏ qua n giây đầu (cache, pool kết nối)")
+    parser.add_argument("--think-ms", type=float, default=0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--login-parallel", type=int, default=8)
+    parser.add_argument("--save", default=os.path.join(HERE, "results", "latest.json"), help="Nơi lưu kết quả lần chạy này")
+    parser.add_argument("--baseline", help="So sánh kết quả với baseline này")
+    parser.add_argument("--threshold", type=float, default=10, help="Chậm đi quá n%% thì coi là regression")
+    parser.add_argument("--diff", nargs=2, metavar=("BEFORE", "AFTER"), help="Chỉ so sánh 2 file kết quả, không chạy load test")
+    args = parser.parse_args()
+
+    if args.diff:
+        report = diff(load(args.diff[0]), load(args.diff[1]), args.threshold)
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+        sys.exit(1 if report["regressions"] else 0)
+
+    result = run(args, load(args.manifest))
+    save(args.save, result)
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+
+    if args.baseline:
+        report = diff(load(args.baseline), result, args.threshold)
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+        sys.exit(1 if report["regressions"] else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,360 @@
+# Giả lập đội thiết bị MQTT để đo ingest end-to-end (broker -> main.message -> MongoDB):
+#   - mỗi phòng trong manifest của seed.py là 1 board ảo, gửi "{room}/device" (trạng thái công tắc) và "{room}/status" (cảm biến)
+#     theo tốc độ và kiểu tải cấu hình được (steady / burst / ramp)
+#   - độ trễ ingest: message cảm biến mang thời điểm gửi, đọc lại từ change stream của collection devices (cần replica set)
+#   - độ trễ lệnh -> thiết bị: gọi POST /devices/{id}/command và tạo lịch hẹn ONCE, đo lúc board ảo nhận "{room}/device"
+#   - số lần ghi MongoDB: chênh lệch opcounters của serverStatus trong lúc chạy
+#
+# Server và simulator dùng chung broker local (vd mosquitto, không TLS -> server chạy với MQTT_TLS=0):
+#   python benchmarks/seed.py --drop --users 500 --rooms-per-house 4
+#   DB_NAME=smart_home_bench MQTT_HOST=127.0.0.1 MQTT_PORT=1883 MQTT_TLS=0 uvicorn main:app
+#   python benchmarks/mqtt_fleet.py --devices 2000 --rate 0.5 --pattern burst --duration 60 --commands 200 --schedules 5
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from gmqtt import Client as MQTTClient
+from motor.motor_asyncio import AsyncIOMotorClient
+from common import HttpClient, summarize
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# Field thêm vào payload để phân biệt message do simulator gửi với lệnh từ server (server bỏ qua field không phải deviceN)
+SIM_MARKER = "_sim"
+
+
+class Stats:
+    def __init__(self):
+        self.published = {"device": 0, "status": 0}
+        self.ingest_lag = []
+        self.ingested = 0
+        self.command_latency = []
+        self.command_timeouts = 0
+        self.schedule_lateness = []
+        self.schedule_missed = 0
+        self.echoed = 0
+
+
+class Fleet:
+    def __init__(self, args, rooms, stats):
+        self.args = args
+        self.rooms = rooms
+        self.stats = stats
+        self.clients = []
+        # roomId -> client của board ảo
+        self.room_client = {}
+        # roomId -> Future chờ lệnh tiếp theo (đo độ trễ lệnh)
+        self.waiters = {}
+        self.seq = 0
+
+    def _on_message(self, client, topic, payload, qos, properties):
+        room_id, _, kind = topic.partition("/")
+        if kind != "device":
+            return 0
+        try:
+            data = json.loads(payload)
+        except ValueError:
+            return 0
+        if not isinstance(data, dict) or SIM_MARKER in data:
+            return 0
+
+        waiter = self.waiters.pop(room_id, None)
+        if waiter is not None and not waiter.done():
+            waiter.set_result(time.perf_counter())
+
+        if self.args.echo:
+            # Board thật báo lại trạng thái sau khi thực hiện lệnh
+            self.publish_device(room_id, {k: v for k, v in data.items() if k.startswith("device")})
+            self.stats.echoed += 1
+        return 0
+
+    async def connect(self):
+        n = max(1, min(self.args.connections, len(self.rooms)))
+        for i in range(n):
+            client = MQTTClient(f"fleet-{os.getpid()}-{i}")
+            if self.args.username:
+                client.set_auth_credentials(self.args.username, self.args.password)
+            client.on_message = self._on_message
+            await client.connect(self.args.broker, self.args.port, ssl=self.args.tls, keepalive=60)
+            self.clients.append(client)
+
+        for i, room_id in enumerate(self.rooms):
+            client = self.clients[i % n]
+            self.room_client[room_id] = client
+            client.subscribe(f"{room_id}/device", qos=0)
+
+    async def disconnect(self):
+        await asyncio.gather(*(c.disconnect() for c in self.clients), return_exceptions=True)
+
+    def publish_device(self, room_id, states):
+        payload = {**states, SIM_MARKER: 1}
+        self.room_client[room_id].publish(f"{room_id}/device", json.dumps(payload), qos=self.args.qos)
+        self.stats.published["device"] += 1
+
+    def publish_status(self, room_id, rng):
+        self.seq += 1
+        payload = {
+            "temperature": round(rng.uniform(20, 35), 1),
+            "humidity": rng.randint(40, 90),
+            # Thời điểm gửi (epoch) để đo độ trễ ingest
+            "sentAt": time.time(),
+            "seq": self.seq
+        }
+        self.room_client[room_id].publish(f"{room_id}/status", json.dumps(payload), qos=self.args.qos)
+        self.stats.published["status"] += 1
+
+    # Tốc độ gửi của 1 board tại thời điểm t (giây kể từ lúc bắt đầu)
+    def rate_at(self, t):
+        args = self.args
+        if args.pattern == "ramp":
+            return args.rate * min(1.0, (t + 1) / max(1.0, args.ramp_seconds))
+        if args.pattern == "burst":
+            # Mỗi burst_period giây có burst_seconds giây tải gấp burst_factor lần
+            in_burst = (t % args.burst_period) < args.burst_seconds
+            return args.rate * (args.burst_factor if in_burst else 1.0)
+        return args.rate
+
+    async def run_device(self, room_id, deadline, started, rng):
+        # Lệch pha giữa các board để không gửi cùng lúc
+        await asyncio.sleep(rng.uniform(0, 1 / max(self.args.rate, 0.01)))
+        while time.perf_counter() < deadline:
+            if rng.random() < self.args.status_ratio:
+                self.publish_status(room_id, rng)
+            else:
+                self.publish_device(room_id, {f"device{e}": rng.randint(0, 1) for e in (1, 2, 3)})
+            rate = self.rate_at(time.perf_counter() - started)
+            # Khoảng cách giữa 2 message theo phân phối mũ (Poisson)
+            await asyncio.sleep(rng.expovariate(rate) if rate > 0 else 1)
+
+
+# Đọc các lần ghi endpoint cảm biến từ change stream, độ trễ = lúc thấy thay đổi - sentAt trong payload
+async def watch_ingest(db, stats, stop):
+    pipeline = [{"$match": {"operationType": "update"}}]
+    try:
+        async with db.devices.watch(pipeline, max_await_time_ms=500) as stream:
+            while not stop.is_set():
+                change = await stream.try_next()
+                if change is None:
+                    continue
+                now = time.time()
+                # Tùy phiên bản MongoDB, updatedFields có thể là cả "endpoints.N.value" hoặc từng field con
+                for field, value in change["updateDescription"]["updatedFields"].items():
+                    if field.endswith(".value") and isinstance(value, dict) and "sentAt" in value:
+                        stats.ingest_lag.append(now - value["sentAt"])
+                    elif field.endswith(".value.sentAt") and isinstance(value, (int, float)):
+                        stats.ingest_lag.append(now - value)
+                stats.ingested += 1
+    except Exception as e:
+        print(f"Không đọc được change stream (cần replica set), bỏ qua độ trễ ingest: {e}", file=sys.stderr)
+
+
+async def opcounters(db):
+    status = await db.client.admin.command("serverStatus")
+    return dict(status["opcounters"])
+
+
+# Gửi lệnh qua API lần lượt theo từng phòng, đo tới lúc board ảo nhận được lệnh
+async def probe_commands(args, fleet, http, devices, stats, deadline):
+    interval = 1 / args.command_rate
+    rng = random.Random(args.seed + 1)
+    loop = asyncio.get_running_loop()
+    sent = 0
+    while sent < args.commands and time.perf_counter() < deadline:
+        room_id, device_id = rng.choice(devices)
+        if room_id in fleet.waiters:
+            await asyncio.sleep(interval)
+            continue
+        waiter = fleet.waiters[room_id] = loop.create_future()
+        started = time.perf_counter()
+        body = {"endpointId": rng.choice((1, 2, 3)), "command": rng.choice(("TURN_ON", "TURN_OFF"))}
+        status, _, _ = await asyncio.to_thread(http.request, "POST", f"/devices/{device_id}/command", body)
+        if status != 201:
+            fleet.waiters.pop(room_id, None)
+            stats.command_timeouts += 1
+        else:
+            try:
+                received = await asyncio.wait_for(waiter, args.command_timeout)
+                stats.command_latency.append(received - started)
+            except asyncio.TimeoutError:
+                fleet.waiters.pop(room_id, None)
+                stats.command_timeouts += 1
+        sent += 1
+        await asyncio.sleep(interval)
+
+
+# Tạo lịch hẹn ONCE chạy trong lúc đo, độ trễ = lúc board nhận lệnh - nextRunAt (scheduler quét mỗi 10 giây)
+async def probe_schedules(args, fleet, http, devices, stats):
+    rng = random.Random(args.seed + 2)
+    loop = asyncio.get_running_loop()
+    # Phòng dùng cho lịch hẹn không dùng cho probe lệnh API để không lẫn message
+    chosen = rng.sample(devices, min(args.schedules, len(devices)))
+    probes = []
+    for i, (room_id, device_id) in enumerate(chosen):
+        run_at = datetime.now() + timedelta(seconds=15 + i * max(1.0, (args.duration - 30) / max(1, len(chosen))))
+        status, payload, _ = await asyncio.to_thread(http.request, "POST", f"/automations/{device_id}/schedules", {
+            "endpointId": 1,
+            "name": f"fleet-probe-{i}",
+            "action": json.dumps({"command": "TURN_ON"}),
+            "scheduleType": "ONCE",
+            "nextRunAt": run_at.isoformat()
+        })
+        if status == 201:
+            probes.append((room_id, run_at, payload["scheduleId"]))
+
+    async def wait_one(room_id, run_at):
+        delay = (run_at - datetime.now()).total_seconds()
+        await asyncio.sleep(max(0, delay - 1))
+        waiter = fleet.waiters[room_id] = loop.create_future()
+        try:
+            await asyncio.wait_for(waiter, 30)
+            stats.schedule_lateness.append((datetime.now() - run_at).total_seconds())
+        except asyncio.TimeoutError:
+            fleet.waiters.pop(room_id, None)
+            stats.schedule_missed += 1
+
+    await asyncio.gather(*(wait_one(room_id, run_at) for room_id, run_at, _ in probes))
+    for _, _, schedule_id in probes:
+        await asyncio.to_thread(http.request, "DELETE", f"/automations/schedules/{schedule_id}")
+    return {room_id for room_id, _, _ in probes}
+
+
+async def main_async(args):
+    with open(args.manifest, encoding="utf-8") as f:
+        manifest = json.load(f)
+
+    houses = manifest["houses"]
+    rooms = [r for h in houses for r in h["rooms"]][:args.devices]
+    room_set = set(rooms)
+    # (roomId, deviceId) có thể nhận lệnh: thiết bị đầu tiên trong phòng (board nhận topic của phòng)
+    room_device = {}
+    db = AsyncIOMotorClient(args.mongo)[manifest["db"]]
+    async for d in db.devices.find({"roomId": {"$in": rooms}}, {"roomId": 1}).sort("_id", 1):
+        room_device.setdefault(d["roomId"], str(d["_id"]))
+
+    stats = Stats()
+    fleet = Fleet(args, rooms, stats)
+    await fleet.connect()
+    print(f"{len(rooms)} board ảo trên {len(fleet.clients)} kết nối MQTT", file=sys.stderr)
+
+    http = None
+    probe_devices = []
+    if args.commands or args.schedules:
+        # Chủ nhà đầu tiên có phòng trong fleet
+        owner_house = next(h for h in houses if room_set & set(h["rooms"]))
+        http = HttpClient(args.url)
+        await asyncio.to_thread(http.login, owner_house["owner"], manifest["password"])
+        probe_devices = [(r, room_device[r]) for r in owner_house["rooms"] if r in room_device]
+
+    stop = asyncio.Event()
+    watcher = asyncio.create_task(watch_ingest(db, stats, stop))
+    before = await opcounters(db)
+
+    started = time.perf_counter()
+    deadline = started + args.duration
+    tasks = [
+        asyncio.create_task(fleet.run_device(room_id, deadline, started, random.Random(args.seed * 100003 + i)))
+        for i, room_id in enumerate(rooms)
+    ]
+    schedule_rooms = set()
+    if args.schedules and probe_devices:
+        schedule_rooms = await probe_schedules_split(args, fleet, http, probe_devices, stats, deadline)
+    elif args.commands and probe_devices:
+        await probe_commands(args, fleet, http, probe_devices, stats, deadline)
+
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+    # Chờ server ghi nốt các message còn trong hàng đợi
+    await asyncio.sleep(args.drain)
+    after = await opcounters(db)
+    stop.set()
+    await watcher
+
+    ingest = None
+    if http is not None:
+        status, payload, _ = await asyncio.to_thread(
+            http.request, "GET", "/system/ingest", headers={"X-Diagnostics-Token": os.getenv("DIAG_TOKEN", "")}
+        )
+        ingest = payload if status == 200 else None
+        http.close()
+    await fleet.disconnect()
+
+    published = sum(stats.published.values())
+    writes = {k: after.get(k, 0) - before.get(k, 0) for k in ("insert", "update", "delete", "query", "command")}
+    return {
+        "config": {
+            "devices": len(rooms), "connections": len(fleet.clients), "ratePerDevice": args.rate,
+            "pattern": args.pattern, "statusRatio": args.status_ratio, "qos": args.qos,
+            "duration": args.duration, "echo": args.echo
+        },
+        "published": {**stats.published, "total": published, "msgsPerSec": round(published / elapsed, 1)},
+        "ingest": {
+            "sensorWritesSeen": len(stats.ingest_lag),
+            "deviceUpdatesSeen": stats.ingested,
+            "writesPerSec": round(stats.ingested / (elapsed + args.drain), 1),
+            "lag": summarize(stats.ingest_lag)
+        },
+        "commands": {"api": summarize(stats.command_latency), "timeouts": stats.command_timeouts, "echoed": stats.echoed},
+        "schedules": {
+            "probes": len(stats.schedule_lateness) + stats.schedule_missed,
+            "latenessSeconds": summarize(stats.schedule_lateness),
+            "missed": stats.schedule_missed,
+            "rooms": len(schedule_rooms)
+        },
+        "mongo": {"opcounters": writes, "writesPerSec": round((writes["insert"] + writes["update"]) / (elapsed + args.drain), 1)},
+        "server": ingest
+    }
+
+
+# Lịch hẹn và lệnh API chạy song song trên 2 nhóm phòng khác nhau
+async def probe_schedules_split(args, fleet, http, devices, stats, deadline):
+    half = max(1, len(devices) // 2) if args.commands else len(devices)
+    schedule_devices, command_devices = devices[:half], devices[half:] or devices[:half]
+    tasks = [probe_schedules(args, fleet, http, schedule_devices, stats)]
+    if args.commands:
+        tasks.append(probe_commands(args, fleet, http, command_devices, stats, deadline))
+    results = await asyncio.gather(*tasks)
+    return results[0]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--manifest", default=os.path.join(HERE, "results", "seed-manifest.json"))
+    parser.add_argument("--broker", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1883)
+    parser.add_argument("--tls", action="store_true")
+    parser.add_argument("--username")
+    parser.add_argument("--password")
+    parser.add_argument("--mongo", default=os.getenv("MONGO_URL", "mongodb://127.0.0.1:27017"))
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--devices", type=int, default=1000, help="Số board ảo (mỗi phòng 1 board)")
+    parser.add_argument("--connections", type=int, default=50, help="Số kết nối MQTT, các board chia nhau dùng")
+    parser.add_argument("--rate", type=float, default=0.2, help="Số message / giây của mỗi board")
+    parser.add_argument("--status-ratio", type=float, default=0.5, help="Tỉ lệ message cảm biến (status)")
+    parser.add_argument("--pattern", choices=("steady", "burst", "ramp"), default="steady")
+    parser.add_argument("--burst-period", type=float, default=10)
+    parser.add_argument("--burst-seconds", type=float, default=2)
+    parser.add_argument("--burst-factor", type=float, default=10)
+    parser.add_argument("--ramp-seconds", type=float, default=30)
+    parser.add_argument("--qos", type=int, choices=(0, 1), default=0)
+    parser.add_argument("--echo", action="store_true", help="Board báo lại trạng thái sau khi nhận lệnh")
+    parser.add_argument("--duration", type=float, default=60)
+    parser.add_argument("--drain", type=float, default=3, help="Chờ thêm n giây sau khi ngừng gửi")
+    parser.add_argument("--commands", type=int, default=0, help="Số lệnh gửi qua API để đo độ trễ lệnh -> thiết bị")
+    parser.add_argument("--command-rate", type=float, default=5)
+    parser.add_argument("--command-timeout", type=float, default=5)
+    parser.add_argument("--schedules", type=int, default=0, help="Số lịch hẹn ONCE tạo để đo độ trễ scheduler")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    result = asyncio.run(main_async(args))
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+# Tạo dữ liệu giả lập cho load test: user, nhà, thành viên, phòng, thiết bị + endpoint, lịch hẹn, lịch sử lệnh.
+# Ghi thẳng vào MongoDB (nhanh hơn gọi API), cùng dạng document với app. Cùng --seed -> cùng cấu trúc dữ liệu.
+# Danh sách tài khoản / id được ghi ra file manifest để loadtest.py dùng.
+#
+#   python benchmarks/seed.py --mongo mongodb://127.0.0.1:27017 --db smart_home_bench --drop --users 200
+# Sau đó chạy server với DB_NAME=smart_home_bench (server tự tạo index khi khởi động)
+import argparse
+import json
+import os
+import random
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from passlib.context import CryptContext
+from pymongo import MongoClient
+
+PASSWORD = "bench123456"
+SWITCH_ENDPOINTS = (1, 2, 3)
+SENSOR_ENDPOINT_ID = 4
+BATCH = 5000
+
+COLLECTIONS = (
+    "users", "houses", "home_members", "rooms", "devices", "schedules", "commands",
+    "refresh_tokens", "house_changes", "usage_rollups", "auto_off_rules", "condition_rules"
+)
+
+
+def insert_batches(collection, docs):
+    for i in range(0, len(docs), BATCH):
+        collection.insert_many(docs[i:i + BATCH], ordered=False)
+
+
+def build(args, rng):
+    now = datetime.now()
+    password_hash = CryptContext(schemes=["bcrypt"], deprecated="auto").hash(PASSWORD)
+
+    users = [{
+        "_id": ObjectId(),
+        "email": f"bench{i}@bench.example.com",
+        "passwordHash": password_hash,
+        "fullName": f"Bench User {i}",
+        "phone": None,
+        "status": "ACTIVE",
+        "createdAt": now
+    } for i in range(args.users)]
+
+    houses, members, rooms, devices, schedules, commands = [], [], [], [], [], []
+    manifest_houses = []
+
+    for owner_index, owner in enumerate(users):
+        for h in range(args.houses_per_user):
+            house_id = ObjectId()
+            houses.append({
+                "_id": house_id,
+                "ownerId": str(owner["_id"]),
+                "name": f"House {owner_index}-{h}",
+                "address": None,
+                "mapId": None,
+                "createdAt": now
+            })
+
+            # Thành viên: chọn ngẫu nhiên trong các user khác; thêm 1 user "dự bị" chưa là thành viên để test mời / xóa
+            others = [u for u in rng.sample(users, min(len(users), args.members_per_house + 2)) if u is not owner]
+            member_users, spare = others[:args.members_per_house], others[args.members_per_house:args.members_per_house + 1]
+            for j, user in enumerate(member_users):
+                members.append({
+                    "_id": ObjectId(),
+                    "houseId": str(house_id),
+                    "userId": str(user["_id"]),
+                    "role": "ADMIN" if j == 0 else "MEMBER",
+                    "status": "ACCEPTED",
+                    "invitedBy": str(owner["_id"]),
+                    "joinedAt": now
+                })
+
+            house_rooms, house_devices = [], []
+            for r in range(args.rooms_per_house):
+                room_id = ObjectId()
+                rooms.append({"_id": room_id, "houseId": str(house_id), "name": f"Room {r}", "floor": r // 4, "createdAt": now})
+                house_rooms.append(str(room_id))
+
+                for d in range(args.devices_per_room):
+                    device_id = ObjectId()
+                    endpoints = [
+                        {"id": e, "name": f"Switch {e}", "type": "SWITCH", "value": rng.randint(0, 1), "lastUpdated": now}
+                        for e in SWITCH_ENDPOINTS
+                    ]
+                    endpoints.append({
+                        "id": SENSOR_ENDPOINT_ID, "name": "Sensor", "type": "SENSOR",
+                        "value": {"temperature": round(rng.uniform(20, 35), 1), "humidity": rng.randint(40, 90)},
+                        "lastUpdated": now
+                    })
+                    devices.append({
+                        "_id": device_id,
+                        "houseId": str(house_id),
+                        "roomId": str(room_id),
+                        "endpoints": endpoints,
+                        "name": f"Device {r}-{d}",
+                        "serialNo": uuid.UUID(int=rng.getrandbits(128)).hex[:12],
+                        "bleMac": None,
+                        "ipAddress": None,
+                        "isOnline": True,
+                        "lastSeenAt": now,
+                        "createdAt": now
+                    })
+                    house_devices.append(str(device_id))
+
+                    for s in range(args.schedules_per_device):
+                        # Lịch ở tương lai để scheduler không kích hoạt trong lúc đo
+                        schedules.append({
+                            "_id": ObjectId(),
+                            "deviceId": str(device_id),
+                            "endpointId": SWITCH_ENDPOINTS[s % len(SWITCH_ENDPOINTS)],
+                            "name": f"Schedule {s}",
+                            "enabled": True,
+                            "action": json.dumps({"command": "TURN_ON"}),
+                            "scheduleType": "DAILY",
+                            "nextRunAt": now + timedelta(days=1, minutes=rng.randint(0, 1440)),
+                            "timezone": "Asia/Ho_Chi_Minh"
+                        })
+
+                    for _ in range(args.commands_per_device):
+                        created = now - timedelta(seconds=rng.randint(0, args.history_days * 86400))
+                        commands.append({
+                            "_id": ObjectId(),
+                            "commandId": uuid.UUID(int=rng.getrandbits(128)).hex,
+                            "deviceId": str(device_id),
+                            "endpointId": rng.choice(SWITCH_ENDPOINTS),
+                            "command": rng.choice(("TURN_ON", "TURN_OFF")),
+                            "payload": None,
+                            "status": "SENT",
+                            "createdAt": created,
+                            "ackedAt": None
+                        })
+
+            manifest_houses.append({
+                "houseId": str(house_id),
+                "owner": owner["email"],
+                "members": [u["email"] for u in member_users],
+                "spare": spare[0]["email"] if spare else None,
+                "rooms": house_rooms,
+                "devices": house_devices
+            })
+
+    data = {
+        "users": users, "houses": houses, "home_members": members, "rooms": rooms,
+        "devices": devices, "schedules": schedules, "commands": commands
+    }
+    manifest = {"password": PASSWORD, "houses": manifest_houses}
+    return data, manifest
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mongo", default=os.getenv("MONGO_URL", "mongodb://127.0.0.1:27017"))
+    parser.add_argument("--db", default="smart_home_bench")
+    parser.add_argument("--drop", action="store_true", help="Xóa dữ liệu cũ trong DB benchmark trước khi tạo")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--houses-per-user", type=int, default=1)
+    parser.add_argument("--members-per-house", type=int, default=2)
+    parser.add_argument("--rooms-per-house", type=int, default=4)
+    parser.add_argument("--devices-per-room", type=int, default=3)
+    parser.add_argument("--schedules-per-device", type=int, default=1)
+    parser.add_argument("--commands-per-device", type=int, default=50)
+    parser.add_argument("--history-days", type=int, default=30)
+    parser.add_argument("--manifest", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "results", "seed-manifest.json"))
+    args = parser.parse_args()
+
+    if args.drop and "bench" not in args.db:
+        parser.error("--drop chỉ dùng cho DB có chữ 'bench' trong tên (tránh xóa nhầm dữ liệu thật)")
+
+    db = MongoClient(args.mongo)[args.db]
+    if args.drop:
+        for name in COLLECTIONS:
+            db[name].drop()
+    elif db.users.count_documents({"email": {"$regex": "^bench"}}, limit=1):
+        parser.error("DB đã có dữ liệu benchmark, chạy lại với --drop")
+
+    started = time.perf_counter()
+    data, manifest = build(args, random.Random(args.seed))
+    for name, docs in data.items():
+        if docs:
+            insert_batches(db[name], docs)
+
+    manifest["db"] = args.db
+    manifest["config"] = {k: v for k, v in vars(args).items() if k not in ("mongo", "manifest", "drop")}
+    os.makedirs(os.path.dirname(args.manifest), exist_ok=True)
+    with open(args.manifest, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+
+    print(json.dumps({
+        "db": args.db,
+        "counts": {name: len(docs) for name, docs in data.items()},
+        "seconds": round(time.perf_counter() - started, 1),
+        "manifest": args.manifest
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+import logging
+import asyncio
+import os
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from bson import ObjectId
+from pymongo.errors import OperationFailure
+from dotenv import load_dotenv
+from database import db, get_client
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# Xóa nhà/phòng có nhiều thiết bị hơn ngưỡng này sẽ chạy nền
+CASCADE_BACKGROUND_DEVICES = int(os.getenv("CASCADE_BACKGROUND_DEVICES", 1000))
+# Số thiết bị xóa mỗi lượt khi chạy nền
+CASCADE_BATCH_SIZE = int(os.getenv("CASCADE_BATCH_SIZE", 500))
+# Số job được giữ lại để tra cứu trạng thái
+MAX_JOBS = 200
+
+# MongoDB standalone không hỗ trợ transaction -> phát hiện 1 lần rồi chạy không transaction
+_transactions_supported = True
+
+
+# Chạy work(session) trong 1 transaction, fallback chạy thường nếu server không hỗ trợ
+async def run_in_transaction(work):
+    global _transactions_supported
+    if _transactions_supported:
+        try:
+            async with await get_client().start_session() as session:
+                async with session.start_transaction():
+                    return await work(session)
+        except OperationFailure as e:
+            # 20 = IllegalOperation: "Transaction numbers are only allowed on a replica set member or mongos"
+            if e.code != 20:
+                raise
+            _transactions_supported = False
+            logger.warning("MongoDB không hỗ trợ transaction, xóa dữ liệu không dùng transaction")
+
+    # Các lệnh xóa đều idempotent nên chạy lại không sao
+    return await work(None)
+
+
+# Lấy id các thiết bị thỏa điều kiện
+async def collect_device_ids(query: dict, session=None):
+    cursor = db.devices.find(query, {"_id": 1}, session=session)
+    return [str(d["_id"]) async for d in cursor]
+
+
+# Tombstone của lịch hẹn / luật tự tắt sắp bị xóa theo thiết bị hoặc endpoint,
+# client đồng bộ tăng dần (/changes, realtime) cần chúng để xóa bản sao của mình
+async def collect_tombstones(query: dict, session=None):
+    tombstones = []
+    async for s in db.schedules.find(query, {"_id": 1}, session=session):
+        tombstones.append(("schedule", str(s["_id"]), "delete"))
+    async for r in db.auto_off_rules.find(query, {"deviceId": 1, "endpointId": 1}, session=session):
+        tombstones.append(("auto_off_rule", f"{r['deviceId']}:{r['endpointId']}", "delete"))
+    return tombstones
+
+
+# Tombstone của luật theo điều kiện sắp bị xóa (query theo targetDeviceId / roomId)
+async def collect_rule_tombstones(query: dict, session=None):
+    cursor = db.condition_rules.find(query, {"_id": 1}, session=session)
+    return [("condition_rule", str(r["_id"]), "delete") async for r in cursor]
+
+
+# Xóa thiết bị cùng dữ liệu phụ thuộc, mỗi collection 1 lệnh $in.
+# tombstones != None: thêm tombstone của dữ liệu phụ thuộc bị xóa vào danh sách này
+async def _delete_devices_batch(device_ids, session=None, tombstones=None):
+    query = {"deviceId": {"$in": device_ids}}
+    if tombstones is not None:
+        tombstones += await collect_tombstones(query, session)
+        tombstones += await collect_rule_tombstones({"targetDeviceId": {"$in": device_ids}}, session)
+    await db.commands.delete_many(query, session=session)
+    await db.auto_off_rules.delete_many(query, session=session)
+    await db.schedules.delete_many(query, session=session)
+    await db.usage_rollups.delete_many(query, session=session)
+    await db.condition_rules.delete_many({"targetDeviceId": {"$in": device_ids}}, session=session)
+    await db.devices.delete_many({"_id": {"$in": [ObjectId(d) for d in device_ids]}}, session=session)
+
+
+# Xóa danh sách thiết bị; có job -> chia lượt và cập nhật tiến độ
+async def delete_devices(device_ids, session=None, job=None, tombstones=None):
+    if not device_ids:
+        return
+
+    if job is None:
+        await _delete_devices_batch(device_ids, session, tombstones)
+        return
+
+    for i in range(0, len(device_ids), CASCADE_BATCH_SIZE):
+        batch = device_ids[i:i + CASCADE_BATCH_SIZE]
+        await _delete_devices_batch(batch, tombstones=tombstones)
+        job["deletedDevices"] += len(batch)
+
+
+# Quản lý job xóa chạy nền (lưu trong bộ nhớ)
+jobs = OrderedDict()
+_running = set()
+
+def create_job(kind: str, target_id: str, user_id: str, total_devices: int):
+    job = {
+        "jobId": uuid.uuid4().hex,
+        "kind": kind,
+        "targetId": target_id,
+        "userId": user_id,
+        "status": "PENDING",
+        "totalDevices": total_devices,
+        "deletedDevices": 0,
+        "createdAt": datetime.now(),
+        "finishedAt": None,
+        "error": None
+    }
+    jobs[job["jobId"]] = job
+    while len(jobs) > MAX_JOBS:
+        jobs.popitem(last=False)
+    return job
+
+def get_job(job_id: str):
+    return jobs.get(job_id)
+
+async def _run_job(job, work):
+    job["status"] = "RUNNING"
+    try:
+        await work
+        job["status"] = "DONE"
+    except Exception as e:
+        job["status"] = "FAILED"
+        job["error"] = str(e)
+        logger.exception("Lỗi job xóa %s %s: %s", job["kind"], job["targetId"], e)
+    finally:
+        job["finishedAt"] = datetime.now()
+
+# Chạy coroutine work trong nền, giữ tham chiếu task để không bị thu gom
+def start_job(job, work):
+    task = asyncio.create_task(_run_job(job, work))
+    _running.add(task)
+    task.add_done_callback(_running.discard)
+    return job
@@ -0,0 +1,238 @@
+import os
+from datetime import datetime, timedelta
+from typing import Optional
+from bson import ObjectId
+from fastapi import HTTPException
+from pymongo import ReturnDocument
+from dotenv import load_dotenv
+from database import db
+from models import AutoOffRule
+from serializers import encode_house, encode_room, encode_device, encode_schedule, encode_condition_rule, make_encoder
+from realtime import hub
+
+load_dotenv()
+
+# Thời gian giữ change log, quá hạn thì client có cursor cũ phải đồng bộ lại toàn bộ
+CHANGELOG_RETENTION_HOURS = float(os.getenv("CHANGELOG_RETENTION_HOURS", 72))
+# Số bản ghi tối đa mỗi nhà
+CHANGELOG_MAX_ENTRIES = int(os.getenv("CHANGELOG_MAX_ENTRIES", 10000))
+# Chu kỳ chạy compaction (giây)
+CHANGELOG_COMPACT_INTERVAL = int(os.getenv("CHANGELOG_COMPACT_INTERVAL", 600))
+# Số thay đổi tối đa trả về 1 lần, nhiều hơn thì client đồng bộ lại toàn bộ
+CHANGES_MAX_RESULTS = int(os.getenv("CHANGES_MAX_RESULTS", 1000))
+# Bản ghi có thể được ghi chậm hơn số phiên bản vài mili giây -> lần đọc sau quét lại khoảng này
+CHANGES_SETTLE_SECONDS = float(os.getenv("CHANGES_SETTLE_SECONDS", 2))
+
+encode_auto_off_rule = make_encoder(AutoOffRule)
+
+
+# Ghi nhiều thay đổi của 1 nhà: tăng phiên bản nhà thêm n, mỗi thay đổi nhận 1 seq liên tiếp
+# changes: list (entity, entityId, op) hoặc (entity, entityId, op, data), op là "create" / "update" / "delete"
+# data (không lưu vào log) được gửi kèm sự kiện realtime, ví dụ giá trị mới của endpoint
+async def record_changes(house_id: str, changes: list) -> int:
+    if not changes:
+        return 0
+
+    house = await db.houses.find_one_and_update(
+        {"_id": ObjectId(house_id)},
+        {"$inc": {"version": len(changes)}},
+        projection={"version": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    if not house:
+        return 0
+
+    first_seq = house["version"] - len(changes) + 1
+    now = datetime.now()
+    entries = []
+    for i, (entity, entity_id, op, *data) in enumerate(changes):
+        entries.append({
+            "houseId": house_id,
+            "seq": first_seq + i,
+            "entity": entity,
+            "entityId": entity_id,
+            "op": op,
+            "at": now
+        })
+    await db.house_changes.insert_many(entries, ordered=False)
+
+    # Đẩy tới các client đang nghe nhà này (WebSocket/SSE)
+    for entry, (_, _, _, *data) in zip(entries, changes):
+        event = {"entity": entry["entity"], "id": entry["entityId"], "op": entry["op"], "seq": entry["seq"]}
+        if data:
+            event["data"] = data[0]
+        hub.publish(house_id, event)
+    return house["version"]
+
+async def record_change(house_id: str, entity: str, entity_id: str, op: str, data: dict = None) -> int:
+    change = (entity, entity_id, op) if data is None else (entity, entity_id, op, data)
+    return await record_changes(house_id, [change])
+
+
+# Cursor gồm seq và thời điểm đọc (ms): "<seq>.<ms>", client chỉ cần gửi lại nguyên giá trị
+def encode_cursor(seq: int, read_at: datetime) -> str:
+    return f"{seq}.{int(read_at.timestamp() * 1000)}"
+
+def decode_cursor(cursor: str):
+    try:
+        seq, _, ms = cursor.partition(".")
+        seq = int(seq)
+        # seq phải vừa int64 của MongoDB; ms ngoài khoảng thời gian hợp lệ -> OverflowError / OSError
+        if not 0 <= seq < 2 ** 63:
+            raise ValueError(seq)
+        read_at = datetime.fromtimestamp(int(ms) / 1000) if ms else None
+        return seq, read_at
+    except (ValueError, OverflowError, OSError):
+        raise HTTPException(status_code=400, detail="Cursor không hợp lệ")
+
+
+# Lấy trạng thái hiện tại của các entity đã thay đổi, mỗi loại entity 1 query
+async def _load_current(keys):
+    ids = {}
+    for entity, entity_id in keys:
+        ids.setdefault(entity, []).append(entity_id)
+
+    current = {}
+
+    async def load(entity, collection, encoder, id_list):
+        async for doc in db[collection].find({"_id": {"$in": [ObjectId(i) for i in id_list]}}):
+            current[(entity, str(doc["_id"]))] = encoder(doc)
+
+    if "house" in ids:
+        await load("house", "houses", encode_house, ids["house"])
+    if "room" in ids:
+        await load("room", "rooms", encode_room, ids["room"])
+    if "device" in ids:
+        await load("device", "devices", encode_device, ids["device"])
+    if "schedule" in ids:
+        await load("schedule", "schedules", encode_schedule, ids["schedule"])
+    if "condition_rule" in ids:
+        await load("condition_rule", "condition_rules", encode_condition_rule, ids["condition_rule"])
+
+    # Endpoint và luật tự tắt có id dạng "<deviceId>:<endpointId>"
+    if "endpoint" in ids:
+        device_ids = list({i.split(":")[0] for i in ids["endpoint"]})
+        cursor = db.devices.find({"_id": {"$in": [ObjectId(d) for d in device_ids]}}, {"endpoints": 1})
+        async for device in cursor:
+            for ep in device.get("endpoints", []):
+                current[("endpoint", f"{device['_id']}:{ep['id']}")] = {"deviceId": str(device["_id"]), **ep}
+
+    if "auto_off_rule" in ids:
+        device_ids = list({i.split(":")[0] for i in ids["auto_off_rule"]})
+        async for rule in db.auto_off_rules.find({"deviceId": {"$in": device_ids}}):
+            current[("auto_off_rule", f"{rule['deviceId']}:{rule['endpointId']}")] = encode_auto_off_rule(rule)
+
+    return current
+
+
+# Lấy các thay đổi của nhà kể từ cursor. resync=True nghĩa là client phải tải lại toàn bộ (snapshot)
+async def get_changes(house_id: str, since: Optional[str]):
+    house = await db.houses.find_one({"_id": ObjectId(house_id)}, {"version": 1, "changeLogFloor": 1})
+    if not house:
+        raise HTTPException(status_code=404, detail="Nhà không tồn tại")
+
+    version = house.get("version", 0)
+    read_at = datetime.now()
+    resync = {"cursor": encode_cursor(version, read_at), "resync": True, "changes": []}
+
+    if since is None:
+        return resync
+    since_seq, since_at = decode_cursor(since)
+    # Cursor cũ hơn phần log còn giữ, hoặc không hợp lệ
+    if since_seq < house.get("changeLogFloor", 0) or since_seq > version:
+        return resync
+
+    query = {"houseId": house_id, "seq": {"$gt": since_seq, "$lte": version}}
+    if since_at is not None:
+        settle_from = since_at - timedelta(seconds=CHANGES_SETTLE_SECONDS)
+        query = {
+            "houseId": house_id,
+            "seq": {"$lte": version},
+            "$or": [{"seq": {"$gt": since_seq}}, {"at": {"$gte": settle_from}}]
+        }
+
+    scan_limit = CHANGES_MAX_RESULTS * 10
+    entries = await db.house_changes.find(query, {"entity": 1, "entityId": 1, "op": 1, "seq": 1}) \
+        .sort("seq", 1).limit(scan_limit + 1).to_list(length=scan_limit + 1)
+    if len(entries) > scan_limit:
+        return resync
+
+    # Mỗi entity chỉ giữ thay đổi mới nhất
+    latest = {}
+    for e in entries:
+        latest.pop((e["entity"], e["entityId"]), None)
+        latest[(e["entity"], e["entityId"])] = e
+    if len(latest) > CHANGES_MAX_RESULTS:
+        return resync
+
+    current = await _load_current([k for k, e in latest.items() if e["op"] != "delete"])
+
+    result = []
+    for key, e in latest.items():
+        data = current.get(key)
+        change = {"entity": e["entity"], "id": e["entityId"], "seq": e["seq"]}
+        if e["op"] == "delete" or data is None:
+            # Tombstone: entity đã bị xóa
+            change["op"] = "delete"
+        else:
+            change["op"] = e["op"]
+            change["data"] = data
+        result.append(change)
+
+    return {"cursor": encode_cursor(version, read_at), "resync": False, "changes": result}
+
+
+# Cắt log của nhà tới seq (bao gồm), client có cursor nhỏ hơn sẽ phải đồng bộ lại
+async def _truncate(house_id: str, seq: int):
+    await db.houses.update_one({"_id": ObjectId(house_id)}, {"$max": {"changeLogFloor": seq}})
+    await db.house_changes.delete_many({"houseId": house_id, "seq": {"$lte": seq}})
+
+
+# Thời điểm bắt đầu lần compaction trước: lần sau chỉ xét các nhà có bản ghi mới từ đó (None = mọi nhà còn log)
+_last_compact_at = None
+
+
+# Compaction 1 nhà: bỏ bản ghi vượt số lượng và bản ghi đã bị thay đổi sau đó thay thế
+async def _compact_house(house_id: str):
+    house = await db.houses.find_one({"_id": ObjectId(house_id)}, {"version": 1, "changeLogFloor": 1})
+    if not house:
+        return
+
+    # Số bản ghi không thể vượt số phiên bản từ lần cắt log trước -> chỉ đếm khi có thể vượt
+    if house.get("version", 0) - house.get("changeLogFloor", 0) > CHANGELOG_MAX_ENTRIES:
+        if await db.house_changes.count_documents({"houseId": house_id}) > CHANGELOG_MAX_ENTRIES:
+            nth = await db.house_changes.find({"houseId": house_id}, {"seq": 1}) \
+                .sort("seq", -1).skip(CHANGELOG_MAX_ENTRIES).limit(1).to_list(length=1)
+            if nth:
+                await _truncate(house_id, nth[0]["seq"])
+
+    # Log của nhà đã được giới hạn ở trên -> đọc hết (chỉ entity, entityId, seq), giữ bản ghi mới nhất của mỗi entity
+    latest, superseded = set(), []
+    async for e in db.house_changes.find({"houseId": house_id}, {"_id": 0, "entity": 1, "entityId": 1, "seq": 1}).sort("seq", -1):
+        key = (e["entity"], e["entityId"])
+        if key in latest:
+            superseded.append(e["seq"])
+        else:
+            latest.add(key)
+    for i in range(0, len(superseded), 1000):
+        await db.house_changes.delete_many({"houseId": house_id, "seq": {"$in": superseded[i:i + 1000]}})
+
+
+# Compaction: bỏ bản ghi quá hạn, rồi compact từng nhà có thay đổi từ lần trước
+async def compact_change_log():
+    global _last_compact_at
+    started = datetime.now()
+    cutoff = started - timedelta(hours=CHANGELOG_RETENTION_HOURS)
+    # Bản ghi cũ hơn đã bị xóa ở lần trước -> index "at" chỉ quét các bản ghi mới quá hạn
+    expired = db.house_changes.aggregate([
+        {"$match": {"at": {"$lt": cutoff}}},
+        {"$group": {"_id": "$houseId", "maxSeq": {"$max": "$seq"}}}
+    ])
+    async for g in expired:
+        await _truncate(g["_id"], g["maxSeq"])
+
+    # Lùi thêm CHANGES_SETTLE_SECONDS: bản ghi có thể được ghi chậm hơn thời điểm "at" của nó
+    since = _last_compact_at - timedelta(seconds=CHANGES_SETTLE_SECONDS) if _last_compact_at else cutoff
+    for house_id in await db.house_changes.distinct("houseId", {"at": {"$gte": since}}):
+        await _compact_house(house_id)
+    _last_compact_at = started
@@ -0,0 +1,248 @@
+import logging
+import asyncio
+import json
+import operator
+import time
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta
+from bson import ObjectId
+from database import db
+from mqtt_client import mqtt
+from invalidation import bus
+from usage import usage
+from metrics import record_publish
+from scheduler import build_fixed_payload
+
+logger = logging.getLogger(__name__)
+
+OPERATORS = {
+    "GT": operator.gt,
+    "GTE": operator.ge,
+    "LT": operator.lt,
+    "LTE": operator.le,
+    "EQ": operator.eq,
+    "NE": operator.ne
+}
+COMMANDS = ("TURN_ON", "TURN_OFF", "SET_VALUE")
+
+
+class CompiledRule:
+    __slots__ = (
+        "id", "house_id", "room_id", "endpoint_id", "field", "operator", "threshold",
+        "target_device_id", "target_endpoint_id", "command", "payload", "cooldown", "last_fired"
+    )
+
+    def __init__(self, doc: dict, last_fired: float = None):
+        self.id = str(doc["_id"])
+        self.house_id = doc["houseId"]
+        self.room_id = doc["roomId"]
+        self.endpoint_id = doc["endpointId"]
+        self.field = doc.get("field", "value")
+        self.operator = doc["operator"]
+        if self.operator not in OPERATORS:
+            raise ValueError(f"toán tử không hợp lệ: {self.operator}")
+        self.threshold = float(doc["threshold"])
+        self.target_device_id = doc["targetDeviceId"]
+        self.target_endpoint_id = doc["targetEndpointId"]
+        self.command = doc["command"]
+        self.payload = doc.get("payload")
+        self.cooldown = int(doc.get("cooldownSec", 60))
+        # Thời điểm kích hoạt gần nhất (time.monotonic) trên replica này
+        self.last_fired = last_fired
+
+
+# Các luật cùng (roomId, endpointId, field), sắp theo ngưỡng để chỉ duyệt các luật thỏa điều kiện
+class _Bucket:
+    def __init__(self):
+        self.rules = {}
+        self.dirty = True
+
+    def _compile(self):
+        by_op = {op: [] for op in OPERATORS}
+        for rule in self.rules.values():
+            by_op[rule.operator].append(rule)
+        self.sorted = {}
+        for op in ("GT", "GTE", "LT", "LTE"):
+            rules = sorted(by_op[op], key=lambda r: r.threshold)
+            self.sorted[op] = ([r.threshold for r in rules], rules)
+        self.eq = {}
+        for rule in by_op["EQ"]:
+            self.eq.setdefault(rule.threshold, []).append(rule)
+        self.ne = by_op["NE"]
+        self.dirty = False
+
+    def match(self, value: float):
+        if self.dirty:
+            self._compile()
+        matched = []
+        # value > t: các luật có ngưỡng < value (đầu danh sách)
+        thresholds, rules = self.sorted["GT"]
+        matched += rules[:bisect_left(thresholds, value)]
+        thresholds, rules = self.sorted["GTE"]
+        matched += rules[:bisect_right(thresholds, value)]
+        # value < t: các luật có ngưỡng > value (cuối danh sách)
+        thresholds, rules = self.sorted["LT"]
+        matched += rules[bisect_right(thresholds, value):]
+        thresholds, rules = self.sorted["LTE"]
+        matched += rules[bisect_left(thresholds, value):]
+        matched += self.eq.get(value, [])
+        matched += [r for r in self.ne if r.threshold != value]
+        return matched
+
+
+# Bộ máy luật theo điều kiện: luật được đánh chỉ mục theo (roomId, endpointId, field),
+# mỗi message chỉ kiểm tra các luật của đúng endpoint đó và chỉ duyệt các luật thỏa điều kiện
+class ConditionEngine:
+    def __init__(self):
+        # (roomId, endpointId, field) -> _Bucket
+        self.index = {}
+        # ruleId -> CompiledRule
+        self.rules = {}
+        self.evaluations = 0
+        self.matched = 0
+        self.fired = 0
+        self.suppressed = 0
+        self.invalid = 0
+        self.eval_seconds = 0.0
+        # Các lần kích hoạt đang chạy (giữ tham chiếu tới task như cascade.start_job)
+        self.firing = set()
+
+    def set_rule(self, doc: dict):
+        old = self.rules.get(str(doc["_id"]))
+        self.remove_rule(str(doc["_id"]))
+        if not doc.get("enabled", True):
+            return
+        try:
+            rule = CompiledRule(doc, old.last_fired if old else None)
+        except (KeyError, TypeError, ValueError) as e:
+            # Document hỏng (thiếu trường / null) -> bỏ qua luật này, không làm hỏng cả bộ máy luật
+            logger.error("Bỏ qua luật lỗi %s: %s", doc.get("_id"), e)
+            self.invalid += 1
+            return
+        self.rules[rule.id] = rule
+        bucket = self.index.setdefault((rule.room_id, rule.endpoint_id, rule.field), _Bucket())
+        bucket.rules[rule.id] = rule
+        bucket.dirty = True
+
+    def remove_rule(self, rule_id: str):
+        rule = self.rules.pop(rule_id, None)
+        if rule is None:
+            return
+        key = (rule.room_id, rule.endpoint_id, rule.field)
+        bucket = self.index.get(key)
+        if bucket:
+            bucket.rules.pop(rule_id, None)
+            bucket.dirty = True
+            if not bucket.rules:
+                del self.index[key]
+
+    # Xóa luật theo điều kiện (khi xóa thiết bị / phòng / nhà)
+    def remove_where(self, predicate):
+        for rule_id in [r.id for r in self.rules.values() if predicate(r)]:
+            self.remove_rule(rule_id)
+
+    def set_all(self, docs):
+        self.index, self.rules = {}, {}
+        for doc in docs:
+            self.set_rule(doc)
+
+    def match(self, room_id: str, endpoint_id: int, field: str, value: float):
+        bucket = self.index.get((room_id, endpoint_id, field))
+        return bucket.match(value) if bucket else []
+
+    # Gọi cho mỗi bản ghi ingest: sensor gửi dict (mỗi trường số là 1 field), endpoint bật/tắt gửi số ("value")
+    def evaluate(self, update: dict):
+        started = time.perf_counter()
+        room_id, endpoint_id, value = update["room"], update["ep"], update["value"]
+        if isinstance(value, dict):
+            readings = [(f, v) for f, v in value.items() if isinstance(v, (int, float)) and not isinstance(v, bool)]
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            readings = [("value", value)]
+        else:
+            readings = []
+
+        now = time.monotonic()
+        for field, reading in readings:
+            for rule in self.match(room_id, endpoint_id, field, reading):
+                self.matched += 1
+                if rule.last_fired is not None and now - rule.last_fired < rule.cooldown:
+                    self.suppressed += 1
+                    continue
+                rule.last_fired = now
+                task = asyncio.create_task(self._fire(rule, field, reading))
+                self.firing.add(task)
+                task.add_done_callback(self.firing.discard)
+
+        self.evaluations += 1
+        self.eval_seconds += time.perf_counter() - started
+
+    async def _fire(self, rule: CompiledRule, field: str, reading):
+        try:
+            # Tính giá trị trước khi giành lượt: payload lỗi (luật tạo trước khi API kiểm tra) không tốn cooldown
+            target_val = 1 if rule.command == "TURN_ON" else 0
+            if rule.command == "SET_VALUE":
+                target_val = int(rule.payload or 0)
+
+            # Nhiều replica cùng nhận message -> chỉ 1 replica giành được lượt kích hoạt
+            now = datetime.now()
+            claimed = await db.condition_rules.update_one(
+                {
+                    "_id": ObjectId(rule.id),
+                    "enabled": True,
+                    "$or": [
+                        {"lastFiredAt": None},
+                        {"lastFiredAt": {"$lte": now - timedelta(seconds=rule.cooldown)}}
+                    ]
+                },
+                {"$set": {"lastFiredAt": now}}
+            )
+            if not claimed.modified_count:
+                self.suppressed += 1
+                return
+
+            device = await db.devices.find_one({"_id": ObjectId(rule.target_device_id)}, {"houseId": 1, "roomId": 1, "endpoints": 1})
+            if not device or not device.get("roomId"):
+                return
+
+            payload = build_fixed_payload(device, rule.target_endpoint_id, target_val)
+            mqtt.publish(f"{device['roomId']}/device", json.dumps(payload))
+            record_publish("condition")
+            usage.record_command(device["houseId"], rule.target_device_id, rule.target_endpoint_id)
+            self.fired += 1
+            logger.info(
+                "Condition: %s=%s -> %s", field, reading, target_val,
+                extra={"rule": rule.id, "device": rule.target_device_id, "endpoint": rule.target_endpoint_id}
+            )
+        except Exception as e:
+            logger.exception("Lỗi thực thi luật %s: %s", rule.id, e)
+
+    async def load(self):
+        docs = await db.condition_rules.find({"enabled": True}).to_list(length=None)
+        self.set_all(docs)
+        logger.info("Condition engine: %d luật", len(self.rules))
+
+    def stats(self):
+        return {
+            "rules": len(self.rules),
+            "keys": len(self.index),
+            "evaluations": self.evaluations,
+            "matched": self.matched,
+            "fired": self.fired,
+            "suppressed": self.suppressed,
+            "invalid": self.invalid,
+            "avgEvalUs": round(self.eval_seconds / self.evaluations * 1e6, 2) if self.evaluations else None
+        }
+
+
+conditions = ConditionEngine()
+
+
+# Luật thêm/sửa/xóa ở replica khác
+@bus.on("condition_rules")
+def _on_rule_change(event):
+    if event.op == "delete":
+        conditions.remove_rule(event.id)
+    elif event.doc is not None:
+        conditions.set_rule(event.doc)
+
+bus.on_reset(lambda: bus.spawn(conditions.load()))
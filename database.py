@@ -1,6 +1,14 @@
+import logging
 import os
+import asyncio
+import threading
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import monitoring
 from dotenv import load_dotenv
+from metrics import mongo_metrics, METRICS_ENABLED, METRICS_MONGO_COMMANDS
+from diagnostics import diagnostics_listener, listener_enabled
+
+logger = logging.getLogger(__name__)
 
 # Đọc các biến từ file .env
 load_dotenv()
@@ -8,8 +16,165 @@ load_dotenv()
 MONGO_URL = os.getenv("MONGO_URL")
 DB_NAME = os.getenv("DB_NAME")
 
-# Tạo kết nối
-client = AsyncIOMotorClient(MONGO_URL)
-db = client[DB_NAME]
+# Cấu hình pool kết nối (0 = không giới hạn với các biến thời gian)
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", 100))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", 0))
+MONGO_MAX_IDLE_MS = int(os.getenv("MONGO_MAX_IDLE_MS", 0))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", 10000))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", 5000))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", 0))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", 0))
+# Số kết nối mở sẵn khi khởi động
+MONGO_WARMUP_CONNECTIONS = int(os.getenv("MONGO_WARMUP_CONNECTIONS", 10))
+
+
+# Theo dõi pool kết nối (được gọi từ các luồng của driver nên cần lock)
+class PoolStats(monitoring.ConnectionPoolListener):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.open = 0
+        self.checked_out = 0
+        self.max_checked_out = 0
+        self.created = 0
+        self.closed = 0
+        self.checkouts = 0
+        self.checkout_failed = 0
+        self.checkout_wait_total = 0.0
+        self.checkout_wait_max = 0.0
+        self.pool_cleared = 0
+
+    def pool_created(self, event): pass
+    def pool_ready(self, event): pass
+    def pool_closed(self, event): pass
+    def connection_ready(self, event): pass
+    def connection_check_out_started(self, event): pass
+
+    def pool_cleared(self, event):
+        with self._lock:
+            self.pool_cleared += 1
+
+    def connection_created(self, event):
+        with self._lock:
+            self.open += 1
+            self.created += 1
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.open -= 1
+            self.closed += 1
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            self.checkout_failed += 1
+
+    def connection_checked_out(self, event):
+        wait = getattr(event, "duration", 0.0) or 0.0
+        with self._lock:
+            self.checked_out += 1
+            self.checkouts += 1
+            self.max_checked_out = max(self.max_checked_out, self.checked_out)
+            self.checkout_wait_total += wait
+            self.checkout_wait_max = max(self.checkout_wait_max, wait)
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.checked_out -= 1
+
+    def snapshot(self):
+        with self._lock:
+            checkouts = self.checkouts or 1
+            return {
+                "maxPoolSize": MONGO_MAX_POOL_SIZE,
+                "open": self.open,
+                "inUse": self.checked_out,
+                "maxInUse": self.max_checked_out,
+                "utilization": round(self.checked_out / MONGO_MAX_POOL_SIZE, 3) if MONGO_MAX_POOL_SIZE else None,
+                "created": self.created,
+                "closed": self.closed,
+                "checkouts": self.checkouts,
+                "checkoutFailed": self.checkout_failed,
+                "avgCheckoutWaitMs": round(self.checkout_wait_total / checkouts * 1000, 3),
+                "maxCheckoutWaitMs": round(self.checkout_wait_max * 1000, 3),
+                "poolCleared": self.pool_cleared
+            }
+
+
+pool_stats = PoolStats()
+client = None
+
+
+def _client_options():
+    options = {
+        "maxPoolSize": MONGO_MAX_POOL_SIZE,
+        "minPoolSize": MONGO_MIN_POOL_SIZE,
+        "connectTimeoutMS": MONGO_CONNECT_TIMEOUT_MS,
+        "serverSelectionTimeoutMS": MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        "event_listeners": [pool_stats]
+    }
+    if METRICS_ENABLED and METRICS_MONGO_COMMANDS:
+        options["event_listeners"].append(mongo_metrics)
+    if listener_enabled():
+        options["event_listeners"].append(diagnostics_listener)
+    if MONGO_MAX_IDLE_MS:
+        options["maxIdleTimeMS"] = MONGO_MAX_IDLE_MS
+    if MONGO_SOCKET_TIMEOUT_MS:
+        options["socketTimeoutMS"] = MONGO_SOCKET_TIMEOUT_MS
+    if MONGO_WAIT_QUEUE_TIMEOUT_MS:
+        options["waitQueueTimeoutMS"] = MONGO_WAIT_QUEUE_TIMEOUT_MS
+    return options
+
+
+# Tạo kết nối (gọi trong lifespan), sai URL sẽ báo lỗi ngay khi khởi động
+async def connect_db():
+    global client
+    client = AsyncIOMotorClient(MONGO_URL, **_client_options())
+    await client.admin.command("ping")
+    await warm_up(MONGO_WARMUP_CONNECTIONS)
+    logger.info("Kết nối tới MongoDB: %s", DB_NAME)
+
+
+# Mở sẵn n kết nối trong pool bằng các lệnh ping chạy song song
+async def warm_up(n: int):
+    n = min(n, MONGO_MAX_POOL_SIZE or n)
+    if n > 0:
+        await asyncio.gather(*[client.admin.command("ping") for _ in range(n)])
+
+
+async def close_db():
+    global client
+    if client is not None:
+        client.close()
+        client = None
+
+
+# Kiểm tra DB còn phản hồi không
+async def ping(timeout: float = 2.0) -> bool:
+    if client is None:
+        return False
+    try:
+        await asyncio.wait_for(client.admin.command("ping"), timeout)
+        return True
+    except Exception:
+        return False
+
+
+def get_client():
+    if client is None:
+        raise RuntimeError("Chưa kết nối MongoDB (connect_db chưa được gọi)")
+    return client
+
+
+def get_db():
+    return get_client()[DB_NAME]
+
+
+# Các module vẫn dùng `from database import db`, kết nối thật được lấy khi truy cập
+class _Database:
+    def __getattr__(self, name):
+        return getattr(get_db(), name)
+
+    def __getitem__(self, name):
+        return get_db()[name]
+
 
-print(f"Kết nối tới MongoDB: {DB_NAME}")
\ No newline at end of file
+db = _Database()
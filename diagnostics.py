@@ -0,0 +1,275 @@
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from contextvars import ContextVar
+from pymongo import monitoring
+from dotenv import load_dotenv
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# Theo dõi số lệnh / thời gian MongoDB của từng request (mặc định tắt)
+DIAG_REQUESTS = os.getenv("DIAG_REQUESTS", "0") == "1"
+# Request chậm hơn ngưỡng này (ms) được ghi log kèm các query của nó
+DIAG_SLOW_REQUEST_MS = float(os.getenv("DIAG_SLOW_REQUEST_MS", 500))
+# Cùng 1 dạng query lặp lại >= n lần trong 1 request -> nghi N+1
+DIAG_N_PLUS_ONE = int(os.getenv("DIAG_N_PLUS_ONE", 10))
+# Ghi log lệnh MongoDB chậm hơn ngưỡng này (ms), 0 = tắt
+DIAG_SLOW_QUERY_MS = float(os.getenv("DIAG_SLOW_QUERY_MS", 0))
+# Token bảo vệ API chẩn đoán (header X-Diagnostics-Token), để trống = tắt các API này
+DIAG_TOKEN = os.getenv("DIAG_TOKEN", "")
+# Thời gian lấy mẫu profile tối đa (giây)
+DIAG_PROFILE_MAX_SECONDS = float(os.getenv("DIAG_PROFILE_MAX_SECONDS", 30))
+
+# Số request / query chậm gần nhất giữ lại để xem qua API
+RECENT_LIMIT = 100
+
+recent_slow_requests = deque(maxlen=RECENT_LIMIT)
+recent_slow_queries = deque(maxlen=RECENT_LIMIT)
+
+# Thống kê DB của request đang xử lý. Motor chạy lệnh trên thread pool nhưng copy context,
+# nên command listener (chạy ở thread của driver) vẫn thấy đúng request
+current_request = ContextVar("diag_request", default=None)
+
+
+# Dạng của filter: giữ tên field / toán tử, thay giá trị bằng "?" (không lộ dữ liệu, gom được các query giống nhau)
+def query_shape(value, depth: int = 0):
+    if isinstance(value, dict):
+        if depth > 4:
+            return "?"
+        return {k: query_shape(v, depth + 1) for k, v in value.items()}
+    if isinstance(value, (list, tuple)) and value and isinstance(value[0], dict):
+        # $or / $and: giữ dạng của từng nhánh
+        return [query_shape(v, depth + 1) for v in value[:5]]
+    return "?"
+
+
+def command_filter(name: str, command: dict):
+    if name == "find":
+        return command.get("filter", {})
+    if name in ("findAndModify", "count", "distinct"):
+        return command.get("query", {})
+    if name in ("update", "delete"):
+        ops = command.get("updates") or command.get("deletes") or []
+        return ops[0].get("q", {}) if ops else {}
+    if name == "aggregate":
+        pipeline = command.get("pipeline") or []
+        if pipeline and "$match" in pipeline[0]:
+            return pipeline[0]["$match"]
+        return {"$pipeline": [next(iter(stage), "?") for stage in pipeline]}
+    return None
+
+
+def describe_command(collection: str, name: str, command: dict):
+    filter_ = command_filter(name, command)
+    shape = json.dumps(query_shape(filter_), sort_keys=True, default=str) if filter_ is not None else ""
+    return f"{collection}.{name} {shape}".rstrip()
+
+
+class RequestDiagnostics:
+    __slots__ = ("db_calls", "db_seconds", "commands", "lock")
+
+    def __init__(self):
+        self.db_calls = 0
+        self.db_seconds = 0.0
+        # (collection, lệnh, command) của từng lệnh, dạng query chỉ tính khi cần báo cáo
+        self.commands = []
+        self.lock = threading.Lock()
+
+    def add(self, collection: str, name: str, command: dict, seconds: float):
+        with self.lock:
+            self.db_calls += 1
+            self.db_seconds += seconds
+            self.commands.append((collection, name, command, seconds))
+
+    # Các dạng query lặp lại nhiều lần (nghi N+1): [(dạng query, số lần, tổng ms)]
+    def repeated(self, threshold: int):
+        counts = Counter()
+        durations = Counter()
+        for collection, name, command, seconds in self.commands:
+            key = describe_command(collection, name, command)
+            counts[key] += 1
+            durations[key] += seconds
+        return [
+            {"query": key, "count": n, "totalMs": round(durations[key] * 1000, 2)}
+            for key, n in counts.most_common() if n >= threshold
+        ]
+
+    def slowest(self, n: int = 5):
+        ranked = sorted(self.commands, key=lambda c: c[3], reverse=True)[:n]
+        return [
+            {"query": describe_command(collection, name, command), "ms": round(seconds * 1000, 2)}
+            for collection, name, command, seconds in ranked
+        ]
+
+
+# Đếm lệnh MongoDB theo request và ghi log lệnh chậm
+class DiagnosticsListener(monitoring.CommandListener):
+    def __init__(self):
+        # (connection, request_id) -> (collection, lệnh, command, RequestDiagnostics)
+        self.inflight = {}
+
+    def started(self, event):
+        diag = current_request.get()
+        if diag is None and not DIAG_SLOW_QUERY_MS:
+            return
+        name = event.command_name
+        collection = event.command.get(name)
+        if not isinstance(collection, str):
+            collection = event.command.get("collection", "")
+            if not isinstance(collection, str):
+                collection = ""
+        self.inflight[(event.connection_id, event.request_id)] = (collection, name, event.command, diag)
+
+    def _finish(self, event, failed: bool):
+        entry = self.inflight.pop((event.connection_id, event.request_id), None)
+        if entry is None:
+            return
+        collection, name, command, diag = entry
+        seconds = event.duration_micros / 1e6
+        if diag is not None:
+            diag.add(collection, name, command, seconds)
+        if DIAG_SLOW_QUERY_MS and seconds * 1000 >= DIAG_SLOW_QUERY_MS:
+            query = describe_command(collection, name, command)
+            recent_slow_queries.append({"at": time.time(), "query": query, "ms": round(seconds * 1000, 2), "failed": failed})
+            logger.warning("Query chậm %.1fms: %s", seconds * 1000, query, extra={"slowQuery": True})
+
+    def succeeded(self, event):
+        self._finish(event, False)
+
+    def failed(self, event):
+        self._finish(event, True)
+
+
+diagnostics_listener = DiagnosticsListener()
+
+
+def listener_enabled() -> bool:
+    return DIAG_REQUESTS or DIAG_SLOW_QUERY_MS > 0
+
+
+# Đo số lệnh / thời gian DB của mỗi request, trả về qua header Server-Timing,
+# ghi log request chậm hoặc có dấu hiệu N+1
+class DiagnosticsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not DIAG_REQUESTS:
+            await self.app(scope, receive, send)
+            return
+
+        diag = RequestDiagnostics()
+        token = current_request.set(diag)
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                timing = f'db;dur={diag.db_seconds * 1000:.1f};desc="{diag.db_calls} calls"'
+                message["headers"] = list(message.get("headers", [])) + [(b"server-timing", timing.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            current_request.reset(token)
+            self._report(scope, diag, time.perf_counter() - started)
+
+    def _report(self, scope, diag: RequestDiagnostics, seconds: float):
+        repeated = diag.repeated(DIAG_N_PLUS_ONE) if diag.db_calls >= DIAG_N_PLUS_ONE else []
+        slow = seconds * 1000 >= DIAG_SLOW_REQUEST_MS
+        if not slow and not repeated:
+            return
+
+        route = getattr(scope.get("route"), "path", None) or scope.get("path")
+        entry = {
+            "at": time.time(),
+            "method": scope.get("method"),
+            "route": route,
+            "path": scope.get("path"),
+            "ms": round(seconds * 1000, 2),
+            "dbCalls": diag.db_calls,
+            "dbMs": round(diag.db_seconds * 1000, 2),
+            "nPlusOne": repeated,
+            "slowestQueries": diag.slowest()
+        }
+        recent_slow_requests.append(entry)
+        if repeated:
+            logger.warning(
+                "Nghi N+1: %s lặp %d lần trong %s %s", repeated[0]["query"], repeated[0]["count"], entry["method"], route,
+                extra={"diagnostics": entry}
+            )
+        else:
+            logger.warning("Request chậm %.0fms (%d lệnh DB, %.0fms)", entry["ms"], diag.db_calls, entry["dbMs"], extra={"diagnostics": entry})
+
+
+# Profile lấy mẫu: đọc stack của thread định kỳ, gom thành số lần xuất hiện của từng stack.
+# Không cần thư viện ngoài, chi phí chỉ là mỗi lần lấy mẫu giữ GIL một chút
+class SamplingProfiler:
+    def __init__(self):
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _stack(frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+            frame = frame.f_back
+        stack.reverse()
+        return ";".join(stack)
+
+    # Chạy trong thread riêng; thread_ids = None -> lấy mẫu mọi thread (trừ chính nó)
+    def run(self, seconds: float, interval: float, thread_ids=None):
+        if not self.lock.acquire(blocking=False):
+            return None
+        try:
+            me = threading.get_ident()
+            stacks = Counter()
+            samples = 0
+            deadline = time.monotonic() + seconds
+            while time.monotonic() < deadline:
+                for tid, frame in sys._current_frames().items():
+                    if tid == me or (thread_ids is not None and tid not in thread_ids):
+                        continue
+                    stacks[self._stack(frame)] += 1
+                samples += 1
+                time.sleep(interval)
+            return samples, stacks
+        finally:
+            self.lock.release()
+
+    @property
+    def running(self) -> bool:
+        return self.lock.locked()
+
+
+profiler = SamplingProfiler()
+
+
+# Dạng "collapsed" (mỗi dòng: stack;...;hàm số_lần) dùng được với flamegraph.pl / speedscope
+def collapsed(stacks: Counter) -> str:
+    return "\n".join(f"{stack} {n}" for stack, n in stacks.most_common()) + "\n"
+
+
+# Các hàm tốn nhiều thời gian nhất: self = đang chạy ở hàm đó, total = hàm có trong stack
+def top_functions(stacks: Counter, samples: int, n: int = 30):
+    own, total = Counter(), Counter()
+    for stack, count in stacks.items():
+        frames = stack.split(";")
+        own[frames[-1]] += count
+        for name in set(frames):
+            total[name] += count
+    return [
+        {
+            "function": name,
+            "selfPercent": round(own[name] / samples * 100, 2) if samples else 0,
+            "totalPercent": round(count / samples * 100, 2) if samples else 0
+        }
+        for name, count in total.most_common(n)
+    ]
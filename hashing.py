@@ -0,0 +1,93 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import HTTPException
+from passlib.context import CryptContext
+from dotenv import load_dotenv
+
+load_dotenv()
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+# Số luồng băm chạy song song và số yêu cầu tối đa được phép xếp hàng chờ
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", min(4, os.cpu_count() or 1)))
+HASH_MAX_PENDING = int(os.getenv("HASH_MAX_PENDING", 64))
+
+
+# Chạy hàm trong luồng worker, trả về thời điểm bắt đầu để tính thời gian chờ
+def _timed_call(fn, *args):
+    started = time.perf_counter()
+    return started, fn(*args)
+
+
+# Pool băm mật khẩu chạy ngoài event loop (bcrypt nhả GIL khi tính toán)
+class HashPool:
+    def __init__(self, workers: int, max_pending: int):
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+
+        # Các biến đếm chỉ được cập nhật trên event loop
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.run_total = 0.0
+
+    async def run(self, fn, *args):
+        # Hàng đợi đầy -> từ chối sớm thay vì để request treo
+        if self.in_flight >= self.workers + self.max_pending:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=503,
+                detail="Máy chủ đang bận, vui lòng thử lại sau",
+                headers={"Retry-After": "1"}
+            )
+
+        loop = asyncio.get_running_loop()
+        self.in_flight += 1
+        submitted = time.perf_counter()
+        try:
+            started, result = await loop.run_in_executor(self._executor, _timed_call, fn, *args)
+        finally:
+            self.in_flight -= 1
+
+        finished = time.perf_counter()
+        wait = started - submitted
+        self.completed += 1
+        self.wait_total += wait
+        self.wait_max = max(self.wait_max, wait)
+        self.run_total += finished - started
+        return result
+
+    def stats(self):
+        completed = self.completed or 1
+        return {
+            "workers": self.workers,
+            "maxPending": self.max_pending,
+            "inFlight": self.in_flight,
+            "queued": max(0, self.in_flight - self.workers),
+            "saturated": self.in_flight >= self.workers,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "avgWaitMs": round(self.wait_total / completed * 1000, 2),
+            "maxWaitMs": round(self.wait_max * 1000, 2),
+            "avgRunMs": round(self.run_total / completed * 1000, 2)
+        }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+hash_pool = HashPool(HASH_WORKERS, HASH_MAX_PENDING)
+
+
+# Hàm mã hóa password
+async def hash_password(password: str) -> str:
+    return await hash_pool.run(pwd_context.hash, password)
+
+# Hàm kiểm tra password
+async def check_password(plain_password: str, hashed_password: str) -> bool:
+    return await hash_pool.run(pwd_context.verify, plain_password, hashed_password)
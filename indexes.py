@@ -0,0 +1,211 @@
+import logging
+import asyncio
+import os
+from bson import ObjectId
+from datetime import datetime
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+from dotenv import load_dotenv
+from database import db, connect_db, close_db
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# Bật kiểm tra explain() khi khởi động: có query nào COLLSCAN thì server không chạy
+INDEX_EXPLAIN_CHECK = os.getenv("INDEX_EXPLAIN_CHECK", "0") == "1"
+
+# Danh sách index của từng collection
+INDEXES = {
+    "users": [
+        IndexModel([("email", ASCENDING)], name="email")
+    ],
+    "houses": [
+        IndexModel([("ownerId", ASCENDING), ("_id", ASCENDING)], name="ownerId__id")
+    ],
+    "home_members": [
+        # Dùng cho kiểm tra quyền theo (houseId, userId, status)
+        IndexModel([("houseId", ASCENDING), ("userId", ASCENDING), ("status", ASCENDING)], name="houseId_userId_status"),
+        # Các index kết thúc bằng _id phục vụ phân trang theo cursor
+        IndexModel([("houseId", ASCENDING), ("_id", ASCENDING)], name="houseId__id"),
+        IndexModel([("userId", ASCENDING), ("status", ASCENDING), ("_id", ASCENDING)], name="userId_status__id")
+    ],
+    "rooms": [
+        IndexModel([("houseId", ASCENDING), ("_id", ASCENDING)], name="houseId__id")
+    ],
+    "devices": [
+        IndexModel([("houseId", ASCENDING), ("_id", ASCENDING)], name="houseId__id"),
+        IndexModel([("roomId", ASCENDING), ("_id", ASCENDING)], name="roomId__id")
+    ],
+    "commands": [
+        IndexModel([("deviceId", ASCENDING), ("createdAt", DESCENDING)], name="deviceId_createdAt"),
+        IndexModel([("deviceId", ASCENDING), ("endpointId", ASCENDING)], name="deviceId_endpointId")
+    ],
+    "auto_off_rules": [
+        IndexModel([("deviceId", ASCENDING), ("endpointId", ASCENDING)], name="deviceId_endpointId"),
+        IndexModel([("enabled", ASCENDING)], name="enabled")
+    ],
+    "schedules": [
+        IndexModel([("enabled", ASCENDING), ("nextRunAt", ASCENDING)], name="enabled_nextRunAt"),
+        IndexModel([("deviceId", ASCENDING), ("endpointId", ASCENDING)], name="deviceId_endpointId"),
+        IndexModel([("deviceId", ASCENDING), ("_id", ASCENDING)], name="deviceId__id")
+    ],
+    "refresh_tokens": [
+        # Token cũ (trước khi băm) không có tokenHash -> sparse để không bị trùng null
+        IndexModel([("tokenHash", ASCENDING)], unique=True, sparse=True, name="tokenHash_sparse_unique"),
+        IndexModel([("usedHashes", ASCENDING)], name="usedHashes"),
+        # MongoDB tự xóa token hết hạn
+        IndexModel([("expiresAt", ASCENDING)], expireAfterSeconds=0, name="expiresAt_ttl")
+    ],
+    "usage_rollups": [
+        IndexModel(
+            [("deviceId", ASCENDING), ("endpointId", ASCENDING), ("period", ASCENDING), ("bucket", ASCENDING)],
+            unique=True, name="deviceId_endpointId_period_bucket_unique"
+        ),
+        IndexModel([("deviceId", ASCENDING), ("period", ASCENDING), ("bucket", ASCENDING)], name="deviceId_period_bucket"),
+        IndexModel([("houseId", ASCENDING), ("period", ASCENDING), ("bucket", ASCENDING)], name="houseId_period_bucket")
+    ],
+    "condition_rules": [
+        IndexModel([("houseId", ASCENDING), ("_id", ASCENDING)], name="houseId__id"),
+        IndexModel([("roomId", ASCENDING)], name="roomId"),
+        IndexModel([("targetDeviceId", ASCENDING), ("targetEndpointId", ASCENDING)], name="targetDeviceId_targetEndpointId"),
+        IndexModel([("enabled", ASCENDING)], name="enabled")
+    ],
+    "house_changes": [
+        IndexModel([("houseId", ASCENDING), ("seq", ASCENDING)], unique=True, name="houseId_seq_unique"),
+        IndexModel([("houseId", ASCENDING), ("at", ASCENDING)], name="houseId_at"),
+        IndexModel([("at", ASCENDING)], name="at")
+    ]
+}
+
+
+# Index cũ đã đổi cấu hình: xóa trước khi tạo bản mới (cùng key, khác option thì MongoDB không cho tạo)
+OBSOLETE_INDEXES = {
+    # Bản đầu dùng partialFilterExpression, query bằng tokenHash không dùng được index đó
+    "refresh_tokens": ["tokenHash_unique"]
+}
+
+# MongoDB: collection / index không tồn tại
+NOT_FOUND_CODES = {26, 27}
+
+
+# Tạo index theo danh sách trên, index đã tồn tại thì MongoDB bỏ qua
+async def ensure_indexes():
+    for collection, names in OBSOLETE_INDEXES.items():
+        for name in names:
+            try:
+                await db[collection].drop_index(name)
+                logger.info("Đã xóa index cũ %s.%s", collection, name)
+            except OperationFailure as e:
+                if e.code not in NOT_FOUND_CODES:
+                    logger.error("Lỗi xóa index cũ %s.%s: %s", collection, name, e)
+
+    for collection, models in INDEXES.items():
+        try:
+            await db[collection].create_indexes(models)
+        except OperationFailure as e:
+            # Index cùng tên nhưng khác cấu hình -> báo lỗi, không chặn server khởi động
+            logger.error("Lỗi tạo index cho %s: %s", collection, e)
+    logger.info("Đã kiểm tra index cho các collection")
+
+
+# Các dạng query mà router / scheduler / ingest dùng: (collection, filter, sort)
+_ID = ObjectId()
+_SID = str(_ID)
+QUERY_SHAPES = [
+    ("users", {"email": "a@b.c"}, None),
+    ("users", {"_id": _ID}, None),
+    ("houses", {"_id": _ID}, None),
+    ("houses", {"ownerId": _SID}, [("_id", ASCENDING)]),
+    ("home_members", {"houseId": _SID}, [("_id", ASCENDING)]),
+    ("home_members", {"houseId": _SID, "userId": _SID}, None),
+    ("home_members", {"houseId": _SID, "userId": _SID, "status": "ACCEPTED"}, None),
+    ("home_members", {"houseId": _SID, "status": "ACCEPTED"}, None),
+    ("home_members", {"userId": _SID, "status": "PENDING"}, [("_id", ASCENDING)]),
+    ("rooms", {"houseId": _SID}, [("_id", ASCENDING)]),
+    ("devices", {"houseId": _SID}, [("_id", ASCENDING)]),
+    ("devices", {"roomId": _SID}, [("_id", ASCENDING)]),
+    ("devices", {"_id": _ID}, None),
+    # routing.load: nạp roomId / endpoint của mọi thiết bị đã gắn phòng
+    ("devices", {"roomId": {"$exists": True}}, None),
+    ("devices", {"_id": _ID, "endpoints": {"$elemMatch": {"id": 1, "lastUpdated": {"$not": {"$gt": datetime.now()}}}}}, None),
+    ("devices", {"_id": _ID, "endpoints.id": 1}, None),
+    ("commands", {"deviceId": _SID}, [("createdAt", DESCENDING)]),
+    ("commands", {"deviceId": _SID, "endpointId": 1}, None),
+    ("auto_off_rules", {"enabled": True}, None),
+    ("auto_off_rules", {"deviceId": _SID}, None),
+    ("auto_off_rules", {"deviceId": {"$in": [_SID]}}, None),
+    ("auto_off_rules", {"deviceId": _SID, "endpointId": 1}, None),
+    ("schedules", {"enabled": True, "nextRunAt": {"$lte": datetime.now()}}, None),
+    ("schedules", {"deviceId": _SID}, [("_id", ASCENDING)]),
+    ("schedules", {"deviceId": _SID, "endpointId": 1}, None),
+    ("schedules", {"deviceId": {"$in": [_SID]}}, None),
+    ("condition_rules", {"enabled": True}, None),
+    ("condition_rules", {"_id": _ID}, None),
+    # conditions._fire: giành lượt kích hoạt giữa các replica
+    ("condition_rules", {"_id": _ID, "enabled": True, "$or": [{"lastFiredAt": None}, {"lastFiredAt": {"$lte": datetime.now()}}]}, None),
+    ("condition_rules", {"houseId": _SID}, None),
+    ("condition_rules", {"houseId": _SID}, [("_id", ASCENDING)]),
+    ("condition_rules", {"roomId": _SID}, None),
+    ("condition_rules", {"targetDeviceId": {"$in": [_SID]}}, None),
+    ("condition_rules", {"targetDeviceId": _SID, "targetEndpointId": 1}, None),
+    ("refresh_tokens", {"tokenHash": "x"}, None),
+    ("refresh_tokens", {"usedHashes": "x"}, None),
+    ("house_changes", {"houseId": _SID, "seq": {"$gt": 0, "$lte": 10}}, [("seq", ASCENDING)]),
+    # get_changes: quét lại các bản ghi ghi chậm trong khoảng CHANGES_SETTLE_SECONDS
+    ("house_changes", {"houseId": _SID, "seq": {"$lte": 10}, "$or": [{"seq": {"$gt": 0}}, {"at": {"$gte": datetime.now()}}]}, [("seq", ASCENDING)]),
+    ("house_changes", {"at": {"$lt": datetime.now()}}, None),
+    ("house_changes", {"at": {"$gte": datetime.now()}}, None),
+    ("house_changes", {"houseId": _SID}, [("seq", DESCENDING)]),
+    ("house_changes", {"houseId": _SID, "seq": {"$in": [1, 2]}}, None),
+    ("usage_rollups", {"houseId": _SID, "period": "day", "bucket": {"$gte": "a", "$lte": "b"}}, [("bucket", ASCENDING)]),
+    ("usage_rollups", {"deviceId": _SID, "period": "day", "bucket": {"$gte": "a", "$lte": "b"}}, [("bucket", ASCENDING)]),
+    ("usage_rollups", {"deviceId": _SID, "endpointId": 1, "period": "day", "bucket": {"$gte": "a", "$lte": "b"}}, [("bucket", ASCENDING)])
+]
+
+
+# Tìm các stage trong plan
+def _plan_stages(plan):
+    stages = [plan.get("stage")]
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            stages += _plan_stages(plan[key])
+    for child in plan.get("inputStages", []):
+        stages += _plan_stages(child)
+    return stages
+
+
+# Chạy explain() cho mọi dạng query, báo lỗi nếu có query quét toàn bộ collection
+async def check_query_plans():
+    failures = []
+    for collection, query, sort in QUERY_SHAPES:
+        find_cmd = {"find": collection, "filter": query}
+        if sort:
+            find_cmd["sort"] = dict(sort)
+
+        explain = await db.command({"explain": find_cmd, "verbosity": "queryPlanner"})
+        stages = _plan_stages(explain["queryPlanner"]["winningPlan"])
+        if "COLLSCAN" in stages:
+            failures.append(f"{collection} {query}")
+        elif "SORT" in stages:
+            # Sort trong bộ nhớ nghĩa là index không phủ được thứ tự
+            failures.append(f"{collection} {query} (sort trong bộ nhớ)")
+
+    if failures:
+        raise RuntimeError("Query không dùng index:\n" + "\n".join(failures))
+
+    logger.info("Explain OK: %d dạng query đều dùng index", len(QUERY_SHAPES))
+
+
+# Chạy tay: python indexes.py
+async def _main():
+    await connect_db()
+    try:
+        await ensure_indexes()
+        await check_query_plans()
+    finally:
+        await close_db()
+
+
+if __name__ == "__main__":
+    asyncio.run(_main())
@@ -0,0 +1,186 @@
+import logging
+import asyncio
+import json
+import os
+from datetime import datetime
+from bson import ObjectId
+from pymongo.errors import PyMongoError
+from dotenv import load_dotenv
+from database import db
+from changes import record_change
+from realtime import hub
+from routing import routing
+from usage import usage
+from conditions import conditions
+from wal import wal
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# Endpoint cảm biến nhận message "{room}/status"
+SENSOR_ENDPOINT_ID = 4
+# Thời gian chờ tối đa 1 lần ghi DB trước khi chuyển bản ghi sang WAL (giây)
+INGEST_DB_TIMEOUT = float(os.getenv("INGEST_DB_TIMEOUT", 2))
+# Số lần ghi DB đang chờ tối đa, nhiều hơn (DB chậm / nghẽn) thì ghi vào WAL
+INGEST_MAX_INFLIGHT = int(os.getenv("INGEST_MAX_INFLIGHT", 200))
+
+inflight = 0
+# False sau khi ghi DB lỗi, tới khi WAL replay thành công 1 bản ghi
+db_available = True
+
+
+# Giải mã message MQTT "{roomId}/device" hoặc "{roomId}/status" thành các bản ghi cập nhật endpoint
+# at: thời điểm nhận (epoch giây), dùng để bỏ qua bản ghi cũ hơn giá trị đang có trong DB
+def decode_message(topic: str, payload_str: str):
+    parts = topic.split("/")
+    if len(parts) != 2:
+        return []
+    room_id, type_msg = parts
+    at = datetime.now().timestamp()
+
+    try:
+        data = json.loads(payload_str)
+    except json.JSONDecodeError:
+        data = payload_str
+
+    updates = []
+    if type_msg == "device":
+        if not isinstance(data, dict):
+            logger.warning("Payload device phải là JSON Object", extra={"room": room_id})
+            return []
+        for key, val in data.items():
+            if not key.startswith("device"):
+                continue
+            try:
+                endpoint_id = int(key.replace("device", ""))
+            except ValueError:
+                continue
+            updates.append({"kind": "device", "room": room_id, "ep": endpoint_id, "value": val, "at": at})
+
+    elif type_msg == "status":
+        updates.append({"kind": "status", "room": room_id, "ep": SENSOR_ENDPOINT_ID, "value": data, "at": at})
+
+    return updates
+
+
+# Ghi 1 bản ghi vào DB. Chỉ ghi đè khi giá trị trong DB cũ hơn bản ghi,
+# nên áp dụng lại nhiều lần hoặc không đúng thứ tự (replay từ WAL) vẫn cho kết quả đúng.
+# Chỉ lần ghi thiết bị chịu timeout (quá hạn -> ghi vào WAL); thống kê / change log chạy sau khi ghi thành công
+async def apply_update(update: dict):
+    room_id, endpoint_id, val = update["room"], update["ep"], update["value"]
+    # MongoDB lưu thời gian tới ms: làm tròn trước để so được với lastUpdated đã lưu
+    at = datetime.fromtimestamp(update["at"])
+    at = at.replace(microsecond=at.microsecond // 1000 * 1000)
+
+    # Thiết bị nhận message lấy từ routing index, không cần query theo roomId
+    device_id = routing.lookup(room_id, endpoint_id)
+    if device_id is None:
+        routing.rejected += 1
+        logger.warning("Không tìm thấy endpoint trong phòng", extra={"room": room_id, "endpoint": endpoint_id})
+        return
+
+    fields = {
+        "endpoints.$.value": val,
+        "endpoints.$.lastUpdated": at,
+        "isOnline": True
+    }
+    if update["kind"] == "device":
+        fields["lastSeenAt"] = at
+
+    device = await asyncio.wait_for(
+        db.devices.find_one_and_update(
+            {
+                "_id": ObjectId(device_id),
+                "endpoints": {"$elemMatch": {"id": endpoint_id, "lastUpdated": {"$not": {"$gt": at}}}}
+            },
+            {"$set": fields},
+            # Trả về document trước khi cập nhật: giá trị cũ của endpoint dùng cho thống kê sử dụng
+            projection={"houseId": 1, "endpoints.$": 1}
+        ),
+        INGEST_DB_TIMEOUT
+    )
+
+    # Không khớp: DB đã có giá trị mới hơn (hoặc endpoint vừa bị xóa)
+    if not device:
+        return
+    prev = device["endpoints"][0] if device.get("endpoints") else {}
+    # Chính bản ghi này đã được ghi trước đó (lần ghi bị timeout nhưng vẫn thành công, rồi replay từ WAL)
+    if prev.get("lastUpdated") == at and prev.get("value") == val:
+        return
+
+    # Replica khác đã ghi cùng message trước (giá trị không đổi) -> không đếm lại lần chuyển trạng thái
+    usage.observe(
+        device["houseId"], device_id, endpoint_id, val, at, prev.get("value"), prev.get("lastUpdated"),
+        changed=prev.get("value") != val
+    )
+    data = {"value": val, "lastUpdated": at}
+    if update["kind"] == "status":
+        # Dữ liệu cảm biến gửi liên tục: chỉ đẩy realtime (không có seq), không tăng phiên bản nhà / ghi change log,
+        # để snapshot và danh sách thiết bị vẫn trả 304 khi cấu trúc / trạng thái nhà không đổi
+        hub.publish(device["houseId"], {"entity": "endpoint", "id": f"{device_id}:{endpoint_id}", "op": "update", "data": data})
+    else:
+        # Giá trị đã ghi xong: lỗi change log không được đẩy bản ghi vào WAL (replay sẽ bị bỏ qua ở trên)
+        try:
+            await record_change(device["houseId"], "endpoint", f"{device_id}:{endpoint_id}", "update", data)
+        except PyMongoError as e:
+            logger.error("Lỗi ghi change log endpoint: %s", e, extra={"device": device_id, "endpoint": endpoint_id})
+    if update["kind"] == "device":
+        logger.debug("Update endpoint = %s", val, extra={"room": room_id, "device": device_id, "endpoint": endpoint_id})
+    else:
+        logger.debug("Update sensor: %s", val, extra={"room": room_id, "device": device_id})
+
+
+# Replay 1 bản ghi từ WAL; thành công nghĩa là DB đã hoạt động lại -> message mới ghi thẳng vào DB
+async def replay_update(update: dict):
+    global db_available
+    await apply_update(update)
+    db_available = True
+
+
+# Ghi thẳng vào DB; DB lỗi / chậm hoặc quá nhiều lần ghi đang chờ thì ghi vào WAL (không mất dữ liệu).
+# Bản ghi mới không cần chờ WAL replay xong: apply_update bỏ qua giá trị cũ hơn DB nên thứ tự không quan trọng
+async def submit(update: dict):
+    global inflight, db_available
+    if not db_available or inflight >= INGEST_MAX_INFLIGHT:
+        wal.append(update)
+        return
+
+    inflight += 1
+    try:
+        await apply_update(update)
+    except (PyMongoError, asyncio.TimeoutError) as e:
+        # Chờ replay thành công mới thử ghi thẳng lại, tránh mỗi message đều chờ timeout khi DB đang lỗi
+        if db_available:
+            logger.warning("Lỗi ghi DB, chuyển vào WAL: %s", e)
+        db_available = False
+        wal.append(update)
+    finally:
+        inflight -= 1
+
+
+async def ingest_message(topic: str, payload_str: str):
+    for update in decode_message(topic, payload_str):
+        # Phòng không có thiết bị nào -> bỏ luôn, không ghi DB / WAL
+        if not routing.has_room(update["room"]):
+            routing.rejected += 1
+            continue
+        # Luật theo điều kiện chạy ngay khi nhận message, không chờ ghi DB
+        conditions.evaluate(update)
+        await submit(update)
+
+
+async def start_ingest():
+    await routing.start()
+    await conditions.load()
+    await wal.open()
+    wal.start(replay_update)
+
+
+async def stop_ingest():
+    await wal.close()
+    await routing.stop()
+
+
+def ingest_stats():
+    return {"inflight": inflight, "maxInflight": INGEST_MAX_INFLIGHT, "dbAvailable": db_available, "routing": routing.stats(), "conditions": conditions.stats(), "wal": wal.stats()}
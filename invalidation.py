@@ -0,0 +1,226 @@
+import logging
+import asyncio
+import os
+import socket
+import time
+from datetime import datetime
+from pymongo.errors import OperationFailure, PyMongoError
+from dotenv import load_dotenv
+from database import db
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# Bật bus hủy cache qua change stream (cần MongoDB replica set, standalone thì tự tắt)
+INVALIDATION_BUS = os.getenv("INVALIDATION_BUS", "1") == "1"
+# Tên replica này, mỗi replica lưu resume token riêng
+INVALIDATION_CONSUMER = os.getenv("INVALIDATION_CONSUMER", socket.gethostname())
+# Lưu resume token xuống DB tối đa 1 lần mỗi n giây
+INVALIDATION_TOKEN_SAVE_SECONDS = float(os.getenv("INVALIDATION_TOKEN_SAVE_SECONDS", 5))
+
+TOKENS_COLLECTION = "change_stream_tokens"
+
+# MongoDB không phải replica set
+CHANGE_STREAM_NOT_SUPPORTED = 40573
+# Resume token đã ra khỏi oplog / không hợp lệ
+RESUME_FAILED_CODES = {260, 280, 286}
+
+# collection -> cấu hình watch
+#   lookup: lấy document đầy đủ khi update (chỉ dùng cho collection ít ghi)
+#   before: lấy document trước khi xóa (cần bật changeStreamPreAndPostImages, MongoDB 6.0+)
+#   fields: chỉ nhận update chạm tới các field khớp regex này (bỏ qua update trạng thái endpoint...)
+WATCHED = {
+    "devices": {"fields": r"^(houseId|roomId|endpoints(\.\d+)?)$"},
+    "home_members": {"lookup": True, "before": True},
+    "houses": {"fields": r"^ownerId$"},
+    "auto_off_rules": {"lookup": True, "before": True},
+    "schedules": {"lookup": True, "before": True},
+    # Bỏ qua update chỉ đổi lastFiredAt (mỗi lần luật kích hoạt)
+    "condition_rules": {"lookup": True, "before": True, "fields": r"^(?!lastFiredAt$)"}
+}
+
+
+class InvalidationEvent:
+    __slots__ = ("collection", "op", "id", "doc", "fields")
+
+    def __init__(self, collection: str, op: str, id: str, doc: dict = None, fields: list = None):
+        self.collection = collection
+        # "insert" / "update" / "replace" / "delete"
+        self.op = op
+        self.id = id
+        # Document sau thay đổi (insert/lookup) hoặc trước khi xóa; None nếu không có
+        self.doc = doc
+        # Các field đã đổi (update), dạng "endpoints.2" / "roomId"
+        self.fields = fields or []
+
+    def __repr__(self):
+        return f"InvalidationEvent({self.collection}, {self.op}, {self.id})"
+
+
+def _pipeline(spec: dict):
+    pipeline = [
+        {"$match": {"operationType": {"$in": ["insert", "update", "replace", "delete"]}}},
+        {"$addFields": {"fields": {"$map": {
+            "input": {"$objectToArray": {"$ifNull": ["$updateDescription.updatedFields", {}]}},
+            "in": "$$this.k"
+        }}}}
+    ]
+    if spec.get("fields"):
+        removed = "updateDescription.removedFields"
+        pipeline.append({"$match": {"$or": [
+            {"operationType": {"$ne": "update"}},
+            {"fields": {"$regex": spec["fields"]}},
+            {removed: {"$regex": spec["fields"]}}
+        ]}})
+    # Không gửi giá trị các field đã đổi, chỉ cần tên field
+    pipeline.append({"$project": {"updateDescription": 0}})
+    return pipeline
+
+
+class InvalidationBus:
+    def __init__(self):
+        # collection -> list handler(event)
+        self.handlers = {}
+        # Gọi khi có thể đã bỏ lỡ sự kiện (resume thất bại) -> cache phải xóa toàn bộ
+        self.reset_handlers = []
+        self.tasks = []
+        # Task do handler tạo ra, giữ tham chiếu tới khi chạy xong
+        self.pending = set()
+        self.enabled = False
+        self.events = {name: 0 for name in WATCHED}
+        self.resets = 0
+        self.errors = 0
+
+    # Đăng ký handler cho 1 collection (dùng làm decorator)
+    def on(self, collection: str):
+        def decorator(handler):
+            self.handlers.setdefault(collection, []).append(handler)
+            return handler
+        return decorator
+
+    def on_reset(self, handler):
+        self.reset_handlers.append(handler)
+        return handler
+
+    def dispatch(self, event: InvalidationEvent):
+        self.events[event.collection] = self.events.get(event.collection, 0) + 1
+        for handler in self.handlers.get(event.collection, []):
+            try:
+                handler(event)
+            except Exception:
+                self.errors += 1
+                logger.exception("Lỗi handler invalidation %s", event)
+
+    # Handler là hàm đồng bộ: việc async chạy thành task riêng (event loop chỉ giữ weak reference tới task)
+    def spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self.pending.add(task)
+        task.add_done_callback(self.pending.discard)
+        return task
+
+    def reset(self):
+        self.resets += 1
+        for handler in self.reset_handlers:
+            handler()
+
+    async def _load_token(self, collection: str):
+        doc = await db[TOKENS_COLLECTION].find_one({"_id": f"{INVALIDATION_CONSUMER}:{collection}"})
+        return doc["token"] if doc else None
+
+    async def _save_token(self, collection: str, token):
+        await db[TOKENS_COLLECTION].update_one(
+            {"_id": f"{INVALIDATION_CONSUMER}:{collection}"},
+            {"$set": {"token": token, "updatedAt": datetime.now()}},
+            upsert=True
+        )
+
+    async def _enable_pre_images(self, collection: str):
+        try:
+            await db.command({"collMod": collection, "changeStreamPreAndPostImages": {"enabled": True}})
+        except PyMongoError:
+            # MongoDB cũ hoặc collection chưa tồn tại: delete sẽ không có document cũ
+            pass
+
+    def _to_event(self, collection: str, change: dict) -> InvalidationEvent:
+        doc = change.get("fullDocument") or change.get("fullDocumentBeforeChange")
+        return InvalidationEvent(
+            collection,
+            change["operationType"],
+            str(change["documentKey"]["_id"]),
+            doc,
+            change.get("fields")
+        )
+
+    async def _watch(self, collection: str, spec: dict):
+        token = await self._load_token(collection)
+        saved_token, saved_at = token, time.monotonic()
+        options = {}
+        if spec.get("lookup"):
+            options["full_document"] = "updateLookup"
+        if spec.get("before"):
+            await self._enable_pre_images(collection)
+            options["full_document_before_change"] = "whenAvailable"
+
+        backoff = 1
+        while True:
+            try:
+                async with db[collection].watch(_pipeline(spec), resume_after=token, max_await_time_ms=1000, **options) as stream:
+                    backoff = 1
+                    while True:
+                        change = await stream.try_next()
+                        if change is not None:
+                            self.dispatch(self._to_event(collection, change))
+                        token = stream.resume_token
+                        if token != saved_token and time.monotonic() - saved_at >= INVALIDATION_TOKEN_SAVE_SECONDS:
+                            await self._save_token(collection, token)
+                            saved_token, saved_at = token, time.monotonic()
+            except asyncio.CancelledError:
+                if token is not None and token != saved_token:
+                    await self._save_token(collection, token)
+                raise
+            except OperationFailure as e:
+                if e.code == CHANGE_STREAM_NOT_SUPPORTED:
+                    logger.warning("Invalidation bus tắt: MongoDB không phải replica set (%s)", e)
+                    return
+                if e.code in RESUME_FAILED_CODES and token is not None:
+                    # Không resume được -> có thể đã mất sự kiện, xóa toàn bộ cache rồi bắt đầu lại
+                    logger.warning("Invalidation bus: không resume được %s, xóa toàn bộ cache", collection)
+                    token = None
+                    self.reset()
+                    continue
+                self.errors += 1
+                logger.error("Lỗi change stream %s: %s", collection, e)
+            except PyMongoError as e:
+                self.errors += 1
+                logger.error("Lỗi change stream %s: %s", collection, e)
+
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 30)
+
+    async def start(self):
+        if not INVALIDATION_BUS or self.tasks:
+            return
+        self.enabled = True
+        self.tasks = [asyncio.create_task(self._watch(name, spec)) for name, spec in WATCHED.items()]
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        self.enabled = False
+
+    def stats(self):
+        running = sum(1 for t in self.tasks if not t.done())
+        return {
+            "enabled": self.enabled,
+            "consumer": INVALIDATION_CONSUMER,
+            "streams": running,
+            "events": dict(self.events),
+            "resets": self.resets,
+            "errors": self.errors
+        }
+
+
+bus = InvalidationBus()
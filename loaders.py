@@ -0,0 +1,47 @@
+from bson import ObjectId
+from database import db
+
+# Không bao giờ lấy các trường nhạy cảm khi nạp entity phụ cho danh sách
+DEFAULT_PROJECTIONS = {
+    "users": {"passwordHash": 0}
+}
+
+
+# Loader theo từng request: gom id lại, mỗi collection chỉ 1 query $in,
+# entity đã nạp (kể cả không tồn tại) được nhớ lại nên không bao giờ lấy 2 lần
+class Loader:
+    def __init__(self, projections: dict = None):
+        self.projections = projections if projections is not None else DEFAULT_PROJECTIONS
+        self._cache = {}
+        self.queries = 0
+
+    # Trả về dict id -> document (None nếu không tồn tại)
+    async def load_many(self, collection: str, ids):
+        ids = [str(i) for i in ids if i is not None]
+        missing = [i for i in dict.fromkeys(ids) if (collection, i) not in self._cache]
+
+        if missing:
+            self.queries += 1
+            cursor = db[collection].find(
+                {"_id": {"$in": [ObjectId(i) for i in missing]}},
+                self.projections.get(collection)
+            )
+            async for doc in cursor:
+                self._cache[(collection, str(doc["_id"]))] = doc
+            for i in missing:
+                self._cache.setdefault((collection, i), None)
+
+        return {i: self._cache[(collection, i)] for i in ids}
+
+    async def load(self, collection: str, id):
+        docs = await self.load_many(collection, [id])
+        return docs.get(str(id))
+
+    # Đưa document đã có sẵn vào cache để các lần load sau không query lại
+    def prime(self, collection: str, doc: dict):
+        self._cache[(collection, str(doc["_id"]))] = doc
+
+
+# Dependency cho FastAPI: mỗi request nhận 1 Loader mới
+def get_loader():
+    return Loader()
@@ -0,0 +1,214 @@
+import json
+import logging
+import logging.handlers
+import os
+import queue
+from contextvars import ContextVar
+from datetime import datetime
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Mức log mặc định
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# Mức log riêng cho từng logger, vd "ingest=WARNING,scheduler=DEBUG"
+LOG_LEVELS = os.getenv("LOG_LEVELS", "")
+# "json" (1 dòng JSON / bản ghi) hoặc "text" (dễ đọc khi chạy local)
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+# Số bản ghi chờ ghi tối đa, đầy thì bỏ bản ghi mới (event loop không bao giờ bị chặn vì log)
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))
+# Tối đa n bản ghi mỗi giây cho cùng 1 mẫu message (0 = không giới hạn)
+LOG_RATE_LIMIT = int(os.getenv("LOG_RATE_LIMIT", 20))
+
+LEVELS = ("DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL")
+
+# Ngữ cảnh gắn vào mọi bản ghi trong cùng task (room, device, topic...)
+log_context = ContextVar("log_context", default=None)
+# Scope ASGI của request đang xử lý, route được đọc lúc ghi log (sau khi router đã khớp)
+request_scope = ContextVar("request_scope", default=None)
+
+# Các thuộc tính sẵn có của LogRecord, phần còn lại là field thêm qua extra / ngữ cảnh
+_STANDARD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+
+def bind(**fields):
+    current = log_context.get()
+    return log_context.set({**current, **fields} if current else fields)
+
+
+def unbind(token):
+    log_context.reset(token)
+
+
+# Thêm ngữ cảnh vào bản ghi (chạy ở luồng gọi log, trước khi đưa vào hàng đợi)
+class ContextFilter(logging.Filter):
+    def filter(self, record):
+        fields = log_context.get()
+        if fields:
+            for key, value in fields.items():
+                if not hasattr(record, key):
+                    setattr(record, key, value)
+        scope = request_scope.get()
+        if scope is not None:
+            route = scope.get("route")
+            record.method = scope.get("method")
+            record.route = getattr(route, "path", None) or scope.get("path")
+        return True
+
+
+# Giới hạn số bản ghi mỗi giây theo (logger, mẫu message); số bản ghi bị bỏ được báo ở bản ghi kế tiếp
+class RateLimitFilter(logging.Filter):
+    def __init__(self, rate: int):
+        super().__init__()
+        self.rate = rate
+        # (logger, msg) -> [bắt đầu cửa sổ, số bản ghi, số bị bỏ]
+        self.windows = {}
+        self.suppressed = 0
+
+    def filter(self, record):
+        if not self.rate:
+            return True
+        key = (record.name, record.msg)
+        window = self.windows.get(key)
+        if window is None or record.created - window[0] >= 1:
+            if len(self.windows) > 10000:
+                self.windows.clear()
+            if window is not None and window[2]:
+                record.suppressed = window[2]
+            window = self.windows[key] = [record.created, 0, 0]
+        if window[1] >= self.rate:
+            window[2] += 1
+            self.suppressed += 1
+            return False
+        window[1] += 1
+        return True
+
+
+# Chỉ đưa bản ghi vào hàng đợi; định dạng và ghi ra stdout do luồng listener làm
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Ghép args ngay (args có thể bị sửa sau đó), exception chuyển thành text
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage()
+        }
+        for key, value in vars(record).items():
+            if key not in _STANDARD_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        extra = " ".join(
+            f"{k}={v}" for k, v in vars(record).items()
+            if k not in _STANDARD_ATTRS and not k.startswith("_")
+        )
+        line = f"{datetime.fromtimestamp(record.created):%H:%M:%S} {record.levelname:<7} {record.name}: {record.getMessage()}"
+        if extra:
+            line += f" [{extra}]"
+        if record.exc_text:
+            line += "\n" + record.exc_text
+        return line
+
+
+_handler = None
+_listener = None
+_rate_limit = RateLimitFilter(LOG_RATE_LIMIT)
+
+
+def set_level(name: str, level: str):
+    level = level.upper()
+    if level not in LEVELS:
+        raise ValueError(level)
+    logging.getLogger(name or None).setLevel(level)
+
+
+def get_levels():
+    levels = {"root": logging.getLevelName(logging.getLogger().level)}
+    for name, logger in logging.root.manager.loggerDict.items():
+        if isinstance(logger, logging.Logger) and logger.level != logging.NOTSET:
+            levels[name] = logging.getLevelName(logger.level)
+    return levels
+
+
+# Gọi 1 lần khi import main: gắn handler hàng đợi vào root logger và chạy luồng ghi log
+def setup_logging():
+    global _handler, _listener
+    if _listener is not None:
+        return
+
+    output = logging.StreamHandler()
+    output.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else TextFormatter())
+
+    _handler = NonBlockingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    _handler.addFilter(ContextFilter())
+    _handler.addFilter(_rate_limit)
+
+    root = logging.getLogger()
+    root.addHandler(_handler)
+    root.setLevel(LOG_LEVEL)
+    for item in filter(None, (s.strip() for s in LOG_LEVELS.split(","))):
+        name, _, level = item.partition("=")
+        set_level(name.strip(), level.strip())
+
+    _listener = logging.handlers.QueueListener(_handler.queue, output)
+    _listener.start()
+
+
+# Ghi nốt các bản ghi còn trong hàng đợi rồi dừng luồng ghi log
+def stop_logging():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def log_stats():
+    return {
+        "queued": _handler.queue.qsize() if _handler else 0,
+        "queueSize": LOG_QUEUE_SIZE,
+        "dropped": _handler.dropped if _handler else 0,
+        "suppressed": _rate_limit.suppressed,
+        "levels": get_levels()
+    }
+
+
+# Gắn scope request vào ngữ cảnh log để mọi bản ghi trong request có method / route
+class LogContextMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+        token = request_scope.set(scope)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            request_scope.reset(token)
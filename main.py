@@ -1,16 +1,49 @@
-from fastapi import FastAPI
+import logging
+from fastapi import FastAPI, Depends
+from fastapi.responses import PlainTextResponse
 from contextlib import asynccontextmanager
 import asyncio
-from database import db
-from routers import users, houses, rooms, devices, automations, members
+import time
+from database import connect_db, close_db, pool_stats
+from routers import users, houses, rooms, devices, automations, members, system, realtime
 from mqtt_client import mqtt
-from datetime import datetime
-import json
 from scheduler import run_scheduler
+from hashing import hash_pool
+from indexes import ensure_indexes, check_query_plans, INDEX_EXPLAIN_CHECK
+from ingest import ingest_message, start_ingest, stop_ingest, ingest_stats
+from invalidation import bus
+from usage import usage
+from realtime import hub
+from wal import wal
+from metrics import registry, MetricsMiddleware, mqtt_messages, mqtt_topic_type, METRICS_ENABLED
+from logs import setup_logging, stop_logging, log_stats, bind, unbind, LogContextMiddleware
+from diagnostics import DiagnosticsMiddleware
+from routers.system import require_diagnostics_token
+
+# Log ghi qua hàng đợi + luồng riêng, event loop không chờ stdout
+setup_logging()
+logger = logging.getLogger(__name__)
 
 # Quản lý vòng đời app(server)
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    # Kết nối MongoDB + mở sẵn kết nối trong pool
+    await connect_db()
+
+    # Tạo index cho mọi collection (chạy lại nhiều lần không sao)
+    await ensure_indexes()
+    if INDEX_EXPLAIN_CHECK:
+        await check_query_plans()
+
+    # Nghe change stream để xóa cache khi replica khác ghi dữ liệu
+    await bus.start()
+
+    # Replay dữ liệu ingest còn trong WAL (nếu lần trước MongoDB lỗi) + ghi WAL khi DB lỗi
+    await start_ingest()
+
+    # Ghi định kỳ thống kê sử dụng endpoint
+    usage.start()
+
     # Khi server khởi động -> chạy Scheduler
     task = asyncio.create_task(run_scheduler())
 
@@ -21,87 +54,67 @@ async def lifespan(app: FastAPI):
 
     # Khi server tắt -> hủy task Scheduler, tắt MQTT
     await mqtt.mqtt_shutdown()
+    await stop_ingest()
     task.cancel()
-    print("Server đang tắt...")
+    await usage.stop()
+    await bus.stop()
+    await close_db()
+    hash_pool.shutdown()
+    logger.info("Server đang tắt...")
+    stop_logging()
 
 app = FastAPI(lifespan=lifespan)
+app.add_middleware(LogContextMiddleware)
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(DiagnosticsMiddleware)
 
 mqtt.init_app(app)
 
 # Đăng ký các Router
 app.include_router(users.router, prefix="/users", tags=["Users"])
 app.include_router(houses.router, prefix="/houses", tags=["Houses"])
+app.include_router(realtime.router, prefix="/houses", tags=["Realtime"])
 app.include_router(rooms.router, prefix="/rooms", tags=["Rooms"])
 app.include_router(devices.router, prefix="/devices", tags=["Devices"])
 app.include_router(automations.router, prefix="/automations", tags=["Automations"])
 app.include_router(members.router, prefix="/members", tags=["Members"])
+app.include_router(system.router, prefix="/system", tags=["System"])
+
+# Metrics đọc từ các bộ đếm sẵn có lúc scrape
+registry.gauge("mongo_pool_in_use", "Số kết nối MongoDB đang được dùng", lambda: pool_stats.snapshot()["inUse"])
+registry.gauge("hash_pool_in_flight", "Số yêu cầu băm mật khẩu đang chạy / chờ", lambda: hash_pool.stats()["inFlight"])
+registry.gauge("ingest_inflight", "Số lần ghi ingest đang chờ DB", lambda: ingest_stats()["inflight"])
+registry.gauge("ingest_wal_bytes", "Dung lượng WAL ingest chưa replay", lambda: wal.stats()["bytes"])
+registry.gauge("realtime_subscribers", "Số kết nối realtime (SSE/WebSocket)", lambda: hub.count)
+registry.gauge("log_dropped", "Số bản ghi log bị bỏ do hàng đợi đầy", lambda: log_stats()["dropped"])
+registry.gauge("log_suppressed", "Số bản ghi log bị bỏ do giới hạn tần suất", lambda: log_stats()["suppressed"])
+
+# Prometheus scrape (cần header X-Diagnostics-Token như các API trạng thái /system/*)
+@app.get("/metrics", include_in_schema=False, dependencies=[Depends(require_diagnostics_token)])
+async def get_metrics():
+    if not METRICS_ENABLED:
+        return PlainTextResponse("metrics disabled\n", status_code=404)
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
 
 # MQTT Event Handlers
 @mqtt.on_connect()
 def connect(client, flags, rc, properties):
-    print("Đã kết nối tới MQTT Broker (HiveMQ)!")
+    logger.info("Đã kết nối tới MQTT Broker (HiveMQ)!")
     mqtt.client.subscribe("+/+")
 
 @mqtt.on_message()
 async def message(client, topic, payload, qos, properties):
+    started = time.perf_counter()
+    # Mọi log trong lúc xử lý message đều có topic / phòng
+    token = bind(topic=topic, room=topic.partition("/")[0])
     try:
         payload_str = payload.decode()
-        print(f"Received message: {topic} -> {payload_str}")
-
-        parts = topic.split("/")
-        if len(parts) == 2:
-            room_id = parts[0]
-            type_msg = parts[1]
-
-            try:
-                data = json.loads(payload_str)
-            except json.JSONDecodeError:
-                data = payload_str
-
-            # Xử lý theo loại message
-            if type_msg == "device":
-                if isinstance(data, dict):
-                    for key, val in data.items():
-                        try:
-                            if key.startswith("device"):
-                                endpoint_id = int(key.replace("device", ""))
-
-                                result = await db.devices.update_one(
-                                    {"roomId": room_id, "endpoints.id": endpoint_id},
-                                    {
-                                        "$set": {
-                                            "endpoints.$.value": val,
-                                            "endpoints.$.lastUpdated": datetime.now(),
-                                            "isOnline": True,
-                                            "lastSeenAt": datetime.now()
-                                        }
-                                    }
-                                )
-                                if result.matched_count > 0:
-                                    print(f"-> Update: Phòng {room_id} - Ep {endpoint_id} = {val}")
-                        except ValueError:
-                            continue
-                else:
-                    print("Lỗi: Payload device phải là JSON Object")
-
-            elif type_msg == "status":
-                SENSOR_ENDPOINT_ID = 4
-
-                result = await db.devices.update_one(
-                    {"roomId": room_id, "endpoints.id": SENSOR_ENDPOINT_ID},
-                    {
-                        "$set": {
-                            "endpoints.$.value": data,
-                            "endpoints.$.lastUpdated": datetime.now(),
-                            "isOnline": True
-                        }
-                    }
-                )
-
-                if result.matched_count > 0:
-                    print(f"-> Update Sensor phòng {room_id}: {data}")
-                else:
-                    print(f"Cảnh báo: Không tìm thấy Sensor (id=4) ở phòng {room_id}")
+        logger.debug("Received message: %s -> %s", topic, payload_str)
+
+        await ingest_message(topic, payload_str)
 
     except Exception as e:
-        print(f"Lỗi xử lý MQTT: {e}")
\ No newline at end of file
+        logger.exception("Lỗi xử lý MQTT: %s", e)
+    finally:
+        unbind(token)
+        mqtt_messages.observe(time.perf_counter() - started, mqtt_topic_type(topic))
@@ -0,0 +1,232 @@
+import os
+import threading
+import time
+from bisect import bisect_left
+from pymongo import monitoring
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Bật /metrics, đo request HTTP và lệnh MongoDB (0 = tắt)
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+# Đo độ trễ từng lệnh MongoDB qua command monitoring của pymongo
+METRICS_MONGO_COMMANDS = os.getenv("METRICS_MONGO_COMMANDS", "1") == "1"
+
+# Bucket mặc định (giây)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Độ trễ kích hoạt lịch hẹn / tự tắt (giây), scheduler quét mỗi 10 giây
+LATENESS_BUCKETS = (0.5, 1.0, 2.5, 5.0, 10.0, 15.0, 30.0, 60.0, 300.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _number(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+# Các metric được ghi từ event loop và từ luồng của driver MongoDB -> mỗi metric có lock riêng
+# (lock không tranh chấp chỉ tốn vài chục ns, rẻ hơn nhiều so với 1 lần ghi DB)
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount: float = 1):
+        with self._lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self):
+        with self._lock:
+            items = list(self.values.items())
+        return [f"{self.name}{_labels(self.label_names, k)} {_number(v)}" for k, v in items]
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.buckets = tuple(buckets)
+        # labels -> [số lần theo bucket (+Inf cuối), tổng]
+        self.series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels):
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self.series.get(labels)
+            if series is None:
+                series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][i] += 1
+            series[1] += value
+
+    def render(self):
+        with self._lock:
+            items = [(k, list(counts), total) for k, (counts, total) in self.series.items()]
+        lines = []
+        for key, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="' + _number(bound) + '"'
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, key)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, key)} {cumulative}")
+        return lines
+
+
+# Giá trị đọc lúc scrape từ các bộ đếm sẵn có (pool, hàng đợi, WAL...)
+class Gauge:
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, fn):
+        self.name = name
+        self.help = help
+        self.fn = fn
+
+    def render(self):
+        try:
+            value = self.fn()
+        except Exception:
+            return []
+        return [] if value is None else [f"{self.name} {_number(value)}"]
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str, labels=()):
+        return self.register(Counter(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def gauge(self, name: str, help: str, fn):
+        return self.register(Gauge(name, help, fn))
+
+    # Định dạng text của Prometheus
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+http_requests = registry.histogram(
+    "http_request_duration_seconds", "Thời gian xử lý request HTTP theo route", ("method", "route", "status")
+)
+mqtt_messages = registry.histogram(
+    "mqtt_message_handler_seconds", "Thời gian xử lý message MQTT nhận được theo loại topic", ("type",)
+)
+mqtt_published = registry.counter(
+    "mqtt_published_total", "Số lệnh MQTT đã gửi tới thiết bị theo nguồn", ("source",)
+)
+scheduler_ticks = registry.histogram(
+    "scheduler_tick_seconds", "Thời gian 1 lượt quét của scheduler"
+)
+scheduler_lateness = registry.histogram(
+    "scheduler_fire_lateness_seconds", "Độ trễ so với thời điểm lẽ ra phải kích hoạt", ("kind",), LATENESS_BUCKETS
+)
+mongo_commands = registry.histogram(
+    "mongo_command_duration_seconds", "Thời gian lệnh MongoDB theo collection và lệnh", ("collection", "command", "status")
+)
+
+
+def mqtt_topic_type(topic: str) -> str:
+    # "{roomId}/device" -> device; giới hạn nhãn để không sinh quá nhiều series
+    kind = topic.rpartition("/")[2]
+    return kind if kind in ("device", "status") else "other"
+
+
+def record_publish(source: str):
+    mqtt_published.inc(source)
+
+
+# Đo từng request HTTP. Nhãn route là mẫu đường dẫn (/devices/{device_id}) để số series có giới hạn;
+# request không khớp route nào gộp vào "unmatched". SSE (text/event-stream) sống lâu nên bỏ qua
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        state = {"status": 500, "stream": False}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                state["status"] = message["status"]
+                for name, value in message.get("headers", ()):
+                    if name == b"content-type" and value.startswith(b"text/event-stream"):
+                        state["stream"] = True
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            if not state["stream"]:
+                route = scope.get("route")
+                path = getattr(route, "path", None) or "unmatched"
+                http_requests.observe(time.perf_counter() - started, scope["method"], path, state["status"])
+
+
+# Command monitoring của pymongo: được gọi từ luồng của driver; tên collection chỉ có ở sự kiện bắt đầu
+class MongoCommandMetrics(monitoring.CommandListener):
+    def __init__(self):
+        # (connection, request_id) -> (collection, command)
+        self.inflight = {}
+
+    def started(self, event):
+        command = event.command
+        name = event.command_name
+        collection = command.get(name)
+        if not isinstance(collection, str):
+            # getMore / killCursors lưu collection ở field "collection"; lệnh admin (ping...) không có
+            collection = command.get("collection", "")
+            if not isinstance(collection, str):
+                collection = ""
+        self.inflight[(event.connection_id, event.request_id)] = (collection, name)
+
+    def _finish(self, event, status: str):
+        labels = self.inflight.pop((event.connection_id, event.request_id), None)
+        if labels is not None:
+            mongo_commands.observe(event.duration_micros / 1e6, labels[0], labels[1], status)
+
+    def succeeded(self, event):
+        self._finish(event, "ok")
+
+    def failed(self, event):
+        self._finish(event, "error")
+
+
+mongo_metrics = MongoCommandMetrics()
@@ -23,11 +23,13 @@ class User(MongoBaseModel):
     status: str = "ACTIVE" # Mặc định là Active
     createdAt: datetime = Field(default_factory=datetime.now) # Mặc định tự lấy thời gian hiện tại
 
-# RefreshToken
+# RefreshToken (mỗi document là 1 "họ" token, xoay vòng tại chỗ)
 class RefreshToken(MongoBaseModel):
     userId: str
-    token: str
+    tokenHash: str # SHA-256 của token hiện tại, không lưu token gốc
+    usedHashes: List[str] = [] # Các token đã dùng để phát hiện dùng lại
     expiresAt: datetime
+    createdAt: datetime = Field(default_factory=datetime.now)
 
 # House
 class House(MongoBaseModel):
@@ -104,6 +106,24 @@ class Schedule(MongoBaseModel):
     nextRunAt: datetime
     timezone: str = "Asia/Ho_Chi_Minh"
 
+# ConditionRule: endpoint (roomId, endpointId) báo giá trị thỏa điều kiện -> gửi lệnh tới thiết bị đích
+class ConditionRule(MongoBaseModel):
+    houseId: str
+    name: str
+    enabled: bool = True
+    roomId: str # Phòng gửi message
+    endpointId: int # Endpoint gửi message (4 = cảm biến)
+    field: str = "value" # Trường trong payload cảm biến (vd temperature), "value" = giá trị của endpoint bật/tắt
+    operator: str # GT, GTE, LT, LTE, EQ, NE
+    threshold: float
+    targetDeviceId: str
+    targetEndpointId: int
+    command: str # TURN_ON, TURN_OFF, SET_VALUE
+    payload: Optional[str] = None
+    cooldownSec: int = 60 # Thời gian tối thiểu giữa 2 lần kích hoạt
+    lastFiredAt: Optional[datetime] = None
+    createdAt: datetime = Field(default_factory=datetime.now)
+
 
 # Models phụ trợ cho API
 # Dùng khi đăng ký tài khoản
@@ -196,4 +216,35 @@ class ScheduleUpdateRequest(BaseModel):
     action: Optional[str] = None
     scheduleType: Optional[str] = None
     nextRunAt: Optional[datetime] = None
-    timezone: Optional[str] = None
\ No newline at end of file
+    timezone: Optional[str] = None
+
+# Request tạo luật theo điều kiện
+class ConditionRuleCreateRequest(BaseModel):
+    houseId: str
+    name: str
+    enabled: bool = True
+    roomId: str
+    endpointId: int
+    field: str = "value"
+    operator: str
+    threshold: float
+    targetDeviceId: str
+    targetEndpointId: int
+    command: str
+    payload: Optional[str] = None
+    cooldownSec: int = 60
+
+class ConditionRuleUpdateRequest(BaseModel):
+    name: Optional[str] = None
+    enabled: Optional[bool] = None
+    field: Optional[str] = None
+    operator: Optional[str] = None
+    threshold: Optional[float] = None
+    command: Optional[str] = None
+    payload: Optional[str] = None
+    cooldownSec: Optional[int] = None
+
+# Đổi mức log lúc đang chạy (logger rỗng = root)
+class LogLevelRequest(BaseModel):
+    logger: str = ""
+    level: str
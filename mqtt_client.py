@@ -5,6 +5,8 @@ import ssl
 
 load_dotenv()
 
+# Broker local (mosquitto chạy benchmark...) thường không có TLS: MQTT_TLS=0
+MQTT_TLS = os.getenv("MQTT_TLS", "1") == "1"
 
 # Cấu hình MQTT
 mqtt_config = MQTTConfig(
@@ -13,8 +15,12 @@ mqtt_config = MQTTConfig(
     username = os.getenv("MQTT_USER"),
     password = os.getenv("MQTT_PASSWORD"),
     keepalive = 60,
-    ssl = ssl.create_default_context()
+    ssl = ssl.create_default_context() if MQTT_TLS else False
 )
 
 # Khởi tạo đối tượng MQTT
-mqtt = FastMQTT(config=mqtt_config)
\ No newline at end of file
+mqtt = FastMQTT(config=mqtt_config)
+
+# Kiểm tra trạng thái kết nối tới MQTT broker
+def is_mqtt_connected() -> bool:
+    return bool(getattr(mqtt.client, "is_connected", False))
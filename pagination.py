@@ -0,0 +1,71 @@
+import base64
+import binascii
+import os
+from typing import Optional
+from bson import ObjectId
+from bson.errors import InvalidId
+from fastapi import HTTPException, Query, Response
+from dotenv import load_dotenv
+from database import db
+
+load_dotenv()
+
+# Số phần tử mặc định / tối đa mỗi trang
+PAGE_SIZE_DEFAULT = int(os.getenv("PAGE_SIZE_DEFAULT", 100))
+PAGE_SIZE_MAX = int(os.getenv("PAGE_SIZE_MAX", 500))
+
+# Header trả về cursor của trang kế tiếp (không có header = trang cuối)
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(last_id: ObjectId) -> str:
+    return base64.urlsafe_b64encode(ObjectId(last_id).binary).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> ObjectId:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        return ObjectId(raw)
+    except (binascii.Error, InvalidId, TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="Cursor không hợp lệ")
+
+
+# Tham số phân trang dùng chung (Depends(PageParams))
+class PageParams:
+    def __init__(
+        self,
+        cursor: Optional[str] = Query(None, description="Giá trị header X-Next-Cursor của trang trước"),
+        limit: int = Query(PAGE_SIZE_DEFAULT, ge=1, le=PAGE_SIZE_MAX)
+    ):
+        self.cursor = cursor
+        self.limit = limit
+        self.after = decode_cursor(cursor) if cursor else None
+
+
+# Cắt kết quả (đã lấy dư 1 phần tử) thành 1 trang và gắn header cursor kế tiếp
+def _finish_page(docs, page: PageParams, response: Response):
+    if len(docs) > page.limit:
+        docs = docs[:page.limit]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(docs[-1]["_id"])
+    return docs
+
+
+# Phân trang query find theo _id tăng dần
+async def paginate(collection: str, query: dict, page: PageParams, response: Response, projection: dict = None):
+    if page.after is not None:
+        query = {"$and": [query, {"_id": {"$gt": page.after}}]}
+
+    cursor = db[collection].find(query, projection).sort("_id", 1).limit(page.limit + 1)
+    docs = await cursor.to_list(length=page.limit + 1)
+    return _finish_page(docs, page, response)
+
+
+# Phân trang aggregation pipeline theo _id tăng dần
+async def paginate_aggregate(collection: str, pipeline: list, page: PageParams, response: Response):
+    stages = list(pipeline)
+    if page.after is not None:
+        stages.append({"$match": {"_id": {"$gt": page.after}}})
+    stages += [{"$sort": {"_id": 1}}, {"$limit": page.limit + 1}]
+
+    docs = await db[collection].aggregate(stages).to_list(length=page.limit + 1)
+    return _finish_page(docs, page, response)
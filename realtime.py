@@ -0,0 +1,145 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict, deque
+from dotenv import load_dotenv
+from serializers import dumps
+
+load_dotenv()
+
+# Số sự kiện tối đa chờ gửi cho 1 subscriber (sau khi gộp)
+REALTIME_QUEUE_SIZE = int(os.getenv("REALTIME_QUEUE_SIZE", 256))
+# Gửi heartbeat (và kiểm tra lại quyền) sau mỗi n giây không có sự kiện
+REALTIME_HEARTBEAT_SECONDS = float(os.getenv("REALTIME_HEARTBEAT_SECONDS", 15))
+# Số subscriber tối đa mỗi process
+REALTIME_MAX_SUBSCRIBERS = int(os.getenv("REALTIME_MAX_SUBSCRIBERS", 10000))
+
+# Mốc histogram độ trễ fan-out (ms): từ lúc publish tới lúc gửi xong cho client
+LATENCY_BUCKETS_MS = [1, 5, 10, 25, 50, 100, 250, 500, 1000]
+
+
+# Hàng đợi của 1 client: mỗi entity chỉ giữ sự kiện mới nhất, client chậm không làm nghẽn ingest
+class Subscriber:
+    def __init__(self, house_id: str, user_id: str, maxsize: int):
+        self.house_id = house_id
+        self.user_id = user_id
+        self.maxsize = maxsize
+        # (entity, id) -> (event đã encode JSON, thời điểm publish)
+        self.pending = OrderedDict()
+        self.ready = asyncio.Event()
+        # Đã phải bỏ sự kiện -> client cần đồng bộ lại qua /changes
+        self.overflowed = False
+
+    # Trả về "coalesced" / "dropped" / None
+    def put(self, key, payload: bytes, published_at: float):
+        result = None
+        if key in self.pending:
+            # Sự kiện cũ của cùng entity chưa kịp gửi -> thay bằng sự kiện mới
+            del self.pending[key]
+            result = "coalesced"
+        elif len(self.pending) >= self.maxsize:
+            self.pending.popitem(last=False)
+            self.overflowed = True
+            result = "dropped"
+        self.pending[key] = (payload, published_at)
+        self.ready.set()
+        return result
+
+    # Chờ tới khi có sự kiện hoặc hết timeout; trả về list (event đã encode, thời điểm publish)
+    async def get(self, timeout: float):
+        if not self.pending:
+            self.ready.clear()
+            try:
+                await asyncio.wait_for(self.ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                return []
+        items = list(self.pending.values())
+        self.pending.clear()
+        return items
+
+
+class RealtimeHub:
+    def __init__(self, queue_size: int, max_subscribers: int):
+        self.queue_size = queue_size
+        self.max_subscribers = max_subscribers
+        # houseId -> set Subscriber
+        self.houses = {}
+        self.count = 0
+        self.published = 0
+        self.delivered = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.latency_counts = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.recent_latencies = deque(maxlen=10000)
+
+    # Trả về None nếu process đã đủ subscriber
+    def subscribe(self, house_id: str, user_id: str):
+        if self.count >= self.max_subscribers:
+            return None
+        sub = Subscriber(house_id, user_id, self.queue_size)
+        self.houses.setdefault(house_id, set()).add(sub)
+        self.count += 1
+        return sub
+
+    def unsubscribe(self, sub: Subscriber):
+        subs = self.houses.get(sub.house_id)
+        if subs and sub in subs:
+            subs.discard(sub)
+            self.count -= 1
+            if not subs:
+                del self.houses[sub.house_id]
+
+    # Không await: chỉ đẩy vào hàng đợi của từng subscriber của nhà, event được encode 1 lần
+    def publish(self, house_id: str, event: dict):
+        subs = self.houses.get(house_id)
+        if not subs:
+            return
+        published_at = time.perf_counter()
+        self.published += 1
+        key = (event["entity"], event["id"])
+        payload = dumps(event)
+        for sub in subs:
+            result = sub.put(key, payload, published_at)
+            if result == "coalesced":
+                self.coalesced += 1
+            elif result == "dropped":
+                self.dropped += 1
+
+    # Ghi nhận độ trễ của các sự kiện vừa gửi xong
+    def observe(self, items):
+        now = time.perf_counter()
+        for _, published_at in items:
+            ms = (now - published_at) * 1000
+            i = 0
+            while i < len(LATENCY_BUCKETS_MS) and ms > LATENCY_BUCKETS_MS[i]:
+                i += 1
+            self.latency_counts[i] += 1
+            self.recent_latencies.append(ms)
+        self.delivered += len(items)
+
+    def stats(self):
+        recent = sorted(self.recent_latencies)
+
+        def pct(p):
+            return round(recent[min(len(recent) - 1, int(len(recent) * p))], 3) if recent else None
+
+        buckets = {f"le_{b}ms": c for b, c in zip(LATENCY_BUCKETS_MS, self.latency_counts)}
+        buckets["inf"] = self.latency_counts[-1]
+        return {
+            "subscribers": self.count,
+            "maxSubscribers": self.max_subscribers,
+            "houses": len(self.houses),
+            "published": self.published,
+            "delivered": self.delivered,
+            "coalesced": self.coalesced,
+            "dropped": self.dropped,
+            "latencyMs": {"p50": pct(0.5), "p95": pct(0.95), "p99": pct(0.99), "buckets": buckets}
+        }
+
+
+# Gộp các event đã encode thành 1 message
+def encode_batch(items) -> str:
+    return (b'{"type":"changes","changes":[' + b",".join(p for p, _ in items) + b"]}").decode()
+
+
+hub = RealtimeHub(REALTIME_QUEUE_SIZE, REALTIME_MAX_SUBSCRIBERS)
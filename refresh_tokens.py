@@ -0,0 +1,75 @@
+import logging
+import hashlib
+import secrets
+from datetime import datetime, timedelta, timezone
+from fastapi import HTTPException
+from pymongo import ReturnDocument
+from database import db
+from models import RefreshToken
+
+logger = logging.getLogger(__name__)
+
+# Refresh token sống 30 ngày kể từ lần xoay gần nhất
+REFRESH_TOKEN_DAYS = 30
+# Số token cũ giữ lại mỗi họ để phát hiện dùng lại
+USED_HASHES_KEEP = 20
+
+
+def hash_token(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def _new_token():
+    token = secrets.token_hex(32)
+    expires = datetime.now(timezone.utc) + timedelta(days=REFRESH_TOKEN_DAYS)
+    return token, expires
+
+
+# Cấp refresh token mới (mở 1 họ token mới) - 1 lần ghi
+async def issue(user_id: str) -> str:
+    token, expires = _new_token()
+
+    refresh_token = RefreshToken(
+        userId=user_id,
+        tokenHash=hash_token(token),
+        expiresAt=expires
+    )
+    await db.refresh_tokens.insert_one(refresh_token.model_dump(by_alias=True, exclude=["id"]))
+    return token
+
+
+# Xoay token: đổi token hiện tại của họ sang token mới trong 1 thao tác nguyên tử - 1 lần ghi
+# Trả về (userId, token mới)
+async def rotate(token: str):
+    token_hash = hash_token(token)
+    new_token, expires = _new_token()
+
+    token_doc = await db.refresh_tokens.find_one_and_update(
+        {"tokenHash": token_hash, "expiresAt": {"$gt": datetime.now(timezone.utc)}},
+        {
+            "$set": {"tokenHash": hash_token(new_token), "expiresAt": expires},
+            "$push": {"usedHashes": {"$each": [token_hash], "$slice": -USED_HASHES_KEEP}}
+        },
+        projection={"userId": 1},
+        return_document=ReturnDocument.BEFORE
+    )
+    if token_doc:
+        return token_doc["userId"], new_token
+
+    # Token đã bị dùng trước đó -> có thể bị đánh cắp, thu hồi cả họ token
+    reused = await db.refresh_tokens.find_one_and_delete({"usedHashes": token_hash}, projection={"userId": 1})
+    if reused:
+        logger.warning("Refresh token bị dùng lại, thu hồi phiên của user %s", reused["userId"])
+        raise HTTPException(status_code=401, detail="Refresh token đã được sử dụng, đăng nhập lại")
+
+    # Token chưa bị MongoDB dọn nhưng đã hết hạn
+    expired = await db.refresh_tokens.find_one({"tokenHash": token_hash}, {"_id": 1})
+    if expired:
+        raise HTTPException(status_code=401, detail="Refresh token đã hết hạn, đăng nhập lại")
+
+    raise HTTPException(status_code=401, detail="Refresh token không tồn tại")
+
+
+# Thu hồi cả họ token (đăng xuất)
+async def revoke(token: str):
+    await db.refresh_tokens.delete_one({"tokenHash": hash_token(token)})
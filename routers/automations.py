@@ -1,11 +1,19 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Response, status
 from typing import List, Optional
 from database import db
-from models import AutoOffRule, Schedule, AutoOffRuleCreateRequest, ScheduleCreateRequest, ScheduleUpdateRequest
+from models import (
+    AutoOffRule, Schedule, ConditionRule, AutoOffRuleCreateRequest, ScheduleCreateRequest, ScheduleUpdateRequest,
+    ConditionRuleCreateRequest, ConditionRuleUpdateRequest
+)
 from routers.users import get_current_user
 from datetime import datetime
 from bson import ObjectId
+from pymongo import ReturnDocument
 from routers.utils import check_house_access
+from pagination import PageParams, paginate
+from serializers import encode_schedule, encode_condition_rule, fast_list_response
+from changes import record_change
+from conditions import conditions, OPERATORS, COMMANDS
 
 router = APIRouter()
 
@@ -26,7 +34,7 @@ async def set_auto_off_rule(
     rule_req: AutoOffRuleCreateRequest,
     current_user: dict = Depends(get_current_user)
 ):
-    await verify_device_ownership(device_id, str(current_user["_id"]))
+    device = await verify_device_ownership(device_id, str(current_user["_id"]))
 
     rule_data = {
         "deviceId": device_id,
@@ -41,6 +49,7 @@ async def set_auto_off_rule(
         {"$set": rule_data},
         upsert=True
     )
+    await record_change(device["houseId"], "auto_off_rule", f"{device_id}:{rule_req.endpointId}", "update")
 
     return {"message": "Đã lưu cấu hình tự động tắt"}
 
@@ -69,7 +78,7 @@ async def create_schedule(
     sch_req: ScheduleCreateRequest,
     current_user: dict = Depends(get_current_user)
 ):
-    await verify_device_ownership(device_id, str(current_user["_id"]))
+    device = await verify_device_ownership(device_id, str(current_user["_id"]))
 
     new_schedule = Schedule(
         deviceId=device_id,
@@ -83,6 +92,7 @@ async def create_schedule(
     )
 
     result = await db.schedules.insert_one(new_schedule.model_dump(by_alias=True, exclude=["id"]))
+    await record_change(device["houseId"], "schedule", str(result.inserted_id), "create")
 
     return {"message": "Tạo lịch hẹn thành công", "scheduleId": str(result.inserted_id)}
 
@@ -90,7 +100,9 @@ async def create_schedule(
 @router.get("/schedules/{device_id}", response_model=List[Schedule])
 async def get_device_schedules(
     device_id: str,
+    response: Response,
     endpoint_id: Optional[int] = None,
+    page: PageParams = Depends(),
     current_user: dict = Depends(get_current_user)
 ):
     await verify_device_ownership(device_id, str(current_user["_id"]))
@@ -99,12 +111,8 @@ async def get_device_schedules(
     if endpoint_id is not None:
         query["endpointId"] = endpoint_id
 
-    schedules = await db.schedules.find(query).to_list(length=100)
-
-    for sch in schedules:
-        sch["_id"] = str(sch["_id"])
-
-    return schedules
+    schedules = await paginate("schedules", query, page, response)
+    return fast_list_response(schedules, encode_schedule, response)
 
 # Cập nhật lịch hẹn
 @router.put("/schedules/{schedule_id}")
@@ -117,7 +125,7 @@ async def update_schedule(
     if not schedule:
         raise HTTPException(status_code=404, detail="Lịch hẹn không tồn tại")
 
-    await verify_device_ownership(schedule["deviceId"], str(current_user["_id"]))
+    device = await verify_device_ownership(schedule["deviceId"], str(current_user["_id"]))
 
     # exclude_unset=True giúp loại bỏ các trường user không gửi
     update_data = update_req.model_dump(exclude_unset=True)
@@ -129,6 +137,7 @@ async def update_schedule(
         {"_id": ObjectId(schedule_id)},
         {"$set": update_data}
     )
+    await record_change(device["houseId"], "schedule", schedule_id, "update")
 
     return {"message": "Cập nhật lịch hẹn thành công"}
 
@@ -142,7 +151,114 @@ async def delete_schedule(
     if not schedule:
         raise HTTPException(status_code=404, detail="Lịch hẹn không tồn tại")
         
-    await verify_device_ownership(schedule["deviceId"], str(current_user["_id"]))
+    device = await verify_device_ownership(schedule["deviceId"], str(current_user["_id"]))
 
     await db.schedules.delete_one({"_id": ObjectId(schedule_id)})
-    return {"message": "Đã xóa lịch hẹn"}
\ No newline at end of file
+    await record_change(device["houseId"], "schedule", schedule_id, "delete")
+    return {"message": "Đã xóa lịch hẹn"}
+
+
+# Kiểm tra toán tử / lệnh của luật theo điều kiện
+def validate_condition(data: dict):
+    if "operator" in data and data["operator"] not in OPERATORS:
+        raise HTTPException(status_code=400, detail=f"Toán tử không hợp lệ, chỉ hỗ trợ: {', '.join(OPERATORS)}")
+    if "command" in data and data["command"] not in COMMANDS:
+        raise HTTPException(status_code=400, detail=f"Lệnh không hợp lệ, chỉ hỗ trợ: {', '.join(COMMANDS)}")
+    if data.get("cooldownSec") is not None and data["cooldownSec"] < 0:
+        raise HTTPException(status_code=400, detail="cooldownSec không được âm")
+    if data.get("command") == "SET_VALUE":
+        try:
+            int(data.get("payload") or 0)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="payload của lệnh SET_VALUE phải là số nguyên")
+
+# Tạo luật theo điều kiện (vd: nhiệt độ phòng > 30 -> bật quạt)
+@router.post("/conditions", status_code=status.HTTP_201_CREATED)
+async def create_condition_rule(
+    rule_req: ConditionRuleCreateRequest,
+    current_user: dict = Depends(get_current_user)
+):
+    validate_condition(rule_req.model_dump())
+    await check_house_access(rule_req.houseId, str(current_user["_id"]), required_role="ADMIN")
+
+    room = await db.rooms.find_one({"_id": ObjectId(rule_req.roomId), "houseId": rule_req.houseId}, {"_id": 1})
+    if not room:
+        raise HTTPException(status_code=404, detail="Phòng không tồn tại trong nhà này")
+
+    device = await db.devices.find_one({"_id": ObjectId(rule_req.targetDeviceId), "houseId": rule_req.houseId}, {"endpoints.id": 1})
+    if not device:
+        raise HTTPException(status_code=404, detail="Thiết bị đích không tồn tại trong nhà này")
+    if not any(ep["id"] == rule_req.targetEndpointId for ep in device.get("endpoints", [])):
+        raise HTTPException(status_code=404, detail="Endpoint đích không tồn tại")
+
+    new_rule = ConditionRule(**rule_req.model_dump())
+    doc = new_rule.model_dump(by_alias=True, exclude=["id"])
+    result = await db.condition_rules.insert_one(doc)
+    conditions.set_rule(doc)
+    await record_change(rule_req.houseId, "condition_rule", str(result.inserted_id), "create")
+
+    return {"message": "Tạo luật thành công", "ruleId": str(result.inserted_id)}
+
+# Lấy danh sách luật theo điều kiện của 1 nhà
+@router.get("/conditions/house/{house_id}", response_model=List[ConditionRule])
+async def get_house_condition_rules(
+    house_id: str,
+    response: Response,
+    page: PageParams = Depends(),
+    current_user: dict = Depends(get_current_user)
+):
+    await check_house_access(house_id, str(current_user["_id"]))
+
+    rules = await paginate("condition_rules", {"houseId": house_id}, page, response)
+    return fast_list_response(rules, encode_condition_rule, response)
+
+# Cập nhật luật theo điều kiện
+@router.put("/conditions/{rule_id}")
+async def update_condition_rule(
+    rule_id: str,
+    update_req: ConditionRuleUpdateRequest,
+    current_user: dict = Depends(get_current_user)
+):
+    rule = await db.condition_rules.find_one({"_id": ObjectId(rule_id)}, {"houseId": 1, "command": 1, "payload": 1})
+    if not rule:
+        raise HTTPException(status_code=404, detail="Luật không tồn tại")
+
+    await check_house_access(rule["houseId"], str(current_user["_id"]), required_role="ADMIN")
+
+    update_data = update_req.model_dump(exclude_unset=True)
+    if not update_data:
+        return {"message": "Không có dữ liệu thay đổi"}
+    # Chỉ payload được gửi null (xóa payload); trường khác null sẽ làm hỏng luật khi nạp vào bộ máy luật
+    nulls = [k for k, v in update_data.items() if v is None and k != "payload"]
+    if nulls:
+        raise HTTPException(status_code=400, detail=f"Không được để trống: {', '.join(nulls)}")
+    # Kiểm tra cùng lệnh / payload hiện tại (chỉ đổi 1 trong 2 field)
+    validate_condition({"command": rule.get("command"), "payload": rule.get("payload"), **update_data})
+
+    doc = await db.condition_rules.find_one_and_update(
+        {"_id": ObjectId(rule_id)},
+        {"$set": update_data},
+        return_document=ReturnDocument.AFTER
+    )
+    if doc:
+        conditions.set_rule(doc)
+    await record_change(rule["houseId"], "condition_rule", rule_id, "update")
+
+    return {"message": "Cập nhật luật thành công"}
+
+# Xóa luật theo điều kiện
+@router.delete("/conditions/{rule_id}")
+async def delete_condition_rule(
+    rule_id: str,
+    current_user: dict = Depends(get_current_user)
+):
+    rule = await db.condition_rules.find_one({"_id": ObjectId(rule_id)}, {"houseId": 1})
+    if not rule:
+        raise HTTPException(status_code=404, detail="Luật không tồn tại")
+
+    await check_house_access(rule["houseId"], str(current_user["_id"]), required_role="ADMIN")
+
+    await db.condition_rules.delete_one({"_id": ObjectId(rule_id)})
+    conditions.remove_rule(rule_id)
+    await record_change(rule["houseId"], "condition_rule", rule_id, "delete")
+    return {"message": "Đã xóa luật"}
@@ -1,12 +1,20 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from typing import List
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, status
+from typing import List, Optional
 from database import db
 from models import CommandRequest, Device, DeviceCreateRequest, DeviceUpdateRequest, Command, EndpointCreateRequest, EndpointUpdateRequest, DeviceEndpoint
 from routers.users import get_current_user
-from datetime import datetime
+from datetime import datetime, timedelta
 from bson import ObjectId
 from routers.utils import check_house_access, delete_device_data, delete_endpoint_data
 from mqtt_client import mqtt
+from pagination import PageParams, paginate
+from streaming import ndjson_response
+from serializers import encode_device, fast_list_response
+from versions import check_not_modified
+from changes import record_change, record_changes
+from routing import routing
+from usage import usage, get_usage
+from metrics import record_publish
 import json
 
 router = APIRouter()
@@ -28,6 +36,8 @@ async def create_device(
     )
 
     result = await db.devices.insert_one(new_device.model_dump(by_alias=True, exclude=["id"]))
+    routing.set_device(str(result.inserted_id), device_req.roomId, [])
+    await record_change(device_req.houseId, "device", str(result.inserted_id), "create")
 
     return {
         "message": "Thêm thiết bị thành công",
@@ -72,6 +82,9 @@ async def update_device(
         {"_id": ObjectId(device_id)},
         {"$set": update_data}
     )
+    if "roomId" in update_data:
+        routing.set_device(device_id, update_data["roomId"], [ep["id"] for ep in device.get("endpoints", [])])
+    await record_change(device["houseId"], "device", device_id, "update")
 
     return {"message": "Cập nhật thiết bị thành công"}
 
@@ -88,7 +101,10 @@ async def delete_device(
     # Check quyền
     await check_house_access(device["houseId"], str(current_user["_id"]), required_role="ADMIN")
 
-    await delete_device_data(device_id)
+    tombstones = await delete_device_data(device_id)
+    routing.remove_devices([device_id])
+    usage.forget_devices([device_id])
+    await record_changes(device["houseId"], tombstones + [("device", device_id, "delete")])
 
     return None
 
@@ -123,6 +139,8 @@ async def add_endpoint(
         {"_id": ObjectId(device_id)},
         {"$push": {"endpoints": new_endpoint.model_dump()}}
     )
+    routing.add_endpoint(device_id, endpoint_req.id)
+    await record_change(device["houseId"], "endpoint", f"{device_id}:{endpoint_req.id}", "create")
 
     return {"message": "Đã thêm endpoint mới"}
 
@@ -155,6 +173,7 @@ async def update_endpoint(
 
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Endpoint không tìm thấy")
+    await record_change(device["houseId"], "endpoint", f"{device_id}:{endpoint_id}", "update")
 
     return {"message": "Cập nhật thành công"}
 
@@ -171,7 +190,9 @@ async def delete_endpoint(
         
     await check_house_access(device["houseId"], str(current_user["_id"]), required_role="ADMIN")
 
-    await delete_endpoint_data(device_id, endpoint_id)
+    tombstones = await delete_endpoint_data(device_id, endpoint_id)
+    routing.remove_endpoint(device_id, endpoint_id)
+    await record_changes(device["houseId"], tombstones + [("endpoint", f"{device_id}:{endpoint_id}", "delete")])
 
     return {"message": "Đã xóa endpoint"}
 
@@ -180,18 +201,29 @@ async def delete_endpoint(
 @router.get("/house/{house_id}", response_model=List[Device])
 async def get_devices_by_house(
     house_id: str,
+    request: Request,
+    response: Response,
+    page: PageParams = Depends(),
     current_user: dict = Depends(get_current_user)
 ):
     # Kiểm tra quyền access
     await check_house_access(house_id, str(current_user["_id"]))
 
-    devices = await db.devices.find({"houseId": house_id}).to_list(length=100)
-    return devices
+    # Nhà chưa thay đổi so với bản client đang có -> 304, không query devices
+    not_modified = await check_not_modified(request, response, house_id, "devices", page.cursor, page.limit)
+    if not_modified:
+        return not_modified
+
+    devices = await paginate("devices", {"houseId": house_id}, page, response)
+    return fast_list_response(devices, encode_device, response)
 
 # API lấy danh sách thiết bị theo room
 @router.get("/room/{room_id}", response_model=List[Device])
 async def get_devices_by_room(
     room_id: str,
+    request: Request,
+    response: Response,
+    page: PageParams = Depends(),
     current_user: dict = Depends(get_current_user)
 ):
     room = await db.rooms.find_one({"_id": ObjectId(room_id)})
@@ -201,8 +233,101 @@ async def get_devices_by_room(
     # Kiểm tra quyền access
     await check_house_access(room["houseId"], str(current_user["_id"]))
 
-    devices = await db.devices.find({"roomId": room_id}).to_list(length=100)
-    return devices
+    not_modified = await check_not_modified(request, response, room["houseId"], "room-devices", room_id, page.cursor, page.limit)
+    if not_modified:
+        return not_modified
+
+    devices = await paginate("devices", {"roomId": room_id}, page, response)
+    return fast_list_response(devices, encode_device, response)
+
+
+# API stream toàn bộ thiết bị của nhà dạng NDJSON (mỗi dòng 1 thiết bị, không giới hạn số lượng)
+@router.get("/house/{house_id}/stream")
+async def stream_devices_by_house(
+    house_id: str,
+    current_user: dict = Depends(get_current_user)
+):
+    await check_house_access(house_id, str(current_user["_id"]))
+
+    cursor = db.devices.find({"houseId": house_id}).sort("_id", 1)
+    return ndjson_response(cursor)
+
+# API xuất trạng thái mọi endpoint của nhà dạng NDJSON (mỗi dòng 1 endpoint)
+@router.get("/house/{house_id}/telemetry/export")
+async def export_house_telemetry(
+    house_id: str,
+    current_user: dict = Depends(get_current_user)
+):
+    await check_house_access(house_id, str(current_user["_id"]))
+
+    cursor = db.devices.aggregate([
+        {"$match": {"houseId": house_id}},
+        {"$sort": {"_id": 1}},
+        {"$unwind": "$endpoints"},
+        {"$project": {
+            "_id": 0,
+            "deviceId": {"$toString": "$_id"},
+            "deviceName": "$name",
+            "roomId": 1,
+            "endpointId": "$endpoints.id",
+            "endpointName": "$endpoints.name",
+            "type": "$endpoints.type",
+            "value": "$endpoints.value",
+            "lastUpdated": "$endpoints.lastUpdated"
+        }}
+    ])
+    return ndjson_response(cursor, filename=f"telemetry-{house_id}.ndjson")
+
+
+# Kiểm tra tham số thống kê: period=day -> YYYY-MM-DD, period=month -> YYYY-MM; mặc định 7 ngày / 12 tháng gần nhất
+def usage_range(period: str, start: Optional[str], end: Optional[str]):
+    if period not in ("day", "month"):
+        raise HTTPException(status_code=400, detail="period phải là day hoặc month")
+    fmt = "%Y-%m-%d" if period == "day" else "%Y-%m"
+    today = datetime.now()
+    default_start = today - timedelta(days=6) if period == "day" else today - timedelta(days=365)
+    try:
+        start = datetime.strptime(start, fmt) if start else default_start
+        end = datetime.strptime(end, fmt) if end else today
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Ngày không hợp lệ, định dạng {'YYYY-MM-DD' if period == 'day' else 'YYYY-MM'}")
+    return start.strftime(fmt), end.strftime(fmt)
+
+# API thống kê sử dụng của các endpoint trong nhà (thời gian bật, số lần bật/tắt, số lệnh)
+@router.get("/house/{house_id}/usage")
+async def get_house_usage(
+    house_id: str,
+    period: str = "day",
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    await check_house_access(house_id, str(current_user["_id"]))
+
+    start, end = usage_range(period, start, end)
+    return await get_usage({"houseId": house_id}, period, start, end)
+
+# API thống kê sử dụng của 1 thiết bị
+@router.get("/{device_id}/usage")
+async def get_device_usage(
+    device_id: str,
+    period: str = "day",
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    endpoint_id: Optional[int] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    device = await db.devices.find_one({"_id": ObjectId(device_id)}, {"houseId": 1})
+    if not device:
+        raise HTTPException(status_code=404, detail="Thiết bị không tồn tại")
+
+    await check_house_access(device["houseId"], str(current_user["_id"]))
+
+    start, end = usage_range(period, start, end)
+    query = {"deviceId": device_id}
+    if endpoint_id is not None:
+        query["endpointId"] = endpoint_id
+    return await get_usage(query, period, start, end)
 
 
 # API gửi lệnh điều khiển endpoint
@@ -266,6 +391,8 @@ async def send_command(
 
     topic = f"{room_id}/device"
     mqtt.publish(topic, json.dumps(payload))
+    record_publish("api")
+    usage.record_command(device["houseId"], device_id, cmd_req.endpointId)
 
     return {
         "message": "Đã gửi lệnh gộp xuống thiết bị", 
@@ -313,4 +440,35 @@ async def get_device_history(
             "ackedAt": cmd.get("ackedAt") # Thời điểm thiết bị phản hồi
         })
 
-    return result
\ No newline at end of file
+    return result
+
+# API xuất toàn bộ lịch sử lệnh của thiết bị dạng NDJSON
+@router.get("/{device_id}/history/export")
+async def export_device_history(
+    device_id: str,
+    current_user: dict = Depends(get_current_user)
+):
+    device = await db.devices.find_one({"_id": ObjectId(device_id)}, {"houseId": 1, "endpoints.id": 1, "endpoints.name": 1})
+    if not device:
+        raise HTTPException(status_code=404, detail="Thiết bị không tồn tại")
+
+    await check_house_access(device["houseId"], str(current_user["_id"]))
+
+    ep_names = {ep["id"]: ep["name"] for ep in device.get("endpoints", [])}
+
+    def to_row(cmd):
+        return {
+            "commandId": cmd.get("commandId"),
+            "endpointId": cmd["endpointId"],
+            "endpointName": ep_names.get(cmd["endpointId"], "Unknown"),
+            "command": cmd["command"],
+            "status": cmd["status"],
+            "createdAt": cmd["createdAt"],
+            "ackedAt": cmd.get("ackedAt")
+        }
+
+    cursor = db.commands.find(
+        {"deviceId": device_id},
+        {"_id": 0, "commandId": 1, "endpointId": 1, "command": 1, "status": 1, "createdAt": 1, "ackedAt": 1}
+    ).sort("createdAt", -1)
+    return ndjson_response(cursor, transform=to_row, filename=f"history-{device_id}.ndjson")
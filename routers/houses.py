@@ -1,11 +1,18 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from typing import List
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, status
+from typing import List, Optional
 from database import db
 from models import House, HouseCreateRequest
 from routers.users import get_current_user
 from datetime import datetime
 from bson import ObjectId
+from fastapi.responses import JSONResponse
 from routers.utils import check_house_access, delete_house_data
+from cascade import CASCADE_BACKGROUND_DEVICES, create_job, start_job
+from pagination import PageParams, paginate_aggregate
+from serializers import encode_house, fast_list_response
+from versions import get_house_version, house_etag, etag_matches
+from changes import record_change, get_changes
+from snapshots import get_snapshot
 
 router = APIRouter()
 
@@ -33,23 +40,77 @@ async def create_house(
         "owner": current_user["email"]
     }
 
-# API lấy danh sách nhà của user
+# API lấy danh sách nhà của user (nhà sở hữu + nhà tham gia, 1 aggregation)
 @router.get("/", response_model=List[House])
-async def get_houses(current_user: dict = Depends(get_current_user)):
+async def get_houses(
+    response: Response,
+    page: PageParams = Depends(),
+    current_user: dict = Depends(get_current_user)
+):
     user_id = str(current_user["_id"])
+    # Lọc theo cursor và giới hạn trong từng nhánh (trước $unionWith / $lookup),
+    # paginate_aggregate chỉ còn gộp 2 nhánh (mỗi nhánh tối đa limit + 1 nhà) rồi cắt lại
+    owned = {"ownerId": user_id}
+    joined = [
+        {"$match": {"userId": user_id, "status": "ACCEPTED"}},
+        {"$addFields": {"hid": {"$toObjectId": "$houseId"}}}
+    ]
+    if page.after is not None:
+        owned["_id"] = {"$gt": page.after}
+        joined.append({"$match": {"hid": {"$gt": page.after}}})
+    joined += [
+        {"$sort": {"hid": 1}},
+        {"$limit": page.limit + 1},
+        {"$lookup": {"from": "houses", "localField": "hid", "foreignField": "_id", "as": "house"}},
+        {"$unwind": "$house"},
+        {"$replaceRoot": {"newRoot": "$house"}}
+    ]
+
+    pipeline = [
+        {"$match": owned},
+        {"$sort": {"_id": 1}},
+        {"$limit": page.limit + 1},
+        {"$unionWith": {"coll": "home_members", "pipeline": joined}}
+    ]
+
+    houses = await paginate_aggregate("houses", pipeline, page, response)
+    return fast_list_response(houses, encode_house, response)
 
-    owned_houses_cursor = db.houses.find({"ownerId": user_id})
-    owned_houses = await owned_houses_cursor.to_list(length=100)
+# API lấy toàn bộ dữ liệu nhà (nhà, phòng, thiết bị, trạng thái endpoint, thành viên) trong 1 lần gọi
+# Kết quả được cache theo phiên bản của nhà, chỉ build lại khi nhà có thay đổi
+@router.get("/{house_id}/snapshot")
+async def get_house_snapshot(
+    house_id: str,
+    request: Request,
+    current_user: dict = Depends(get_current_user)
+):
+    await check_house_access(house_id, str(current_user["_id"]))
 
-    members_cursor = db.home_members.find({"userId": user_id, "status": "ACCEPTED"})
-    members = await members_cursor.to_list(length=100)
+    version = await get_house_version(house_id)
+    if version is None:
+        raise HTTPException(status_code=404, detail="Nhà không tồn tại")
 
-    joined_house_ids = [ObjectId(m["houseId"]) for m in members]
+    etag = house_etag(house_id, version, "snapshot")
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag})
 
-    joined_houses_cursor = db.houses.find({"_id": {"$in": joined_house_ids}})
-    joined_houses = await joined_houses_cursor.to_list(length=100)
+    body = await get_snapshot(house_id, version)
+    if body is None:
+        raise HTTPException(status_code=404, detail="Nhà không tồn tại")
 
-    return owned_houses + joined_houses
+    return Response(content=body, media_type="application/json", headers={"ETag": etag})
+
+# API đồng bộ tăng dần: các phòng, thiết bị, endpoint, luật tự động đã tạo/sửa/xóa kể từ cursor
+# Lần đầu (không có since) hoặc resync=True -> client tải lại snapshot rồi dùng cursor trả về
+@router.get("/{house_id}/changes")
+async def get_house_changes(
+    house_id: str,
+    since: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    await check_house_access(house_id, str(current_user["_id"]))
+
+    return await get_changes(house_id, since)
 
 # API cập nhật thông tin nhà
 @router.put("/{house_id}")
@@ -65,6 +126,7 @@ async def update_house(
         {"_id": ObjectId(house_id)},
         {"$set": {"name": house_req.name, "address": house_req.address, "mapId": house_req.mapId}}
     )
+    await record_change(house_id, "house", house_id, "update")
     return {"message": "Cập nhật nhà thành công"}
 
 # API xóa nhà
@@ -78,6 +140,16 @@ async def delete_house(
     if not house:
         raise HTTPException(status_code=404, detail="Không tìm thấy nhà hoặc bạn không có quyền")
 
+    # Nhà quá nhiều thiết bị -> xóa nền, trả về jobId để theo dõi tiến độ
+    device_count = await db.devices.count_documents({"houseId": house_id})
+    if device_count > CASCADE_BACKGROUND_DEVICES:
+        job = create_job("HOUSE", house_id, str(current_user["_id"]), device_count)
+        start_job(job, delete_house_data(house_id, job))
+        return JSONResponse(
+            status_code=status.HTTP_202_ACCEPTED,
+            content={"message": "Đang xóa nhà trong nền", "jobId": job["jobId"]}
+        )
+
     await delete_house_data(house_id)
     
     return None
\ No newline at end of file
@@ -1,11 +1,14 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, status
 from typing import List
 from database import db
 from models import HomeMember, InviteMemberRequest, UpdateMemberRole
 from routers.users import get_current_user
-from routers.utils import check_house_access
+from routers.utils import check_house_access, invalidate_house_access, bump_membership_version
 from bson import ObjectId
 from datetime import datetime
+from loaders import Loader, get_loader
+from pagination import PageParams, paginate
+from versions import bump_house_version, check_not_modified
 
 router = APIRouter()
 
@@ -58,27 +61,37 @@ async def invite_member(
     )
 
     await db.home_members.insert_one(new_member.model_dump(by_alias=True, exclude=["id"]))
+    # Danh sách thành viên có hiện cả lời mời đang chờ
+    await bump_house_version(req.houseId)
 
     return {"message": f"Đã gửi lời mời tới {req.email}"}
 
 
 # API xem danh sách lời mời
 @router.get("/invitations")
-async def get_invitations(current_user: dict = Depends(get_current_user)):
-    invites_cursor = db.home_members.find({
+async def get_invitations(
+    response: Response,
+    page: PageParams = Depends(),
+    current_user: dict = Depends(get_current_user),
+    loader: Loader = Depends(get_loader)
+):
+    invites = await paginate("home_members", {
         "userId": str(current_user["_id"]),
         "status": "PENDING"
-    })
-    invites = await invites_cursor.to_list(length=100)
+    }, page, response)
+
+    # Nạp nhà và chủ nhà theo lô (mỗi collection 1 query)
+    houses = await loader.load_many("houses", [inv["houseId"] for inv in invites])
+    owners = await loader.load_many("users", [h["ownerId"] for h in houses.values() if h])
 
     result = []
     for inv in invites:
-        house = await db.houses.find_one({"_id": ObjectId(inv["houseId"])})
-        owner = await db.users.find_one({"_id": ObjectId(house["ownerId"])})
+        house = houses.get(inv["houseId"])
         if house:
+            owner = owners.get(house["ownerId"])
             inv["_id"] = str(inv["_id"])
             inv["houseName"] = house["name"]
-            inv["ownerName"] = owner["fullName"]
+            inv["ownerName"] = owner["fullName"] if owner else None
             result.append(inv)
             
     return result
@@ -116,6 +129,9 @@ async def accept_invitation(
         {"_id": ObjectId(member_id)},
         {"$set": {"status": "ACCEPTED", "joinedAt": datetime.now()}}
     )
+    # Không cần tăng membershipVersion: nhà mới không có trong token sẽ tự kiểm tra qua DB
+    invalidate_house_access(invite["houseId"], invite["userId"])
+    await bump_house_version(invite["houseId"])
     return {"message": "Đã chấp nhận lời mời"}
 
 # API từ chối lời mời
@@ -132,6 +148,7 @@ async def reject_invitation(
         raise HTTPException(status_code=403, detail="Lời mời này không phải của bạn")
 
     await db.home_members.delete_one({"_id": ObjectId(member_id)})
+    await bump_house_version(invite["houseId"])
     return {"message": "Đã từ chối lời mời"}
 
 
@@ -139,24 +156,36 @@ async def reject_invitation(
 @router.get("/{house_id}")
 async def get_house_members(
     house_id: str,
-    current_user: dict = Depends(get_current_user)
+    request: Request,
+    response: Response,
+    page: PageParams = Depends(),
+    current_user: dict = Depends(get_current_user),
+    loader: Loader = Depends(get_loader)
 ):
     await check_house_access(house_id, str(current_user["_id"]))
 
-    members_cursor = db.home_members.find({"houseId": house_id})
-    members = await members_cursor.to_list(length=100)
+    not_modified = await check_not_modified(request, response, house_id, "members", page.cursor, page.limit)
+    if not_modified:
+        return not_modified
+
+    members = await paginate("home_members", {"houseId": house_id}, page, response)
+
+    # Nạp chủ nhà cùng lô với các thành viên (1 query users duy nhất)
+    house = await loader.load("houses", house_id)
+    owner_id = house["ownerId"] if house else None
+    users = await loader.load_many("users", [m["userId"] for m in members] + [owner_id])
 
     result = []
     for m in members:
-        user = await db.users.find_one({"_id": ObjectId(m["userId"])})
+        user = users.get(m["userId"])
         if user:
             m["_id"] = str(m["_id"])
             m["email"] = user["email"]
             m["fullName"] = user["fullName"]
             result.append(m)
 
-    house = await db.houses.find_one({"_id": ObjectId(house_id)})
-    owner = await db.users.find_one({"_id": ObjectId(house["ownerId"])})
+    # Chủ nhà chỉ nằm ở trang đầu
+    owner = users.get(owner_id) if owner_id and page.cursor is None else None
     if owner:
         result.insert(0, {
             "userId": str(owner["_id"]),
@@ -189,6 +218,9 @@ async def update_member_role(
         {"_id": ObjectId(member_id), "houseId": req.houseId},
         {"$set": {"role": req.role}}
     )
+    invalidate_house_access(req.houseId, member_record["userId"])
+    await bump_membership_version([member_record["userId"]])
+    await bump_house_version(req.houseId)
     return {"message": "Cập nhật vai trò thành viên thành công"}
 
 
@@ -205,6 +237,9 @@ async def remove_member(
     await check_house_access(member_record["houseId"], str(current_user["_id"]), required_role="OWNER")
     
     await db.home_members.delete_one({"_id": ObjectId(member_id), "houseId": member_record["houseId"]})
+    invalidate_house_access(member_record["houseId"], member_record["userId"])
+    await bump_membership_version([member_record["userId"]])
+    await bump_house_version(member_record["houseId"])
     return {"message": "Đã xóa thành viên khỏi nhà"}
 
 
@@ -231,5 +266,8 @@ async def leave_house(
         raise HTTPException(status_code=404, detail="Bạn không phải thành viên nhà này")
 
     await db.home_members.delete_one({"_id": member_record["_id"]})
+    invalidate_house_access(house_id, str(current_user["_id"]))
+    await bump_membership_version([str(current_user["_id"])])
+    await bump_house_version(house_id)
 
     return {"message": "Đã rời khỏi nhà thành công"}
\ No newline at end of file
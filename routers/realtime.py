@@ -0,0 +1,130 @@
+import asyncio
+import json
+from fastapi import APIRouter, Depends, HTTPException, WebSocket, status
+from fastapi.responses import StreamingResponse
+from routers.users import get_current_user, get_user_from_token
+from routers.utils import check_house_access, token_roles
+from versions import get_house_version
+from realtime import hub, encode_batch, REALTIME_HEARTBEAT_SECONDS
+
+router = APIRouter()
+
+PING_MESSAGE = json.dumps({"type": "ping"})
+RESYNC_MESSAGE = json.dumps({"type": "resync"})
+
+
+# Đăng ký nhận sự kiện của nhà, message đầu tiên là phiên bản hiện tại:
+# client áp dụng các event có seq lớn hơn version (hoặc gọi /changes?since=version để bù phần thiếu)
+async def _subscribe(house_id: str, user_id: str):
+    sub = hub.subscribe(house_id, user_id)
+    if sub is None:
+        raise HTTPException(status_code=503, detail="Server đang quá tải kết nối realtime, vui lòng thử lại sau")
+    try:
+        hello = json.dumps({"type": "hello", "version": await get_house_version(house_id)})
+    except BaseException:
+        # Lỗi DB / client ngắt khi đang đọc phiên bản -> không giữ subscriber
+        hub.unsubscribe(sub)
+        raise
+    return sub, hello
+
+
+# Lấy message tiếp theo cần gửi: các thay đổi đã gộp, hoặc ping khi hết thời gian chờ
+# Mỗi lần ping kiểm tra lại quyền (bỏ role trong token) -> user bị xóa khỏi nhà sẽ bị ngắt
+async def _next_messages(sub):
+    items = await sub.get(REALTIME_HEARTBEAT_SECONDS)
+    if not items:
+        token_roles.set(None)
+        await check_house_access(sub.house_id, sub.user_id)
+        return [PING_MESSAGE], []
+
+    messages = []
+    if sub.overflowed:
+        # Đã bỏ bớt sự kiện do client đọc chậm -> client tự đồng bộ lại
+        sub.overflowed = False
+        messages.append(RESYNC_MESSAGE)
+    messages.append(encode_batch(items))
+    return messages, items
+
+
+# WebSocket nhận thay đổi của nhà. Trình duyệt không gửi được header nên token truyền qua ?token=
+@router.websocket("/{house_id}/ws")
+async def house_websocket(websocket: WebSocket, house_id: str, token: str = ""):
+    try:
+        user = await get_user_from_token(token)
+        user_id = str(user["_id"])
+        await check_house_access(house_id, user_id)
+        sub, hello = await _subscribe(house_id, user_id)
+    except HTTPException as e:
+        code = status.WS_1013_TRY_AGAIN_LATER if e.status_code == 503 else status.WS_1008_POLICY_VIOLATION
+        await websocket.close(code=code, reason=str(e.detail))
+        return
+
+    async def pump():
+        await websocket.send_text(hello)
+        while True:
+            messages, items = await _next_messages(sub)
+            for message in messages:
+                await websocket.send_text(message)
+            hub.observe(items)
+
+    # Client không cần gửi gì, chỉ đọc để biết khi nào ngắt kết nối
+    async def receive_until_disconnect():
+        while (await websocket.receive())["type"] != "websocket.disconnect":
+            pass
+
+    await websocket.accept()
+    tasks = [asyncio.create_task(pump()), asyncio.create_task(receive_until_disconnect())]
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if isinstance(task.exception(), HTTPException):
+                # Mất quyền truy cập nhà
+                await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+    except Exception:
+        pass
+    finally:
+        for task in tasks:
+            task.cancel()
+        hub.unsubscribe(sub)
+
+
+# Server-Sent Events, dùng khi không mở được WebSocket (header Authorization như các API khác)
+@router.get("/{house_id}/events")
+async def house_events(
+    house_id: str,
+    current_user: dict = Depends(get_current_user)
+):
+    user_id = str(current_user["_id"])
+    await check_house_access(house_id, user_id)
+    # Chỉ kiểm tra trước để trả 503; đăng ký trong generator để client ngắt trước khi stream bắt đầu
+    # không để lại subscriber (generator chưa chạy thì chưa đăng ký, đã chạy thì finally luôn hủy đăng ký)
+    if hub.count >= hub.max_subscribers:
+        raise HTTPException(status_code=503, detail="Server đang quá tải kết nối realtime, vui lòng thử lại sau")
+
+    async def stream():
+        try:
+            sub, hello = await _subscribe(house_id, user_id)
+        except HTTPException:
+            # Vừa hết chỗ giữa lúc kiểm tra và lúc bắt đầu stream -> đóng, EventSource sẽ tự kết nối lại
+            return
+        try:
+            yield f"event: hello\ndata: {hello}\n\n"
+            while True:
+                try:
+                    messages, items = await _next_messages(sub)
+                except HTTPException:
+                    return
+                for message in messages:
+                    if message is PING_MESSAGE:
+                        yield ": ping\n\n"
+                    else:
+                        yield f"data: {message}\n\n"
+                hub.observe(items)
+        finally:
+            hub.unsubscribe(sub)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
@@ -1,11 +1,17 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, status
 from typing import List
 from database import db
 from models import Room, RoomCreateRequest, RoomUpdateRequest
 from routers.users import get_current_user
 from datetime import datetime
 from bson import ObjectId
+from fastapi.responses import JSONResponse
 from routers.utils import check_house_access, delete_room_data
+from cascade import CASCADE_BACKGROUND_DEVICES, create_job, start_job
+from pagination import PageParams, paginate
+from serializers import encode_room, fast_list_response
+from versions import check_not_modified
+from changes import record_change
 
 router = APIRouter()
 
@@ -26,6 +32,7 @@ async def create_room(
     )
 
     result = await db.rooms.insert_one(new_room.model_dump(by_alias=True, exclude=["id"]))
+    await record_change(room_req.houseId, "room", str(result.inserted_id), "create")
 
     return {
         "message": "Tạo phòng thành công", 
@@ -37,14 +44,21 @@ async def create_room(
 @router.get("/{house_id}", response_model=List[Room])
 async def get_rooms_by_house(
     house_id: str,
+    request: Request,
+    response: Response,
+    page: PageParams = Depends(),
     current_user: dict = Depends(get_current_user)
 ):
     # Kiểm tra quyền access
     await check_house_access(house_id, str(current_user["_id"]))
 
-    rooms_cursor = db.rooms.find({"houseId": house_id})
-    rooms = await rooms_cursor.to_list(length=100)
-    return rooms
+    # Nhà chưa thay đổi so với bản client đang có -> 304
+    not_modified = await check_not_modified(request, response, house_id, "rooms", page.cursor, page.limit)
+    if not_modified:
+        return not_modified
+
+    rooms = await paginate("rooms", {"houseId": house_id}, page, response)
+    return fast_list_response(rooms, encode_room, response)
 
 # API cập nhật phòng
 @router.put("/{room_id}")
@@ -64,6 +78,7 @@ async def update_room(
         {"_id": ObjectId(room_id)},
         {"$set": {"name": room_req.name, "floor": room_req.floor}}
     )
+    await record_change(room["houseId"], "room", room_id, "update")
     return {"message": "Cập nhật phòng thành công"}
 
 # API xóa phòng
@@ -79,6 +94,16 @@ async def delete_room(
     # Kiểm tra quyền access
     await check_house_access(room["houseId"], str(current_user["_id"]), required_role="ADMIN")
 
-    await delete_room_data(room_id)
+    # Phòng quá nhiều thiết bị -> xóa nền, trả về jobId để theo dõi tiến độ
+    device_count = await db.devices.count_documents({"roomId": room_id})
+    if device_count > CASCADE_BACKGROUND_DEVICES:
+        job = create_job("ROOM", room_id, str(current_user["_id"]), device_count)
+        start_job(job, delete_room_data(room_id, room["houseId"], job))
+        return JSONResponse(
+            status_code=status.HTTP_202_ACCEPTED,
+            content={"message": "Đang xóa phòng trong nền", "jobId": job["jobId"]}
+        )
+
+    await delete_room_data(room_id, room["houseId"])
 
     return None
\ No newline at end of file
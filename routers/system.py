@@ -0,0 +1,139 @@
+import asyncio
+import secrets
+import threading
+from fastapi import APIRouter, Depends, Header, HTTPException
+from fastapi.responses import JSONResponse, PlainTextResponse
+from hashing import hash_pool
+from database import ping, pool_stats
+from mqtt_client import is_mqtt_connected
+from routers.users import get_current_user
+from cascade import get_job
+from snapshots import snapshot_stats
+from routers.utils import access_cache
+from realtime import hub
+from invalidation import bus
+from ingest import ingest_stats
+from usage import usage
+from logs import log_stats, set_level, LEVELS
+from models import LogLevelRequest
+import diagnostics
+from diagnostics import profiler, collapsed, top_functions, DIAG_TOKEN, DIAG_PROFILE_MAX_SECONDS
+
+router = APIRouter()
+
+# API liveness: process còn sống và event loop còn phản hồi
+@router.get("/health/live")
+async def liveness():
+    return {"status": "ok"}
+
+# API readiness: sẵn sàng nhận traffic khi DB và MQTT đều kết nối được
+@router.get("/health/ready")
+async def readiness():
+    checks = {
+        "mongo": await ping(),
+        "mqtt": is_mqtt_connected()
+    }
+    ready = all(checks.values())
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={"status": "ready" if ready else "not_ready", "checks": checks}
+    )
+
+# API chẩn đoán / vận hành (trạng thái nội bộ, đổi cấu hình) chỉ mở khi có DIAG_TOKEN và request gửi đúng token
+async def require_diagnostics_token(x_diagnostics_token: str = Header(default="")):
+    if not DIAG_TOKEN:
+        raise HTTPException(status_code=404, detail="API chẩn đoán chưa được bật")
+    if not secrets.compare_digest(x_diagnostics_token, DIAG_TOKEN):
+        raise HTTPException(status_code=403, detail="Sai token chẩn đoán")
+
+# API xem mức sử dụng pool kết nối MongoDB
+@router.get("/db-pool", dependencies=[Depends(require_diagnostics_token)])
+async def get_db_pool_stats():
+    return pool_stats.snapshot()
+
+# API xem trạng thái pool băm mật khẩu (độ bận, hàng đợi, thời gian chờ)
+@router.get("/hash-pool", dependencies=[Depends(require_diagnostics_token)])
+async def get_hash_pool_stats():
+    return hash_pool.stats()
+
+# API xem trạng thái các cache trong bộ nhớ
+@router.get("/caches", dependencies=[Depends(require_diagnostics_token)])
+async def get_cache_stats():
+    return {"access": access_cache.stats(), "snapshots": snapshot_stats(), "invalidation": bus.stats()}
+
+# API xem số kết nối realtime và độ trễ fan-out
+@router.get("/realtime", dependencies=[Depends(require_diagnostics_token)])
+async def get_realtime_stats():
+    return hub.stats()
+
+# API xem trạng thái ingest MQTT (số lần ghi đang chờ, WAL)
+@router.get("/ingest", dependencies=[Depends(require_diagnostics_token)])
+async def get_ingest_stats():
+    return {**ingest_stats(), "usage": usage.stats()}
+
+# API xem trạng thái log (hàng đợi, số bản ghi bị bỏ, mức log hiện tại)
+@router.get("/logging", dependencies=[Depends(require_diagnostics_token)])
+async def get_logging_stats():
+    return log_stats()
+
+# API đổi mức log của 1 logger (vd "ingest" -> DEBUG khi cần điều tra), chỉ áp dụng cho replica nhận request.
+# Mức DEBUG ghi mọi payload MQTT và làm chậm ingest nên chỉ người vận hành (token chẩn đoán) được đổi
+@router.put("/logging", dependencies=[Depends(require_diagnostics_token)])
+async def set_log_level(req: LogLevelRequest):
+    if req.level.upper() not in LEVELS:
+        raise HTTPException(status_code=400, detail=f"Mức log không hợp lệ, chỉ hỗ trợ: {', '.join(LEVELS)}")
+    set_level(req.logger, req.level)
+    return {"message": "Đã đổi mức log", "levels": log_stats()["levels"]}
+
+# API xem các request / query chậm gần đây (kèm dạng query, số lệnh DB, dấu hiệu N+1)
+@router.get("/diagnostics", dependencies=[Depends(require_diagnostics_token)])
+async def get_diagnostics():
+    return {
+        "config": {
+            "requests": diagnostics.DIAG_REQUESTS,
+            "slowRequestMs": diagnostics.DIAG_SLOW_REQUEST_MS,
+            "nPlusOne": diagnostics.DIAG_N_PLUS_ONE,
+            "slowQueryMs": diagnostics.DIAG_SLOW_QUERY_MS
+        },
+        "slowRequests": list(diagnostics.recent_slow_requests),
+        "slowQueries": list(diagnostics.recent_slow_queries)
+    }
+
+# API lấy profile của process trong n giây (mặc định chỉ lấy mẫu thread chạy event loop)
+# format=collapsed trả về dạng dùng cho flamegraph.pl / speedscope
+@router.post("/diagnostics/profile", dependencies=[Depends(require_diagnostics_token)])
+async def capture_profile(
+    seconds: float = 10,
+    interval_ms: float = 5,
+    all_threads: bool = False,
+    format: str = "json"
+):
+    if not 0 < seconds <= DIAG_PROFILE_MAX_SECONDS:
+        raise HTTPException(status_code=400, detail=f"seconds phải trong khoảng (0, {DIAG_PROFILE_MAX_SECONDS}]")
+    if interval_ms < 1:
+        raise HTTPException(status_code=400, detail="interval_ms tối thiểu là 1")
+    if profiler.running:
+        raise HTTPException(status_code=409, detail="Đang có profile khác chạy")
+
+    # Endpoint chạy trên thread của event loop
+    thread_ids = None if all_threads else {threading.get_ident()}
+    result = await asyncio.to_thread(profiler.run, seconds, interval_ms / 1000, thread_ids)
+    if result is None:
+        raise HTTPException(status_code=409, detail="Đang có profile khác chạy")
+
+    samples, stacks = result
+    if format == "collapsed":
+        return PlainTextResponse(collapsed(stacks))
+    return {"seconds": seconds, "samples": samples, "top": top_functions(stacks, samples)}
+
+# API xem tiến độ job xóa nhà/phòng chạy nền
+@router.get("/jobs/{job_id}")
+async def get_job_status(
+    job_id: str,
+    current_user: dict = Depends(get_current_user)
+):
+    job = get_job(job_id)
+    if not job or job["userId"] != str(current_user["_id"]):
+        raise HTTPException(status_code=404, detail="Job không tồn tại")
+
+    return {k: v for k, v in job.items() if k != "userId"}
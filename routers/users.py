@@ -1,55 +1,57 @@
 from fastapi import APIRouter, HTTPException, status, Depends
 from fastapi.security import OAuth2PasswordRequestForm, OAuth2PasswordBearer
 from database import db
-from models import User, UserRegisterRequest, UserUpdateRequest, RefreshToken
-from passlib.context import CryptContext
+from models import User, UserRegisterRequest, UserUpdateRequest
+from hashing import hash_password, check_password
 from datetime import datetime, timedelta, timezone
 from jose import jwt
 import os
 from dotenv import load_dotenv
 from bson import ObjectId
-import secrets
+from routers.utils import token_roles, get_user_house_roles
+from versions import bump_house_versions
+import refresh_tokens
 
 load_dotenv()
 
 router = APIRouter()
 
 # Cấu hình bảo mật
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = "HS256"
 
+# Nhúng role của user ở các nhà vào access token (bỏ qua nếu user ở quá TOKEN_MAX_HOUSES nhà)
+TOKEN_EMBED_ROLES = os.getenv("TOKEN_EMBED_ROLES", "0") == "1"
+TOKEN_MAX_HOUSES = int(os.getenv("TOKEN_MAX_HOUSES", 20))
 
-# Hàm mã hóa password
-def get_password_hash(password):
-    return pwd_context.hash(password)
+
+# Hàm mã hóa password (chạy trong pool riêng, không chặn event loop)
+async def get_password_hash(password):
+    return await hash_password(password)
 
 # Hàm kiểm tra password
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+async def verify_password(plain_password, hashed_password):
+    return await check_password(plain_password, hashed_password)
 
 # Hàm tạo access token
-def create_access_token(data: dict):
+# roles: {houseId: role}, membership_version: giá trị membershipVersion của user lúc lấy roles
+def create_access_token(data: dict, roles: dict = None, membership_version: int = 0):
     to_encode = data.copy()
+    if roles is not None:
+        to_encode.update({"roles": roles, "mv": membership_version})
     # Token hết hạn sau 30p
     expire = datetime.now(timezone.utc) + timedelta(minutes=30)
     to_encode.update({"exp": expire})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-# Hàm tạo refresh token
-async def create_refresh_token(user_id: str):
-    # Sinh chuỗi ngẫu nhiên
-    token = secrets.token_hex(32)
-    expires = datetime.now(timezone.utc) + timedelta(days=30)
-
-    refresh_token = RefreshToken(
-        userId=user_id,
-        token=token,
-        expiresAt=expires
-    )
-    await db.refresh_tokens.insert_one(refresh_token.model_dump(by_alias=True, exclude=["id"]))
-    return token
+# Hàm tạo access token cho user (kèm role nếu được bật)
+async def create_user_access_token(user_id: str, membership_version: int = 0):
+    roles = None
+    if TOKEN_EMBED_ROLES:
+        # Đọc version trước khi lấy roles: nếu roles đổi giữa chừng, version trong token sẽ cũ -> quay về DB
+        roles = await get_user_house_roles(user_id, TOKEN_MAX_HOUSES)
+    return create_access_token(data={"sub": user_id}, roles=roles, membership_version=membership_version)
 
 # API đăng ký user mới
 @router.post("/register", status_code=status.HTTP_201_CREATED)
@@ -62,7 +64,7 @@ async def register_user(user_req: UserRegisterRequest):
     # Tạo user mới
     new_user = User(
         email=user_req.email,
-        passwordHash=get_password_hash(user_req.password),
+        passwordHash=await get_password_hash(user_req.password),
         fullName=user_req.fullName
     )
 
@@ -82,14 +84,14 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends()):
         raise HTTPException(status_code=400, detail="Sai email hoặc mật khẩu")
 
     # Kiểm tra mật khẩu
-    if not verify_password(form_data.password, user["passwordHash"]):
+    if not await verify_password(form_data.password, user["passwordHash"]):
         raise HTTPException(status_code=400, detail="Sai email hoặc mật khẩu")
 
     # Tạo token
     # Cho userId vào trong token để sau này biết ai đang gọi
     user_id = str(user["_id"])
-    access_token = create_access_token(data={"sub": user_id})
-    refresh_token = await create_refresh_token(user_id)
+    access_token = await create_user_access_token(user_id, user.get("membershipVersion", 0))
+    refresh_token = await refresh_tokens.issue(user_id)
     
     return {
         "access_token": access_token,
@@ -100,29 +102,22 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends()):
 # Api đăng xuất (revoke refresh token)
 @router.post("/logout")
 async def logout(refresh_token: str):
-    await db.refresh_tokens.delete_one({"token": refresh_token})
+    await refresh_tokens.revoke(refresh_token)
     return {"message": "Đăng xuất thành công"}
 
 
 # API làm mới token
 @router.post("/refresh")
 async def refresh_access_token(refresh_token: str):
-    token_doc = await db.refresh_tokens.find_one({"token": refresh_token})
-    if not token_doc:
-        raise HTTPException(status_code=401, detail="Refresh token không tồn tại")
-
-    # Check hết hạn
-    if token_doc["expiresAt"] < datetime.now(timezone.utc).replace(tzinfo=None):
-        await db.refresh_tokens.delete_one({"token": refresh_token})
-        raise HTTPException(status_code=401, detail="Refresh token đã hết hạn, đăng nhập lại")
-    
-    # Xóa refresh token cũ
-    await db.refresh_tokens.delete_one({"token": refresh_token})
+    # Xoay refresh token (kiểm tra hết hạn + phát hiện dùng lại)
+    user_id, refresh_token = await refresh_tokens.rotate(refresh_token)
 
-    # Cấp token mới
-    user_id = token_doc["userId"]
-    access_token = create_access_token(data={"sub": user_id})
-    refresh_token = await create_refresh_token(user_id)
+    # Cấp access token mới
+    membership_version = 0
+    if TOKEN_EMBED_ROLES:
+        user = await db.users.find_one({"_id": ObjectId(user_id)}, {"membershipVersion": 1})
+        membership_version = user.get("membershipVersion", 0) if user else 0
+    access_token = await create_user_access_token(user_id, membership_version)
 
     return {
         "access_token": access_token,
@@ -136,6 +131,10 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/users/login")
 
 # Hàm lấy token từ header, giải mã và tìm user trong DB
 async def get_current_user(token: str = Depends(oauth2_scheme)):
+    return await get_user_from_token(token)
+
+# Giải mã access token và lấy user (dùng chung cho HTTP và WebSocket)
+async def get_user_from_token(token: str):
     credentials_exception = HTTPException(
         status_code=401,
         detail="Token không hợp lệ hoặc đã hết hạn",
@@ -156,6 +155,13 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
     if user is None:
         raise credentials_exception
 
+    # Token mang role và membershipVersion còn khớp -> check_house_access dùng role trong token
+    roles = payload.get("roles")
+    if roles is not None and payload.get("mv") == user.get("membershipVersion", 0):
+        token_roles.set((userId, roles))
+    else:
+        token_roles.set(None)
+
     # Trả về toàn bộ thông tin user để các hàm khác dùng
     return user
 
@@ -172,7 +178,7 @@ async def update_user(
 ):
     for k, v in user_update.model_dump().items():
         if k == "passwordHash" and v is not None:
-            user_update.passwordHash = get_password_hash(v)
+            user_update.passwordHash = await get_password_hash(v)
     update_data = {k: v for k, v in user_update.model_dump().items() if v is not None}
     
     if len(update_data) >= 1:
@@ -180,5 +186,10 @@ async def update_user(
             {"_id": current_user["_id"]},
             {"$set": update_data}
         )
+
+        # Tên/email hiển thị trong danh sách thành viên của mọi nhà user tham gia
+        if update_data.get("fullName") != current_user.get("fullName"):
+            house_roles = await get_user_house_roles(str(current_user["_id"]), limit=10000)
+            await bump_house_versions(list(house_roles or {}))
     
     return {"message": "Cập nhật thông tin thành công"}
\ No newline at end of file
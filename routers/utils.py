@@ -1,7 +1,21 @@
 from fastapi import HTTPException
+from typing import List
 from database import db
 from models import Device
 from bson import ObjectId
+from cache import TTLCache, MISSING
+from cascade import run_in_transaction, collect_device_ids, collect_tombstones, collect_rule_tombstones, delete_devices
+from changes import record_changes
+from snapshots import invalidate_snapshot
+from invalidation import bus
+from routing import routing
+from usage import usage
+from conditions import conditions
+from contextvars import ContextVar
+import logging
+import os
+
+logger = logging.getLogger(__name__)
 
 # Định nghĩa cấp độ quyền hạn
 ROLE_LEVELS = {
@@ -10,28 +24,144 @@ ROLE_LEVELS = {
     "OWNER": 3
 }
 
-# Hàm kiểm tra quyền truy cập nhà
-async def check_house_access(house_id: str, user_id: str, required_role: str = "MEMBER"):    
-    # Check Ownership
-    house = await db.houses.find_one({"_id": ObjectId(house_id)})
+# Cache quyền: (houseId, userId) -> role (None nếu không phải thành viên)
+ACCESS_CACHE_TTL = float(os.getenv("ACCESS_CACHE_TTL", 30))
+access_cache = TTLCache(ttl=ACCESS_CACHE_TTL, maxsize=50000)
+
+# Xóa cache quyền khi thành viên thay đổi (hoặc cả nhà nếu không truyền user_id)
+def invalidate_house_access(house_id: str, user_id: str = None):
+    if user_id is not None:
+        access_cache.pop((house_id, user_id))
+    else:
+        access_cache.invalidate_where(lambda key: key[0] == house_id)
+
+# Thay đổi từ replica khác (qua change stream) cũng phải xóa cache quyền
+@bus.on("home_members")
+def _on_member_change(event):
+    if event.doc and "houseId" in event.doc:
+        invalidate_house_access(event.doc["houseId"], event.doc.get("userId"))
+    else:
+        # Xóa thành viên mà không có document cũ -> không biết nhà nào
+        access_cache.clear()
+
+@bus.on("houses")
+def _on_house_change(event):
+    # Nhà bị xóa hoặc đổi chủ
+    invalidate_house_access(event.id)
+
+bus.on_reset(access_cache.clear)
+
+# Quyền lấy từ access token của request hiện tại: (userId, {houseId: role})
+# Chỉ được set khi membershipVersion trong token khớp với DB (xem get_current_user)
+token_roles: ContextVar = ContextVar("token_roles", default=None)
+
+# Tăng membershipVersion của user -> các token đang mang role cũ sẽ quay về kiểm tra qua DB
+async def bump_membership_version(user_ids: List[str]):
+    if not user_ids:
+        return
+    await db.users.update_many(
+        {"_id": {"$in": [ObjectId(u) for u in user_ids]}},
+        {"$inc": {"membershipVersion": 1}}
+    )
+
+# Lấy danh sách role của user ở mọi nhà (dùng để nhúng vào token)
+# Trả về None nếu user ở quá nhiều nhà, khi đó token không mang role
+async def get_user_house_roles(user_id: str, limit: int):
+    roles = {}
+    async for house in db.houses.find({"ownerId": user_id}, {"_id": 1}).limit(limit + 1):
+        roles[str(house["_id"])] = "OWNER"
+
+    members_cursor = db.home_members.find(
+        {"userId": user_id, "status": "ACCEPTED"},
+        {"houseId": 1, "role": 1}
+    ).limit(limit + 1)
+    async for m in members_cursor:
+        roles[m["houseId"]] = m["role"]
+
+    if len(roles) > limit:
+        return None
+    return roles
+
+# Hàm lấy vai trò của user trong nhà
+async def get_house_role(house_id: str, user_id: str):
+    # Ưu tiên role trong token (không cần truy vấn DB)
+    claims = token_roles.get()
+    if claims is not None and claims[0] == user_id and house_id in claims[1]:
+        return claims[1][house_id]
+
+    role = access_cache.get((house_id, user_id))
+    if role is not MISSING:
+        return role
+
+    house = await db.houses.find_one({"_id": ObjectId(house_id)}, {"ownerId": 1})
     if not house:
         raise HTTPException(status_code=404, detail="Nhà không tồn tại")
-        
+
     if house["ownerId"] == user_id:
-        return True
-
-    # Check bảng home_members
-    member = await db.home_members.find_one({
-        "houseId": house_id,
-        "userId": user_id,
-        "status": "ACCEPTED"
-    })
-    
-    if not member:
+        role = "OWNER"
+    else:
+        member = await db.home_members.find_one(
+            {"houseId": house_id, "userId": user_id, "status": "ACCEPTED"},
+            {"role": 1}
+        )
+        role = member["role"] if member else None
+
+    access_cache.set((house_id, user_id), role)
+    return role
+
+# Hàm lấy vai trò của user trong nhiều nhà cùng lúc (1 query cho các nhà chưa có trong cache)
+# Trả về dict houseId -> role, nhà không tồn tại sẽ không có trong kết quả
+async def get_house_roles(house_ids: List[str], user_id: str):
+    roles = {}
+    missing = []
+    for house_id in dict.fromkeys(house_ids):
+        role = access_cache.get((house_id, user_id))
+        if role is MISSING:
+            missing.append(house_id)
+        else:
+            roles[house_id] = role
+
+    if missing:
+        pipeline = [
+            {"$match": {"_id": {"$in": [ObjectId(h) for h in missing]}}},
+            {"$project": {"ownerId": 1}},
+            {"$lookup": {
+                "from": "home_members",
+                "let": {"hid": {"$toString": "$_id"}},
+                "pipeline": [
+                    {"$match": {
+                        "$expr": {"$eq": ["$houseId", "$$hid"]},
+                        "userId": user_id,
+                        "status": "ACCEPTED"
+                    }},
+                    {"$project": {"role": 1}},
+                    {"$limit": 1}
+                ],
+                "as": "membership"
+            }}
+        ]
+        async for house in db.houses.aggregate(pipeline):
+            house_id = str(house["_id"])
+            if house["ownerId"] == user_id:
+                role = "OWNER"
+            elif house["membership"]:
+                role = house["membership"][0]["role"]
+            else:
+                role = None
+            access_cache.set((house_id, user_id), role)
+            roles[house_id] = role
+
+    return roles
+
+# Hàm kiểm tra quyền truy cập nhà
+async def check_house_access(house_id: str, user_id: str, required_role: str = "MEMBER"):
+    role = await get_house_role(house_id, user_id)
+
+    if role is None:
         raise HTTPException(status_code=403, detail="Bạn không phải thành viên của nhà này")
 
     # Check quyền hạn
-    user_role_level = ROLE_LEVELS.get(member["role"], 0)
+    user_role_level = ROLE_LEVELS.get(role, 0)
     required_level = ROLE_LEVELS.get(required_role, 1)
 
     if user_role_level < required_level:
@@ -43,42 +173,106 @@ async def check_house_access(house_id: str, user_id: str, required_role: str = "
     return True
 
 
-# Hàm xử lý xóa dữ liệu liên quan
+# Hàm xử lý xóa dữ liệu liên quan. Trả về tombstone của lịch hẹn / luật bị xóa theo,
+# người gọi ghi cùng tombstone của endpoint / thiết bị vào change log
 async def delete_endpoint_data(device_id: str, endpoint_id: int):
-    await db.commands.delete_many({"deviceId": device_id, "endpointId": endpoint_id})
-    await db.auto_off_rules.delete_one({"deviceId": device_id, "endpointId": endpoint_id})
-    await db.schedules.delete_many({"deviceId": device_id, "endpointId": endpoint_id})
-    await db.devices.update_one(
-        {"_id": ObjectId(device_id)},
-        {"$pull": {"endpoints": {"id": endpoint_id}}}
-    )
-    print(f"Đã xóa endpoint: {device_id}/{endpoint_id}")
+    tombstones = []
+
+    async def work(session):
+        query = {"deviceId": device_id, "endpointId": endpoint_id}
+        rule_query = {"targetDeviceId": device_id, "targetEndpointId": endpoint_id}
+        tombstones[:] = await collect_tombstones(query, session) + await collect_rule_tombstones(rule_query, session)
+        await db.commands.delete_many(query, session=session)
+        await db.auto_off_rules.delete_many(query, session=session)
+        await db.schedules.delete_many(query, session=session)
+        await db.usage_rollups.delete_many(query, session=session)
+        await db.condition_rules.delete_many(rule_query, session=session)
+        await db.devices.update_one(
+            {"_id": ObjectId(device_id)},
+            {"$pull": {"endpoints": {"id": endpoint_id}}},
+            session=session
+        )
+
+    await run_in_transaction(work)
+    conditions.remove_where(lambda r: r.target_device_id == device_id and r.target_endpoint_id == endpoint_id)
+    usage.forget_endpoint(device_id, endpoint_id)
+    logger.info("Đã xóa endpoint", extra={"device": device_id, "endpoint": endpoint_id})
+    return tombstones
 
 async def delete_device_data(device_id: str):
-    await db.commands.delete_many({"deviceId": device_id})
-    await db.auto_off_rules.delete_one({"deviceId": device_id})
-    await db.schedules.delete_many({"deviceId": device_id})
-    await db.devices.delete_one({"_id": ObjectId(device_id)})
-    print(f"Đã xóa thiết bị: {device_id}")
+    tombstones = []
+
+    async def work(session):
+        tombstones.clear()
+        await delete_devices([device_id], session, tombstones=tombstones)
+
+    await run_in_transaction(work)
+    conditions.remove_where(lambda r: r.target_device_id == device_id)
+    logger.info("Đã xóa thiết bị", extra={"device": device_id})
+    return tombstones
+
+# job != None: xóa nền theo từng lượt (không transaction) và cập nhật tiến độ vào job
+async def delete_room_data(room_id: str, house_id: str, job: dict = None):
+    device_ids = []
+    tombstones = []
+
+    async def work(session):
+        device_ids[:] = await collect_device_ids({"roomId": room_id}, session)
+        tombstones.clear()
+        if job is not None:
+            job["totalDevices"] = len(device_ids)
+        await delete_devices(device_ids, session, job, tombstones)
+        tombstones.extend(await collect_rule_tombstones({"roomId": room_id}, session))
+        await db.condition_rules.delete_many({"roomId": room_id}, session=session)
+        await db.rooms.delete_one({"_id": ObjectId(room_id)}, session=session)
+
+    if job is not None:
+        await work(None)
+    else:
+        await run_in_transaction(work)
 
-async def delete_room_data(room_id: str):
-    devices_cursor = db.devices.find({"roomId": room_id})
-    async for device in devices_cursor:
-        await delete_device_data(str(device["_id"]))
+    routing.remove_devices(device_ids)
+    usage.forget_devices(device_ids)
+    targets = set(device_ids)
+    conditions.remove_where(lambda r: r.room_id == room_id or r.target_device_id in targets)
+    # Tombstone cho phòng, các thiết bị trong phòng và lịch hẹn / luật của chúng
+    # (luật vừa ở trong phòng vừa điều khiển thiết bị của phòng chỉ ghi 1 lần)
+    unique = list(dict.fromkeys(tombstones))
+    await record_changes(house_id, unique + [("device", d, "delete") for d in device_ids] + [("room", room_id, "delete")])
+    logger.info("Đã xóa phòng", extra={"room": room_id, "house": house_id})
 
-    await db.rooms.delete_one({"_id": ObjectId(room_id)})
+async def delete_house_data(house_id: str, job: dict = None):
+    # Lấy danh sách người có quyền trước khi xóa để vô hiệu role trong token của họ
+    house = await db.houses.find_one({"_id": ObjectId(house_id)}, {"ownerId": 1})
+    member_ids = await db.home_members.distinct("userId", {"houseId": house_id, "status": "ACCEPTED"})
 
-    print(f"Đã xóa phòng: {room_id}")
+    device_ids = []
 
-async def delete_house_data(house_id: str):
-    devices_cursor = db.devices.find({"houseId": house_id})
-    async for device in devices_cursor:
-        await delete_device_data(str(device["_id"]))
+    async def work(session):
+        device_ids[:] = await collect_device_ids({"houseId": house_id}, session)
+        if job is not None:
+            job["totalDevices"] = len(device_ids)
+        await delete_devices(device_ids, session, job)
 
-    await db.rooms.delete_many({"houseId": house_id})
+        await db.rooms.delete_many({"houseId": house_id}, session=session)
+        await db.home_members.delete_many({"houseId": house_id}, session=session)
+        await db.condition_rules.delete_many({"houseId": house_id}, session=session)
+        await db.house_changes.delete_many({"houseId": house_id}, session=session)
+        # Xóa nhà sau cùng: nếu bị gián đoạn, người dùng vẫn thấy nhà để xóa lại
+        await db.houses.delete_one({"_id": ObjectId(house_id)}, session=session)
 
-    await db.home_members.delete_many({"houseId": house_id})
+    if job is not None:
+        await work(None)
+    else:
+        await run_in_transaction(work)
 
-    await db.houses.delete_one({"_id": ObjectId(house_id)})
+    invalidate_house_access(house_id)
+    invalidate_snapshot(house_id)
+    routing.remove_devices(device_ids)
+    usage.forget_devices(device_ids)
+    conditions.remove_where(lambda r: r.house_id == house_id)
+    if house:
+        member_ids.append(house["ownerId"])
+    await bump_membership_version(member_ids)
 
-    print(f"Đã xóa nhà: {house_id}")
\ No newline at end of file
+    logger.info("Đã xóa nhà", extra={"house": house_id})
@@ -0,0 +1,160 @@
+import logging
+import asyncio
+import os
+from bson import ObjectId
+from dotenv import load_dotenv
+from database import db
+from invalidation import bus
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# Tải lại toàn bộ index định kỳ (giây), phòng khi bỏ lỡ thay đổi từ replica khác (0 = tắt)
+ROUTING_RELOAD_SECONDS = float(os.getenv("ROUTING_RELOAD_SECONDS", 300))
+
+
+# Index trong bộ nhớ: topic MQTT "{roomId}/..." + endpointId -> deviceId,
+# để ingest ghi thẳng theo _id và bỏ qua message của phòng không tồn tại mà không cần query
+class RoutingIndex:
+    def __init__(self):
+        # roomId -> {endpointId: deviceId}
+        self.rooms = {}
+        # deviceId -> (roomId, [endpointId])
+        self.devices = {}
+        # roomId -> set deviceId
+        self.room_devices = {}
+        self.loaded = False
+        # Phòng đang có endpoint trùng giữa các board
+        self.conflict_rooms = set()
+        self.rejected = 0
+        self.task = None
+
+    # Phòng có nhiều board trùng endpointId -> board tạo trước (_id nhỏ hơn) nhận message
+    def _rebuild_room(self, room_id: str):
+        device_ids = self.room_devices.get(room_id)
+        if not device_ids:
+            self.rooms.pop(room_id, None)
+            self.room_devices.pop(room_id, None)
+            self.conflict_rooms.discard(room_id)
+            return
+
+        routes = {}
+        conflicted = False
+        for device_id in sorted(device_ids):
+            for endpoint_id in self.devices[device_id][1]:
+                if endpoint_id in routes:
+                    conflicted = True
+                    continue
+                routes[endpoint_id] = device_id
+        self.rooms[room_id] = routes
+
+        if conflicted and room_id not in self.conflict_rooms:
+            logger.warning("Phòng có nhiều thiết bị trùng endpoint, message gửi tới thiết bị tạo trước", extra={"room": room_id})
+            self.conflict_rooms.add(room_id)
+        elif not conflicted:
+            self.conflict_rooms.discard(room_id)
+
+    def set_device(self, device_id: str, room_id: str, endpoint_ids):
+        old = self.devices.get(device_id)
+        self.devices[device_id] = (room_id, list(endpoint_ids))
+        self.room_devices.setdefault(room_id, set()).add(device_id)
+        if old and old[0] != room_id:
+            self.room_devices.get(old[0], set()).discard(device_id)
+            self._rebuild_room(old[0])
+        self._rebuild_room(room_id)
+
+    def add_endpoint(self, device_id: str, endpoint_id: int):
+        entry = self.devices.get(device_id)
+        if entry and endpoint_id not in entry[1]:
+            self.set_device(device_id, entry[0], entry[1] + [endpoint_id])
+
+    def remove_endpoint(self, device_id: str, endpoint_id: int):
+        entry = self.devices.get(device_id)
+        if entry and endpoint_id in entry[1]:
+            self.set_device(device_id, entry[0], [e for e in entry[1] if e != endpoint_id])
+
+    def remove_devices(self, device_ids):
+        rooms = set()
+        for device_id in device_ids:
+            entry = self.devices.pop(device_id, None)
+            if entry:
+                self.room_devices.get(entry[0], set()).discard(device_id)
+                rooms.add(entry[0])
+        for room_id in rooms:
+            self._rebuild_room(room_id)
+
+    def has_room(self, room_id: str) -> bool:
+        return room_id in self.rooms
+
+    def lookup(self, room_id: str, endpoint_id: int):
+        routes = self.rooms.get(room_id)
+        return routes.get(endpoint_id) if routes else None
+
+    def _set_all(self, devices):
+        self.devices, self.room_devices, self.rooms = {}, {}, {}
+        self.conflict_rooms = set()
+        for device_id, room_id, endpoint_ids in devices:
+            self.devices[device_id] = (room_id, endpoint_ids)
+            self.room_devices.setdefault(room_id, set()).add(device_id)
+        for room_id in list(self.room_devices):
+            self._rebuild_room(room_id)
+
+    async def load(self):
+        devices = []
+        async for d in db.devices.find({"roomId": {"$exists": True}}, {"roomId": 1, "endpoints.id": 1}).batch_size(5000):
+            devices.append((str(d["_id"]), d["roomId"], [ep["id"] for ep in d.get("endpoints", [])]))
+        # Thay toàn bộ cùng lúc (không await giữa chừng) để ingest không thấy index dở dang
+        self._set_all(devices)
+        self.loaded = True
+        logger.info("Routing index: %d thiết bị, %d phòng", len(self.devices), len(self.rooms))
+
+    async def reload_device(self, device_id: str):
+        d = await db.devices.find_one({"_id": ObjectId(device_id)}, {"roomId": 1, "endpoints.id": 1})
+        if d is None or "roomId" not in d:
+            self.remove_devices([device_id])
+        else:
+            self.set_device(device_id, d["roomId"], [ep["id"] for ep in d.get("endpoints", [])])
+
+    async def _reload_loop(self):
+        while True:
+            await asyncio.sleep(ROUTING_RELOAD_SECONDS)
+            try:
+                await self.load()
+            except Exception as e:
+                logger.error("Lỗi tải lại routing index: %s", e)
+
+    async def start(self):
+        await self.load()
+        if ROUTING_RELOAD_SECONDS > 0:
+            self.task = asyncio.create_task(self._reload_loop())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            self.task = None
+
+    def stats(self):
+        return {
+            "loaded": self.loaded,
+            "rooms": len(self.rooms),
+            "devices": len(self.devices),
+            "conflictRooms": len(self.conflict_rooms),
+            "rejected": self.rejected
+        }
+
+
+routing = RoutingIndex()
+
+
+# Thiết bị thêm/sửa/xóa ở replica khác
+@bus.on("devices")
+def _on_device_change(event):
+    if event.op == "delete":
+        routing.remove_devices([event.id])
+    elif event.op == "insert" and event.doc is not None and "roomId" in event.doc:
+        routing.set_device(event.id, event.doc["roomId"], [ep["id"] for ep in event.doc.get("endpoints", [])])
+    else:
+        bus.spawn(routing.reload_device(event.id))
+
+bus.on_reset(lambda: bus.spawn(routing.load()))
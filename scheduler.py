@@ -1,8 +1,16 @@
+import logging
 import asyncio
 import json
+import time
 from datetime import datetime, timedelta
 from database import db
+from bson import ObjectId
 from mqtt_client import mqtt
+from changes import record_change, compact_change_log, CHANGELOG_COMPACT_INTERVAL
+from usage import usage
+from metrics import record_publish, scheduler_ticks, scheduler_lateness
+
+logger = logging.getLogger(__name__)
 
 # Hàm hỗ trợ tạo payload gộp 3 thiết bị
 def build_fixed_payload(device, target_ep_id, target_val):
@@ -35,7 +43,7 @@ async def check_auto_off_rules():
         duration = rule["durationSec"]
 
         # Tìm thiết bị trong DB để kiểm tra trạng thái
-        device = await db.devices.find_one({"deviceId": device_id})
+        device = await db.devices.find_one({"_id": ObjectId(device_id)})
         if not device: continue
 
         # Tìm endpoint đích
@@ -45,19 +53,26 @@ async def check_auto_off_rules():
         if target_ep and target_ep.get("value") == 1:
             turn_on_time = target_ep["lastUpdated"]
             if (datetime.now() - turn_on_time).total_seconds() >= duration:
-                print(f"Auto-Off: Tắt device{endpoint_id}")
+                logger.info("Auto-Off: tắt endpoint", extra={"device": device_id, "endpoint": endpoint_id})
+                scheduler_lateness.observe((datetime.now() - turn_on_time).total_seconds() - duration, "auto_off")
                 
                 if device.get("roomId"):
                     topic = f"{device['roomId']}/device"
                     # Tắt -> target_val = 0
                     payload = build_fixed_payload(device, endpoint_id, 0)
                     mqtt.publish(topic, json.dumps(payload))
+                    record_publish("auto_off")
                 
                 # Cập nhật DB
-                await db.devices.update_one(
-                    {"deviceId": device_id, "endpoints.id": endpoint_id},
-                    {"$set": {"endpoints.$.value": 0, "endpoints.$.lastUpdated": datetime.now()}}
+                off_at = datetime.now()
+                # Chỉ ghi khi endpoint còn bật: replica khác / message mới đã tắt thì không đếm lại
+                result = await db.devices.update_one(
+                    {"_id": ObjectId(device_id), "endpoints": {"$elemMatch": {"id": endpoint_id, "value": 1}}},
+                    {"$set": {"endpoints.$.value": 0, "endpoints.$.lastUpdated": off_at}}
                 )
+                usage.record_command(device["houseId"], device_id, endpoint_id, off_at)
+                usage.observe(device["houseId"], device_id, endpoint_id, 0, off_at, 1, turn_on_time, changed=result.modified_count == 1)
+                await record_change(device["houseId"], "endpoint", f"{device_id}:{endpoint_id}", "update")
 
 # Hàm xử lý Schedule
 async def check_schedules():
@@ -69,10 +84,11 @@ async def check_schedules():
     }).to_list(None)
 
     for sch in pending_schedules:
-        print(f"Schedule: Thực thi lịch {sch['name']}")
+        logger.info("Schedule: thực thi lịch %s", sch["name"], extra={"device": sch["deviceId"], "endpoint": sch["endpointId"]})
+        scheduler_lateness.observe((now - sch["nextRunAt"]).total_seconds(), "schedule")
         
         # Gửi lệnh MQTT
-        device = await db.devices.find_one({"deviceId": sch["deviceId"]})
+        device = await db.devices.find_one({"_id": ObjectId(sch["deviceId"])})
         if device and device.get("roomId"):
             try:
                 action = json.loads(sch["action"])
@@ -86,8 +102,10 @@ async def check_schedules():
                 topic = f"{device['roomId']}/device"
                 payload = build_fixed_payload(device, sch["endpointId"], target_val)
                 mqtt.publish(topic, json.dumps(payload))
+                record_publish("schedule")
+                usage.record_command(device["houseId"], sch["deviceId"], sch["endpointId"])
             except Exception as e:
-                print(f"Lỗi schedule: {e}")
+                logger.exception("Lỗi schedule: %s", e)
 
         # Tính toán thời gian chạy tiếp theo
         updates = {}
@@ -100,16 +118,26 @@ async def check_schedules():
             
         if updates:
             await db.schedules.update_one({"_id": sch["_id"]}, {"$set": updates})
+            if device:
+                await record_change(device["houseId"], "schedule", str(sch["_id"]), "update")
 
 # Vòng lặp chính (Background Task)
 async def run_scheduler():
-    print("Scheduler Service đã khởi động...")
+    logger.info("Scheduler Service đã khởi động...")
+    last_compact = datetime.min
     while True:
+        started = time.perf_counter()
         try:
             await check_auto_off_rules()
             await check_schedules()
+
+            # Dọn change log định kỳ
+            if (datetime.now() - last_compact).total_seconds() >= CHANGELOG_COMPACT_INTERVAL:
+                last_compact = datetime.now()
+                await compact_change_log()
         except Exception as e:
-            print(f"Lỗi Scheduler: {e}")
+            logger.exception("Lỗi Scheduler: %s", e)
+        scheduler_ticks.observe(time.perf_counter() - started)
         
         # Nghỉ 10 giây rồi quét tiếp
         await asyncio.sleep(10)
\ No newline at end of file
@@ -0,0 +1,91 @@
+import json
+import typing
+from datetime import datetime
+from bson import ObjectId
+from fastapi import Response
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+from models import ConditionRule, Device, House, Room, Schedule
+
+# orjson nhanh hơn nhiều nếu được cài, không có thì dùng json chuẩn
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# json chỉ gọi hàm này với kiểu không chuẩn JSON
+def json_default(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Không serialize được kiểu {type(value).__name__}")
+
+
+def dumps(content) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content, default=json_default)
+    return json.dumps(content, default=json_default, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+# Response JSON không qua jsonable_encoder / validate của FastAPI
+class FastJSONResponse(JSONResponse):
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+# Model con trong List[...] (ví dụ List[DeviceEndpoint]) -> encoder riêng
+def _nested_model(annotation):
+    for arg in typing.get_args(annotation):
+        if isinstance(arg, type) and issubclass(arg, BaseModel):
+            return arg
+    return None
+
+
+# Biên dịch sẵn encoder cho 1 model: document Mongo -> dict cùng dạng với response_model
+# (key theo alias, điền giá trị mặc định, ObjectId -> str) mà không validate lại
+def make_encoder(model):
+    fields = []
+    for name, info in model.model_fields.items():
+        nested = _nested_model(info.annotation)
+        fields.append((
+            info.alias or name,
+            name,
+            info,
+            make_encoder(nested) if nested is not None else None
+        ))
+
+    def encode(doc: dict) -> dict:
+        out = {}
+        for key, name, info, nested in fields:
+            if key in doc:
+                value = doc[key]
+            elif name in doc:
+                value = doc[name]
+            else:
+                value = info.get_default(call_default_factory=True)
+
+            if nested is not None and value is not None:
+                value = [nested(v) for v in value]
+            elif isinstance(value, ObjectId):
+                value = str(value)
+            out[key] = value
+        return out
+
+    return encode
+
+
+encode_house = make_encoder(House)
+encode_room = make_encoder(Room)
+encode_device = make_encoder(Device)
+encode_schedule = make_encoder(Schedule)
+encode_condition_rule = make_encoder(ConditionRule)
+
+
+# Trả list document qua encoder, giữ lại header đã set trên response (ví dụ X-Next-Cursor)
+def fast_list_response(docs, encoder, response: Response = None):
+    result = FastJSONResponse([encoder(d) for d in docs])
+    if response is not None:
+        result.headers.update(response.headers)
+    return result
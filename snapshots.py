@@ -0,0 +1,96 @@
+import asyncio
+import os
+from collections import OrderedDict
+from bson import ObjectId
+from dotenv import load_dotenv
+from database import db
+from loaders import Loader
+from serializers import encode_house, encode_room, encode_device, dumps
+from invalidation import bus
+
+load_dotenv()
+
+# Số nhà tối đa giữ snapshot trong bộ nhớ
+SNAPSHOT_CACHE_SIZE = int(os.getenv("SNAPSHOT_CACHE_SIZE", 1000))
+
+# houseId -> (version, JSON bytes)
+_cache = OrderedDict()
+stats = {"hits": 0, "misses": 0}
+
+
+def _member_row(user_id, role, user):
+    return {
+        "userId": user_id,
+        "role": role,
+        "email": user["email"] if user else None,
+        "fullName": user["fullName"] if user else None
+    }
+
+
+# Nhà + phòng + thiết bị (kèm trạng thái endpoint) + thành viên: mỗi collection 1 query riêng, ghép lại ở đây
+# (không gộp bằng $lookup: nhà nhiều thiết bị sẽ vượt giới hạn 16 MB của 1 document kết quả)
+async def _build_snapshot(house_id: str, version: int):
+    house = await db.houses.find_one({"_id": ObjectId(house_id)})
+    if not house:
+        return None
+
+    by_house = {"houseId": house_id}
+    rooms, devices, member_docs = await asyncio.gather(
+        db.rooms.find(by_house).sort("_id", 1).to_list(length=None),
+        db.devices.find(by_house).sort("_id", 1).to_list(length=None),
+        db.home_members.find({**by_house, "status": "ACCEPTED"}).sort("_id", 1).to_list(length=None)
+    )
+    loader = Loader({"users": {"email": 1, "fullName": 1}})
+    users = await loader.load_many("users", [house["ownerId"]] + [m["userId"] for m in member_docs])
+
+    members = [_member_row(house["ownerId"], "OWNER", users.get(house["ownerId"]))]
+    for m in member_docs:
+        members.append(_member_row(m["userId"], m["role"], users.get(m["userId"])))
+
+    return {
+        "version": version,
+        "house": encode_house(house),
+        "rooms": [encode_room(r) for r in rooms],
+        "devices": [encode_device(d) for d in devices],
+        "members": members
+    }
+
+
+# Lấy snapshot dạng JSON bytes; cache còn đúng phiên bản thì không query lại
+async def get_snapshot(house_id: str, version: int):
+    cached = _cache.get(house_id)
+    if cached is not None and cached[0] == version:
+        _cache.move_to_end(house_id)
+        stats["hits"] += 1
+        return cached[1]
+
+    stats["misses"] += 1
+    snapshot = await _build_snapshot(house_id, version)
+    if snapshot is None:
+        return None
+
+    body = dumps(snapshot)
+    # Phiên bản được đọc trước khi query nên dữ liệu luôn mới hơn hoặc bằng phiên bản đã lưu
+    if cached is None or cached[0] <= version:
+        _cache[house_id] = (version, body)
+        _cache.move_to_end(house_id)
+        while len(_cache) > SNAPSHOT_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return body
+
+
+def invalidate_snapshot(house_id: str):
+    _cache.pop(house_id, None)
+
+
+# Nhà bị xóa ở replica khác (các thay đổi còn lại đã được phát hiện qua phiên bản nhà)
+@bus.on("houses")
+def _on_house_change(event):
+    if event.op == "delete":
+        invalidate_snapshot(event.id)
+
+bus.on_reset(_cache.clear)
+
+
+def snapshot_stats():
+    return {"size": len(_cache), "maxsize": SNAPSHOT_CACHE_SIZE, **stats}
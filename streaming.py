@@ -0,0 +1,49 @@
+import json
+import os
+from fastapi.responses import StreamingResponse
+from dotenv import load_dotenv
+from serializers import json_default
+
+load_dotenv()
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+# Số document Motor lấy mỗi lần từ MongoDB
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", 500))
+# Gửi dữ liệu xuống client sau mỗi n dòng (dòng đầu tiên luôn gửi ngay)
+STREAM_FLUSH_LINES = int(os.getenv("STREAM_FLUSH_LINES", 64))
+
+
+def dumps_line(doc) -> str:
+    return json.dumps(doc, default=json_default, ensure_ascii=False, separators=(",", ":")) + "\n"
+
+
+# Đọc cursor và gửi từng dòng JSON, bộ nhớ không phụ thuộc số document
+async def _ndjson_lines(cursor, transform=None):
+    buffer = []
+    first = True
+    try:
+        async for doc in cursor:
+            if transform is not None:
+                doc = transform(doc)
+            buffer.append(dumps_line(doc))
+            if first or len(buffer) >= STREAM_FLUSH_LINES:
+                yield "".join(buffer).encode()
+                buffer = []
+                first = False
+        if buffer:
+            yield "".join(buffer).encode()
+    finally:
+        # Client ngắt kết nối giữa chừng -> đóng cursor trên server
+        await cursor.close()
+
+
+# Tạo response NDJSON trực tiếp từ Motor cursor (find hoặc aggregate)
+def ndjson_response(cursor, transform=None, filename: str = None):
+    if hasattr(cursor, "batch_size"):
+        cursor = cursor.batch_size(STREAM_BATCH_SIZE)
+
+    headers = {}
+    if filename:
+        headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+
+    return StreamingResponse(_ndjson_lines(cursor, transform), media_type=NDJSON_MEDIA_TYPE, headers=headers)
@@ -0,0 +1,233 @@
+import logging
+import asyncio
+import os
+from datetime import datetime, timedelta
+from bson import ObjectId
+from pymongo import UpdateOne
+from dotenv import load_dotenv
+from database import db
+from invalidation import bus
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# Chu kỳ ghi bộ cộng dồn xuống usage_rollups (giây)
+USAGE_FLUSH_SECONDS = float(os.getenv("USAGE_FLUSH_SECONDS", 30))
+
+COUNTERS = ("onSeconds", "switches", "commands")
+
+
+def _is_on(value) -> bool:
+    return isinstance(value, (int, float)) and value != 0
+
+
+def _day(at: datetime) -> str:
+    return at.strftime("%Y-%m-%d")
+
+
+# Thống kê sử dụng theo endpoint: thời gian bật, số lần chuyển trạng thái, số lệnh điều khiển.
+# Cộng dồn trong bộ nhớ từ các lần chuyển trạng thái, định kỳ ghi $inc vào bản ghi ngày và tháng
+class UsageAggregator:
+    def __init__(self, flush_seconds: float):
+        self.flush_seconds = flush_seconds
+        # (deviceId, endpointId) -> [đang bật, từ thời điểm, houseId]
+        self.state = {}
+        # (deviceId, endpointId, ngày) -> {"houseId", "onSeconds", "switches", "commands"}
+        self.pending = {}
+        self.task = None
+        self.started_at = datetime.now()
+        self.flushes = 0
+        self.errors = 0
+
+    def _counter(self, house_id: str, device_id: str, endpoint_id: int, day: str):
+        key = (device_id, endpoint_id, day)
+        counter = self.pending.get(key)
+        if counter is None:
+            counter = self.pending[key] = {"houseId": house_id, "onSeconds": 0.0, "switches": 0, "commands": 0}
+        return counter
+
+    # Cộng thời gian bật trong [start, end), chia theo từng ngày
+    def _add_on_time(self, house_id: str, device_id: str, endpoint_id: int, start: datetime, end: datetime):
+        while start < end:
+            midnight = datetime.combine(start.date() + timedelta(days=1), datetime.min.time())
+            stop = min(end, midnight)
+            self._counter(house_id, device_id, endpoint_id, _day(start))["onSeconds"] += (stop - start).total_seconds()
+            start = stop
+
+    # Endpoint nhận giá trị mới lúc at. prev_value / prev_at: giá trị trước đó trong DB,
+    # chỉ dùng khi bộ nhớ chưa có trạng thái của endpoint (ví dụ sau khi khởi động lại).
+    # Mọi replica đều nhận cùng message MQTT; chỉ replica có lần ghi làm đổi giá trị (changed) đếm lần chuyển
+    # trạng thái và giữ trạng thái endpoint, các replica khác chỉ trả lại phần thời gian bật mình đang giữ
+    def observe(self, house_id: str, device_id: str, endpoint_id: int, value, at: datetime, prev_value=None, prev_at=None, changed: bool = True):
+        # Chỉ thống kê endpoint dạng bật/tắt (cảm biến gửi dict)
+        if isinstance(value, dict):
+            return
+
+        key = (device_id, endpoint_id)
+        on = _is_on(value)
+        state = self.state.get(key)
+        if not changed:
+            if state is None or state[0] == on:
+                # Message lặp lại: endpoint vẫn do replica này giữ (hoặc không giữ), flush tự cộng thời gian bật
+                return
+            # Replica khác đã ghi lần chuyển trạng thái: cộng nốt thời gian bật đang giữ rồi bỏ trạng thái
+            if state[0]:
+                self._add_on_time(house_id, device_id, endpoint_id, state[1], max(at, state[1]))
+            del self.state[key]
+            return
+
+        if state is None:
+            # Chưa có trạng thái: replica mới khởi động, hoặc lần chuyển trước do replica khác ghi
+            # (replica đó tự cộng thời gian bật của nó) -> chỉ tính từ DB khi giá trị cũ có trước lúc khởi động
+            if prev_at is None or prev_at >= self.started_at:
+                self.state[key] = [on, at, house_id]
+                if prev_at is not None and _is_on(prev_value) != on:
+                    self._counter(house_id, device_id, endpoint_id, _day(at))["switches"] += 1
+                return
+            state = [_is_on(prev_value), prev_at, house_id]
+
+        was_on, since, _ = state
+        # at có thể sớm hơn since một chút khi flush vừa cộng thời gian bật tới hiện tại
+        at = max(at, since)
+        if was_on:
+            self._add_on_time(house_id, device_id, endpoint_id, since, at)
+        if was_on != on:
+            self._counter(house_id, device_id, endpoint_id, _day(at))["switches"] += 1
+        self.state[key] = [on, at, house_id]
+
+    # Lệnh điều khiển gửi tới endpoint (API, lịch hẹn, tự tắt)
+    def record_command(self, house_id: str, device_id: str, endpoint_id: int, at: datetime = None):
+        self._counter(house_id, device_id, endpoint_id, _day(at or datetime.now()))["commands"] += 1
+
+    # Thiết bị / endpoint đã xóa: bỏ cả bộ đếm chưa ghi, nếu không flush sẽ upsert lại rollup vừa bị xóa
+    def forget_devices(self, device_ids):
+        device_ids = set(device_ids)
+        for key in [k for k in self.state if k[0] in device_ids]:
+            del self.state[key]
+        for key in [k for k in self.pending if k[0] in device_ids]:
+            del self.pending[key]
+
+    def forget_endpoint(self, device_id: str, endpoint_id: int):
+        self.state.pop((device_id, endpoint_id), None)
+        for key in [k for k in self.pending if k[0] == device_id and k[1] == endpoint_id]:
+            del self.pending[key]
+
+    # Bỏ các endpoint không còn trong thiết bị (endpoint bị xóa ở replica khác)
+    async def sync_device(self, device_id: str):
+        d = await db.devices.find_one({"_id": ObjectId(device_id)}, {"endpoints.id": 1})
+        if d is None:
+            self.forget_devices([device_id])
+            return
+        alive = {ep["id"] for ep in d.get("endpoints", [])}
+        stale = {k[1] for k in [*self.state, *self.pending] if k[0] == device_id and k[1] not in alive}
+        for endpoint_id in stale:
+            self.forget_endpoint(device_id, endpoint_id)
+
+    async def flush(self):
+        # Endpoint đang bật: cộng thời gian tới hiện tại để bản ghi ngày luôn mới
+        now = datetime.now()
+        for (device_id, endpoint_id), state in self.state.items():
+            if state[0] and state[1] < now:
+                self._add_on_time(state[2], device_id, endpoint_id, state[1], now)
+                state[1] = now
+
+        pending, self.pending = self.pending, {}
+        if not pending:
+            return
+
+        # Bản ghi tháng cộng từ cùng bộ đếm với bản ghi ngày
+        merged = {}
+        for (device_id, endpoint_id, day), counter in pending.items():
+            for period, bucket in (("day", day), ("month", day[:7])):
+                key = (device_id, endpoint_id, period, bucket)
+                target = merged.setdefault(key, {"houseId": counter["houseId"], **{c: 0 for c in COUNTERS}})
+                for c in COUNTERS:
+                    target[c] += counter[c]
+
+        ops = [
+            UpdateOne(
+                {"deviceId": device_id, "endpointId": endpoint_id, "period": period, "bucket": bucket},
+                {
+                    "$inc": {c: counter[c] for c in COUNTERS if counter[c]},
+                    "$set": {"updatedAt": now},
+                    "$setOnInsert": {"houseId": counter["houseId"]}
+                },
+                upsert=True
+            )
+            for (device_id, endpoint_id, period, bucket), counter in merged.items()
+            if any(counter[c] for c in COUNTERS)
+        ]
+        if not ops:
+            return
+        try:
+            await db.usage_rollups.bulk_write(ops, ordered=False)
+            self.flushes += 1
+        except Exception as e:
+            # Ghi lỗi -> trả bộ đếm lại để lần sau ghi tiếp
+            self.errors += 1
+            logger.error("Lỗi ghi usage rollup: %s", e)
+            for key, counter in pending.items():
+                target = self._counter(counter["houseId"], *key)
+                for c in COUNTERS:
+                    target[c] += counter[c]
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_seconds)
+            await self.flush()
+
+    def start(self):
+        self.task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            self.task = None
+        await self.flush()
+
+    def stats(self):
+        return {
+            "trackedEndpoints": len(self.state),
+            "pendingBuckets": len(self.pending),
+            "flushes": self.flushes,
+            "errors": self.errors
+        }
+
+
+usage = UsageAggregator(USAGE_FLUSH_SECONDS)
+
+
+# Thiết bị xóa / đổi danh sách endpoint ở replica khác
+@bus.on("devices")
+def _on_device_change(event):
+    if event.op == "delete":
+        usage.forget_devices([event.id])
+    elif "endpoints" in event.fields or event.op == "replace":
+        bus.spawn(usage.sync_device(event.id))
+
+
+# Đọc rollup đã lưu, gộp theo endpoint. query: điều kiện theo houseId hoặc deviceId
+async def get_usage(query: dict, period: str, start: str, end: str):
+    query = {**query, "period": period, "bucket": {"$gte": start, "$lte": end}}
+    projection = {"_id": 0, "deviceId": 1, "endpointId": 1, "bucket": 1, **{c: 1 for c in COUNTERS}}
+    rows = await db.usage_rollups.find(query, projection).sort("bucket", 1).to_list(length=None)
+
+    endpoints = {}
+    for row in rows:
+        key = (row["deviceId"], row["endpointId"])
+        entry = endpoints.get(key)
+        if entry is None:
+            entry = endpoints[key] = {
+                "deviceId": row["deviceId"],
+                "endpointId": row["endpointId"],
+                **{c: 0 for c in COUNTERS},
+                "buckets": []
+            }
+        for c in COUNTERS:
+            entry[c] += row.get(c, 0)
+        entry["buckets"].append({"bucket": row["bucket"], **{c: row.get(c, 0) for c in COUNTERS}})
+
+    for entry in endpoints.values():
+        entry["onSeconds"] = round(entry["onSeconds"], 1)
+    return {"period": period, "from": start, "to": end, "endpoints": list(endpoints.values())}
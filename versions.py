@@ -0,0 +1,64 @@
+import hashlib
+from typing import Optional
+from bson import ObjectId
+from fastapi import HTTPException, Request, Response
+from pymongo import ReturnDocument
+from database import db
+
+
+# Mỗi nhà có 1 số phiên bản tăng dần (houses.version), tăng mỗi khi dữ liệu trong nhà thay đổi
+# (nhà, phòng, thiết bị, trạng thái endpoint, thành viên). Trả về phiên bản mới.
+async def bump_house_version(house_id: str) -> int:
+    doc = await db.houses.find_one_and_update(
+        {"_id": ObjectId(house_id)},
+        {"$inc": {"version": 1}},
+        projection={"version": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    return doc["version"] if doc else 0
+
+
+# Tăng phiên bản nhiều nhà cùng lúc (ví dụ khi thông tin 1 user hiển thị ở nhiều nhà thay đổi)
+async def bump_house_versions(house_ids):
+    if house_ids:
+        await db.houses.update_many(
+            {"_id": {"$in": [ObjectId(h) for h in house_ids]}},
+            {"$inc": {"version": 1}}
+        )
+
+
+# Đọc phiên bản hiện tại của nhà (None nếu nhà không tồn tại)
+async def get_house_version(house_id: str) -> Optional[int]:
+    doc = await db.houses.find_one({"_id": ObjectId(house_id)}, {"version": 1})
+    if doc is None:
+        return None
+    return doc.get("version", 0)
+
+
+# ETag yếu từ phiên bản nhà, parts phân biệt loại dữ liệu / tham số (ví dụ "devices", cursor, limit)
+def house_etag(house_id: str, version: int, *parts) -> str:
+    suffix = hashlib.sha1(repr(parts).encode()).hexdigest()[:12]
+    return f'W/"{house_id}-{version}-{suffix}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    # So sánh yếu: bỏ tiền tố W/ ở cả 2 phía
+    candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in candidates or etag.removeprefix("W/") in candidates
+
+
+# GET có điều kiện theo phiên bản nhà: trả về response 304 nếu client đã có bản mới nhất,
+# ngược lại gắn ETag vào response và trả về None để handler tiếp tục query
+async def check_not_modified(request: Request, response: Response, house_id: str, *parts):
+    version = await get_house_version(house_id)
+    if version is None:
+        raise HTTPException(status_code=404, detail="Nhà không tồn tại")
+
+    etag = house_etag(house_id, version, *parts)
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag})
+
+    response.headers["ETag"] = etag
+    return None
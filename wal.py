@@ -0,0 +1,217 @@
+import logging
+import asyncio
+import json
+import os
+import time
+from pymongo.errors import PyMongoError
+from dotenv import load_dotenv
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# Thư mục chứa log ghi trước (write-ahead log) của ingest
+INGEST_WAL_DIR = os.getenv("INGEST_WAL_DIR", "ingest-wal")
+# Kích thước 1 segment, đầy thì mở segment mới
+INGEST_WAL_SEGMENT_BYTES = int(os.getenv("INGEST_WAL_SEGMENT_BYTES", 4 * 1024 * 1024))
+# Tổng dung lượng tối đa, vượt thì bỏ segment cũ nhất (có thể vượt thêm tối đa 1 segment)
+INGEST_WAL_MAX_BYTES = int(os.getenv("INGEST_WAL_MAX_BYTES", 512 * 1024 * 1024))
+# Gom bản ghi rồi ghi + fsync 1 lần sau mỗi n ms (bản ghi trong khoảng này có thể mất nếu process chết)
+INGEST_WAL_FSYNC_MS = int(os.getenv("INGEST_WAL_FSYNC_MS", 50))
+# Số bản ghi replay tối đa mỗi giây khi MongoDB hoạt động lại (0 = không giới hạn)
+INGEST_WAL_REPLAY_RATE = float(os.getenv("INGEST_WAL_REPLAY_RATE", 500))
+
+
+def _write(path: str, lines):
+    with open(path, "ab") as f:
+        f.write(b"".join(lines))
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _read(path: str):
+    with open(path, "rb") as f:
+        return f.read().splitlines()
+
+
+def _count_lines(path: str) -> int:
+    with open(path, "rb") as f:
+        return sum(1 for _ in f)
+
+
+# Log chỉ ghi nối, chia segment "<seq>.log" (mỗi dòng 1 JSON), replay theo đúng thứ tự ghi.
+# Replay chạy song song với ingest trực tiếp: bản ghi replay cũ hơn giá trị trong DB sẽ tự bị bỏ qua
+class WriteAheadLog:
+    def __init__(self, directory: str, segment_bytes: int, max_bytes: int, fsync_ms: int, replay_rate: float):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max(max_bytes, 2 * segment_bytes)
+        self.fsync_ms = fsync_ms
+        self.replay_rate = replay_rate
+
+        # Segment đã đóng, chờ replay (cũ nhất trước)
+        self.segments = []
+        self.current = 1
+        self.current_bytes = 0
+        self.current_records = 0
+        self.total_bytes = 0
+        self.buffer = []
+        self.lock = asyncio.Lock()
+        self.wakeup = asyncio.Event()
+        self.tasks = []
+
+        # True khi còn bản ghi chưa replay
+        self.active = False
+        self.appended = 0
+        self.replayed = 0
+        self.dropped = 0
+        self.corrupt = 0
+
+    def _path(self, seq: int) -> str:
+        return os.path.join(self.directory, f"{seq:012d}.log")
+
+    # Đọc các segment còn lại từ lần chạy trước (process chết khi MongoDB đang lỗi)
+    async def open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        seqs = sorted(int(name[:-4]) for name in os.listdir(self.directory) if name.endswith(".log"))
+        self.segments = seqs
+        self.current = (seqs[-1] + 1) if seqs else 1
+        self.total_bytes = sum(os.path.getsize(self._path(s)) for s in seqs)
+        self.active = self.total_bytes > 0
+        if self.active:
+            logger.warning("WAL: còn %d segment (%d bytes) chưa replay", len(seqs), self.total_bytes)
+
+    # Không await: chỉ đưa vào buffer, task nền ghi + fsync theo lô
+    def append(self, record: dict):
+        line = (json.dumps(record, separators=(",", ":")) + "\n").encode()
+        self.buffer.append(line)
+        self.current_bytes += len(line)
+        self.current_records += 1
+        self.total_bytes += len(line)
+        self.appended += 1
+        self.active = True
+        self.wakeup.set()
+
+    async def _flush_locked(self):
+        lines, self.buffer = self.buffer, []
+        if lines:
+            await asyncio.to_thread(_write, self._path(self.current), lines)
+
+    async def flush(self):
+        async with self.lock:
+            await self._flush_locked()
+
+    # Đóng segment hiện tại (để replay) và mở segment mới
+    async def rotate(self):
+        async with self.lock:
+            await self._flush_locked()
+            if self.current_records:
+                self.segments.append(self.current)
+                self.current += 1
+                self.current_bytes = 0
+                self.current_records = 0
+
+    # Vượt dung lượng -> bỏ segment cũ nhất chưa replay
+    async def _enforce_budget(self):
+        while self.total_bytes > self.max_bytes and self.segments:
+            seq = self.segments.pop(0)
+            path = self._path(seq)
+            size = os.path.getsize(path)
+            self.dropped += await asyncio.to_thread(_count_lines, path)
+            os.remove(path)
+            self.total_bytes -= size
+            logger.error("WAL: vượt %d bytes, bỏ segment %s", self.max_bytes, seq)
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.fsync_ms / 1000)
+            if self.buffer:
+                await self.flush()
+            if self.current_bytes >= self.segment_bytes:
+                await self.rotate()
+                await self._enforce_budget()
+
+    # Replay lần lượt từng segment; apply lỗi (MongoDB vẫn chưa lên) thì chờ rồi thử lại bản ghi đó
+    async def _replay_loop(self, apply):
+        while True:
+            if not self.segments:
+                if not self.current_records:
+                    # Đã replay hết
+                    self.active = False
+                    self.wakeup.clear()
+                    await self.wakeup.wait()
+                    continue
+                await self.rotate()
+
+            seq = self.segments.pop(0)
+            path = self._path(seq)
+            size = os.path.getsize(path)
+            interval = 1 / self.replay_rate if self.replay_rate else 0
+            next_at = time.monotonic()
+            for line in await asyncio.to_thread(_read, path):
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Dòng cuối bị ghi dở khi process chết
+                    self.corrupt += 1
+                    continue
+
+                backoff = 0.5
+                while True:
+                    try:
+                        await apply(record)
+                        self.replayed += 1
+                        break
+                    except (PyMongoError, asyncio.TimeoutError) as e:
+                        logger.warning("WAL: replay lỗi, thử lại sau %ss (%s)", backoff, e)
+                        await asyncio.sleep(backoff)
+                        backoff = min(backoff * 2, 10)
+                    except Exception as e:
+                        # Bản ghi không áp dụng được (không phải lỗi DB) -> bỏ qua
+                        logger.error("WAL: bỏ bản ghi lỗi %s: %s", record, e)
+                        self.corrupt += 1
+                        break
+
+                if interval:
+                    next_at += interval
+                    delay = next_at - time.monotonic()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                    elif delay < -1:
+                        # Vừa chờ DB lâu -> không replay dồn để bù
+                        next_at = time.monotonic()
+
+            os.remove(path)
+            self.total_bytes -= size
+
+    def start(self, apply):
+        self.tasks = [asyncio.create_task(self._flush_loop()), asyncio.create_task(self._replay_loop(apply))]
+
+    async def close(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        await self.flush()
+
+    def stats(self):
+        return {
+            "active": self.active,
+            "segments": len(self.segments) + (1 if self.current_records else 0),
+            "bytes": self.total_bytes,
+            "maxBytes": self.max_bytes,
+            "pendingFsync": len(self.buffer),
+            "appended": self.appended,
+            "replayed": self.replayed,
+            "dropped": self.dropped,
+            "corrupt": self.corrupt
+        }
+
+
+wal = WriteAheadLog(
+    INGEST_WAL_DIR,
+    INGEST_WAL_SEGMENT_BYTES,
+    INGEST_WAL_MAX_BYTES,
+    INGEST_WAL_FSYNC_MS,
+    INGEST_WAL_REPLAY_RATE
+)